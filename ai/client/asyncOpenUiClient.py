@@ -0,0 +1,418 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+
+from client.batching import batch_complete, batch_messages, commit_id, pack_batches, parse_batch_answer
+from client.knowledgeCache import KnowledgeCache, get_knowledge_cache
+from client.openUiClient import read_knowledge_files
+from client.prompts import (CLASSIFICATION_TEMPLATE, LAYOUTS, QUALITY_TEMPLATE, PromptTemplate, build_classification_prompt,
+                            build_quality_prompt, commit_data, quality_payload)
+from client.rateLimiter import CircuitOpenError, RateLimiter, parse_retry_after
+from client.responseCache import ResponseCache
+from client.streamParser import Completion, classification_complete, completion_body, quality_complete, read_stream_async
+
+@dataclass
+class ChatResult:
+    """
+    The outcome of one chat completion made for a commit.
+
+    Attributes:
+        commit (dict): The commit the request was made for.
+        model (str): The model that was queried.
+        response (Optional[str]): The content of the model's answer, None if the request failed.
+        status (Optional[int]): The HTTP status code, None if no response was received.
+        error (Optional[str]): The error that made the request fail.
+        elapsed (float): The seconds spent waiting for the last response.
+        attempts (int): The number of times the request was sent.
+        cached (bool): Whether the response came from the response cache.
+        stopped_early (bool): Whether the streamed answer was left as soon as it was complete.
+    """
+    commit: dict
+    model: str
+    response: Optional[str] = None
+    status: Optional[int] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    attempts: int = 0
+    cached: bool = False
+    stopped_early: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.response is not None
+
+    def as_output(self) -> dict:
+        """
+        Returns the result in the format the notebooks save to the evaluation files.
+
+        Returns:
+            dict: The 'model', 'sha', 'link' and 'response' of the result.
+        """
+        return {
+            'model': self.model,
+            'sha': self.commit.get('sha', ''),
+            'link': self.commit.get('link', ''),
+            'response': self.response,
+        }
+
+class AsyncOpenUiClient:
+    """
+    An asyncio variant of `OpenUiClient` that sends many chat completions at once over a
+    pooled keep-alive HTTP session.
+
+    Use it as an async context manager, e.g. in a notebook cell:
+
+        async with AsyncOpenUiClient(concurrency=8) as client:
+            async for result in client.evaluate_many(commits, knowledge_files, model='llama3:8b'):
+                responses.append(result.as_output())
+    """
+    # Load environment variables from env file
+    load_dotenv()
+
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None, concurrency: int = 8, timeout: float = 300.0,
+                 rate_limiter: Optional[RateLimiter] = None, knowledge_cache: Optional[KnowledgeCache] = None,
+                 response_cache: Optional[ResponseCache] = None, prompt_layout: str = 'legacy',
+                 classification_template: PromptTemplate = CLASSIFICATION_TEMPLATE, quality_template: PromptTemplate = QUALITY_TEMPLATE,
+                 stream: bool = False):
+        """
+        Constructor for the AsyncOpenUiClient class.
+
+        Args:
+            api_url (Optional[str]): The base URL of the API. Defaults to the value from the environment variable.
+            api_key (Optional[str]): The API key for authentication. Defaults to the value from the environment variable.
+            concurrency (int): The maximum number of requests in flight, which is also the size of the connection pool.
+            timeout (float): The seconds after which a request is abandoned.
+            rate_limiter (Optional[RateLimiter]): Adapts the requests in flight (up to `concurrency`) to the load of the
+                server and retries failed ones. Defaults to a `RateLimiter` with its default settings.
+            knowledge_cache (Optional[KnowledgeCache]): Where the knowledge files are read through. Defaults to the process-wide cache.
+            response_cache (Optional[ResponseCache]): Answers repeated chat requests without querying the model. Disabled if None.
+            prompt_layout (str): 'prefix' to send the guidelines in a leading message shared by every commit (see
+                `PromptTemplate`), 'legacy' to send the single user message of earlier runs. Defaults to 'legacy',
+                so new runs stay comparable with the recorded outputs unless the layout is chosen explicitly.
+            classification_template (PromptTemplate): The template of `classify` with the 'prefix' layout.
+            quality_template (PromptTemplate): The template of `evaluate` with the 'prefix' layout.
+            stream (bool): Whether answers are streamed, so the stream can be closed as soon as the expected
+                fields have been received instead of waiting for the trailing tokens of the model.
+        """
+        if prompt_layout not in LAYOUTS:
+            raise ValueError(f"Unknown prompt layout {prompt_layout}, expected one of {LAYOUTS}.")
+        self.api_url = api_url or self.__getEnv("API_URL", "API URL")
+        self.api_key = api_key or self.__getEnv("OPEN_WEB_UI_API_KEY", "API key")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter(max_concurrency=concurrency)
+        self.knowledge_cache = knowledge_cache or get_knowledge_cache()
+        self.response_cache = response_cache
+        self.prompt_layout = prompt_layout
+        self.classification_template = classification_template
+        self.quality_template = quality_template
+        self.stream = stream
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def __getEnv(self, variable: str, description: str) -> str:
+        """
+        Retrieves a setting from environment variables (private method).
+
+        Returns:
+            str: The value of the variable.
+        """
+        value = (os.getenv(variable) or '').strip('"')
+        if not value:
+            raise ValueError(f"{description} is not set in the environment variables.")
+        return value
+
+    async def __aenter__(self) -> 'AsyncOpenUiClient':
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    'Authorization': f'Bearer {self.api_key}',
+                    'Content-Type': 'application/json'
+                }
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Closes the HTTP session and its pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def chat(self, content: str, model: str = 'llama3:8b', commit: Optional[dict] = None) -> ChatResult:
+        """
+        Sends a single user message to the specified model, see `chat_messages`.
+
+        Args:
+            content (str): The message content to send to the model.
+            model (str): The model to interact with (default is 'llama3:8b').
+            commit (Optional[dict]): The commit the message is about, kept in the result.
+
+        Returns:
+            ChatResult: The answer of the model, or the last error.
+        """
+        return await self.chat_messages([{'role': 'user', 'content': content}], model, commit)
+
+    async def chat_messages(self, messages: List[dict], model: str = 'llama3:8b', commit: Optional[dict] = None,
+                            is_complete: Optional[Completion] = None) -> ChatResult:
+        """
+        Sends chat messages to the specified model through the rate limiter, retrying timeouts,
+        connection errors, 429 and 5xx answers with jittered exponential backoff. Errors are
+        returned in the result instead of being raised, so one failed commit does not stop a batch.
+        When streaming, the answer is read until `is_complete` recognizes it or the stream ends.
+
+        Args:
+            messages (List[dict]): The messages to send to the model.
+            model (str): The model to interact with (default is 'llama3:8b').
+            commit (Optional[dict]): The commit the messages are about, kept in the result.
+            is_complete (Optional[Completion]): Recognizes a complete streamed answer.
+
+        Returns:
+            ChatResult: The answer of the model, or the last error.
+        """
+        result = ChatResult(commit if commit is not None else {}, model)
+        data = {
+            'model': model,
+            'messages': messages
+        }
+        if self.response_cache is not None:
+            cached = self.response_cache.get(data)
+            if cached is not None:
+                try:
+                    result.response = cached['choices'][0]['message']['content']
+                    result.status = 200
+                    result.cached = True
+                    return result
+                except (KeyError, IndexError, TypeError):
+                    pass
+
+        if self.stream:
+            data = {**data, 'stream': True}
+        retry = self.rate_limiter.retry
+        for attempt in range(retry.max_attempts):
+            result.attempts = attempt + 1
+            try:
+                ticket = await self.rate_limiter.acquire_async(model)
+            except CircuitOpenError as e:
+                result.error = str(e)
+                if attempt + 1 >= retry.max_attempts:
+                    break
+                await asyncio.sleep(min(e.retry_in, retry.max_delay))
+                continue
+
+            result.status = None
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                async with self._get_session().post(f'{self.api_url}/chat/completions', json=data) as response:
+                    result.status = response.status
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    response.raise_for_status()
+                    if self.stream:
+                        text, result.stopped_early = await read_stream_async(response.content, is_complete)
+                        # Closing rather than releasing the connection tells the server to stop generating
+                        response.close()
+                        body = completion_body(text, model, result.stopped_early)
+                    else:
+                        body = await response.json(content_type=None)
+                    result.response = body['choices'][0]['message']['content']
+                    result.error = None
+                    if self.response_cache is not None and not result.stopped_early:
+                        self.response_cache.put(data, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result.error = f"Error performing the chat. Details: {e!r}"
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                result.error = f"Error processing the chat response. Details: {e!r}"
+            except BaseException:
+                self.rate_limiter.cancel(ticket)
+                raise
+            result.elapsed = time.perf_counter() - start
+            self.rate_limiter.release(ticket, result.status, retry_after)
+
+            if result.ok or not retry.should_retry(result.status, attempt):
+                break
+            await asyncio.sleep(retry.delay(attempt, retry_after))
+        return result
+
+    async def classify(self, commit: dict, knowledge: Optional[str] = None, model: str = 'llama3:8b') -> ChatResult:
+        """
+        Classifies the maintenance type of a commit, like `OpenUiClient.chatWithModel`.
+
+        Args:
+            commit (dict): The commit, with its 'message' and 'files'.
+            knowledge (Optional[str]): The text of the guidelines (not its path).
+            model (str): The model to interact with (default is 'llama3:8b').
+
+        Returns:
+            ChatResult: The answer of the model, or the error.
+        """
+        if knowledge is not None and self.prompt_layout == 'prefix':
+            messages = self.classification_template.messages(knowledge, commit_data(commit))
+        else:
+            messages = [{'role': 'user', 'content': build_classification_prompt(knowledge, commit_data(commit))}]
+        return await self.chat_messages(messages, model, commit, classification_complete if knowledge is not None else None)
+
+    async def evaluate(self, commit: dict, knowledge: Optional[str] = None, model: str = 'llama3:8b') -> ChatResult:
+        """
+        Evaluates the quality of a commit message, like `OpenUiClient.evaluateCommitQualityChatWithModel`.
+
+        Args:
+            commit (dict): The commit, with its 'message' and 'files_changed'.
+            knowledge (Optional[str]): The text of the guidelines (see `read_knowledge_files`).
+            model (str): The model to interact with (default is 'llama3:8b').
+
+        Returns:
+            ChatResult: The answer of the model, or the error.
+        """
+        if knowledge is not None and self.prompt_layout == 'prefix':
+            payload = quality_payload(commit.get('message', ''), commit.get('files_changed'))
+            messages = self.quality_template.messages(knowledge, payload)
+        else:
+            messages = [{'role': 'user', 'content': build_quality_prompt(knowledge, commit.get('message', ''), commit.get('files_changed'))}]
+        return await self.chat_messages(messages, model, commit, quality_complete if knowledge is not None else None)
+
+    async def _run_many(self, commits: Iterable[dict], request: Callable[[dict], Awaitable[ChatResult]]) -> AsyncIterator[ChatResult]:
+        """
+        Runs a request per commit with at most `concurrency` of them started (the rate
+        limiter decides how many are actually in flight), yielding the results as they complete. Commits are read from the iterable only when a slot
+        frees up, so it can be a generator over a large file.
+        """
+        commits = iter(commits)
+        pending = set()
+        exhausted = False
+
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) < self.concurrency:
+                commit = next(commits, None)
+                if commit is None:
+                    exhausted = True
+                    return
+                pending.add(asyncio.ensure_future(request(commit)))
+
+        fill()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                fill()
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def classify_many(self, commits: Iterable[dict], knowledge: Optional[str] = None, model: str = 'llama3:8b') -> AsyncIterator[ChatResult]:
+        """
+        Classifies the maintenance type of many commits concurrently.
+
+        Args:
+            commits (Iterable[dict]): The commits, with their 'message' and 'files'.
+            knowledge (Optional[str]): Path to the text file with the guidelines, read once for every commit.
+            model (str): The model to interact with (default is 'llama3:8b').
+
+        Yields:
+            ChatResult: The result of each commit, in completion order.
+        """
+        knowledge_text = self.knowledge_cache.get(knowledge) if knowledge else None
+
+        async for result in self._run_many(commits, lambda commit: self.classify(commit, knowledge_text, model)):
+            yield result
+
+    async def _classify_batch(self, batch: List[Tuple[int, dict]], knowledge: Optional[str], model: str) -> List[ChatResult]:
+        """
+        Classifies a batch of commits with one request, then the commits missing from its
+        answer one by one.
+        """
+        classifications = {}
+        batch_result = None
+        if len(batch) > 1:
+            batch_result = await self.chat_messages(batch_messages(batch, knowledge), model, {}, batch_complete)
+            if batch_result.ok:
+                classifications = parse_batch_answer(batch_result.response, [commit_id(commit, index) for index, commit in batch])
+
+        async def classify_one(index: int, commit: dict) -> ChatResult:
+            classification = classifications.get(commit_id(commit, index))
+            if classification is None:
+                return await self.classify(commit, knowledge, model)
+            return replace(batch_result, commit=commit, response=classification)
+
+        return list(await asyncio.gather(*(classify_one(index, commit) for index, commit in batch)))
+
+    async def classify_batched(self, commits: Iterable[dict], knowledge: Optional[str] = None, model: str = 'llama3:8b',
+                               context_budget: int = 8192, max_batch: int = 16) -> AsyncIterator[ChatResult]:
+        """
+        Classifies many commits concurrently, several per request: the commits are packed into
+        batches that fit the context budget (see `pack_batches`) and the model answers each batch
+        with a JSON array of classifications keyed by SHA. The commits whose entry is missing or
+        malformed, and those of a failed batch, are classified again one by one with `classify`.
+
+        Args:
+            commits (Iterable[dict]): The commits, with their 'sha', 'message' and 'files'.
+            knowledge (Optional[str]): Path to the text file with the guidelines, sent once per batch.
+            model (str): The model to interact with (default is 'llama3:8b').
+            context_budget (int): The tokens a request may take, answer included.
+            max_batch (int): The commits per request at most.
+
+        Yields:
+            ChatResult: The result of each commit, batch by batch in completion order. The response
+            has the format of the answers of `classify`.
+        """
+        knowledge_text = self.knowledge_cache.get(knowledge) if knowledge else None
+        batches = pack_batches(commits, knowledge_text, context_budget, max_batch)
+
+        async for results in self._run_many(batches, lambda batch: self._classify_batch(batch, knowledge_text, model)):
+            for result in results:
+                yield result
+
+    async def evaluate_many(self, commits: Iterable[dict], knowledge_files: Optional[List[str]] = None, model: str = 'llama3:8b') -> AsyncIterator[ChatResult]:
+        """
+        Evaluates the quality of many commit messages concurrently.
+
+        Args:
+            commits (Iterable[dict]): The commits, with their 'message' and 'files_changed'.
+            knowledge_files (Optional[List[str]]): Paths to the PDFs with the guidelines, read once for every commit.
+            model (str): The model to interact with (default is 'llama3:8b').
+
+        Yields:
+            ChatResult: The result of each commit, in completion order.
+        """
+        knowledge_text = read_knowledge_files(knowledge_files, self.knowledge_cache) if knowledge_files else None
+
+        async for result in self._run_many(commits, lambda commit: self.evaluate(commit, knowledge_text, model)):
+            yield result
+
+    async def getAvailableApiModels(self) -> Optional[list]:
+        """
+        Fetches the list of available model IDs from the API.
+
+        Returns:
+            Optional[list]: A list of model IDs if successful, None otherwise.
+        """
+        try:
+            async with self._get_session().get(f'{self.api_url}/models') as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+            return [model['id'] for model in data.get('data', []) if 'id' in model]
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching available models. Details: {e}")
+            return None
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Error processing the available models response. Details: {e}")
+            return None
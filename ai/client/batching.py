@@ -0,0 +1,146 @@
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from client.prompts import BATCH_CLASSIFICATION_TEMPLATE, commit_data
+
+MODIFICATION_REQUESTS = ('correction', 'enhancement')
+MAINTENANCE_TYPES = ('corrective', 'adaptive', 'preventive', 'perfective', 'additive')
+
+# Rough size of a token in characters, for budgeting prompts without the model's tokenizer
+CHARS_PER_TOKEN = 4
+# Tokens reserved for the answer of each commit of a batch
+ANSWER_TOKENS_PER_COMMIT = 48
+# Shortest SHA prefix accepted when the model abbreviates a SHA
+MIN_SHA_PREFIX = 7
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text from its length.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def commit_id(commit: dict, index: int) -> str:
+    """
+    Returns the identifier of a commit in a batch: its SHA, or its position if it has none.
+    """
+    return commit.get('sha') or f'commit-{index}'
+
+def commit_section(commit: dict, index: int) -> str:
+    """
+    Formats a commit of a batch: a header with its identifier, then its commit data.
+    """
+    return f"=== Commit {commit_id(commit, index)} ===\n{commit_data(commit)}\n"
+
+def pack_batches(commits: Iterable[dict], knowledge: Optional[str], context_budget: int = 8192,
+                 max_batch: int = 16) -> Iterator[List[Tuple[int, dict]]]:
+    """
+    Groups commits into batches whose prompt and answers fit the context budget of the
+    model. Commits are packed greedily in their order; a commit too large to share the
+    budget with others forms a batch of its own. The commits are read lazily.
+
+    Args:
+        commits (Iterable[dict]): The commits, with their 'sha', 'message' and 'files'.
+        knowledge (Optional[str]): The text of the guidelines, sent once per batch.
+        context_budget (int): The tokens a batch may take, prompt and answer included.
+        max_batch (int): The commits per batch at most.
+
+    Yields:
+        List[Tuple[int, dict]]: The position and the commit of each commit of a batch.
+    """
+    shared = estimate_tokens(BATCH_CLASSIFICATION_TEMPLATE.prefix(knowledge))
+    batch, used = [], shared
+    for index, commit in enumerate(commits):
+        cost = estimate_tokens(commit_section(commit, index)) + ANSWER_TOKENS_PER_COMMIT
+        if batch and (used + cost > context_budget or len(batch) >= max_batch):
+            yield batch
+            batch, used = [], shared
+        batch.append((index, commit))
+        used += cost
+    if batch:
+        yield batch
+
+def batch_messages(batch: List[Tuple[int, dict]], knowledge: Optional[str]) -> List[dict]:
+    """
+    Builds the messages of the classification request of a batch.
+
+    Args:
+        batch (List[Tuple[int, dict]]): The position and the commit of each commit, as yielded by `pack_batches`.
+        knowledge (Optional[str]): The text of the guidelines.
+
+    Returns:
+        List[dict]: The shared message with the guidelines, then the commits.
+    """
+    return BATCH_CLASSIFICATION_TEMPLATE.messages(knowledge, '\n'.join(commit_section(commit, index) for index, commit in batch))
+
+def format_classification(modification_request: str, maintenance_type: str) -> str:
+    """
+    Formats a classification like the answer to a single-commit prompt, so batched and
+    single results are parsed the same way.
+    """
+    return f"Modification Request Classification: {modification_request}\nMaintenance Type: {maintenance_type}\n"
+
+def _find_array(answer: str) -> list:
+    """Returns the first JSON array of an answer, ignoring code fences and surrounding text."""
+    start = answer.find('[')
+    while start != -1:
+        try:
+            value, _ = json.JSONDecoder().raw_decode(answer, start)
+            if isinstance(value, list):
+                return value
+        except ValueError:
+            pass
+        start = answer.find('[', start + 1)
+    return []
+
+def batch_complete(text: str) -> bool:
+    """
+    Tells whether the answer to a batch received so far holds a closed JSON array, so a
+    streamed answer can be left before the model comments on it.
+    """
+    return bool(_find_array(text))
+
+def _match_id(sha: str, ids: List[str]) -> Optional[str]:
+    if sha in ids:
+        return sha
+    if len(sha) >= MIN_SHA_PREFIX:
+        matches = [candidate for candidate in ids if candidate.startswith(sha)]
+        if len(matches) == 1:
+            return matches[0]
+    return None
+
+def parse_batch_answer(answer: str, ids: List[str]) -> Dict[str, str]:
+    """
+    Extracts the classification of each commit from the answer to a batch. Entries are
+    matched by SHA (an unambiguous abbreviation is accepted), never by position, so a
+    skipped or reordered entry cannot shift the others. Entries with an unknown SHA, a
+    value outside the allowed keywords, or a SHA already classified differently are dropped.
+
+    Args:
+        answer (str): The content of the model's answer.
+        ids (List[str]): The identifiers of the commits of the batch.
+
+    Returns:
+        Dict[str, str]: The classification of each commit found, formatted by `format_classification`.
+    """
+    classifications: Dict[str, str] = {}
+    conflicting = set()
+    for entry in _find_array(answer):
+        if not isinstance(entry, dict):
+            continue
+        matched = _match_id(str(entry.get('sha', '')).strip(), ids)
+        modification_request = str(entry.get('modification_request', '')).strip().lower()
+        maintenance_type = str(entry.get('maintenance_type', '')).strip().lower()
+        if matched is None or modification_request not in MODIFICATION_REQUESTS or maintenance_type not in MAINTENANCE_TYPES:
+            continue
+        classification = format_classification(modification_request, maintenance_type)
+        if classifications.setdefault(matched, classification) != classification:
+            conflicting.add(matched)
+    for matched in conflicting:
+        del classifications[matched]
+    return classifications
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import fitz
+
+# Bumped whenever the extraction changes, so texts extracted by an older version are redone
+EXTRACTOR_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'knowledge', '.cache')
+
+def extract_text(file_path: str) -> str:
+    """
+    Extracts the full text of a knowledge document: the text of every page for a PDF,
+    the content of the file otherwise.
+
+    Args:
+        file_path (str): Path to the document.
+
+    Returns:
+        str: The text of the document.
+    """
+    if file_path.lower().endswith('.pdf'):
+        with fitz.open(file_path) as doc:
+            return "\n".join(page.get_text() for page in doc)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+class KnowledgeCache:
+    """
+    A two-level cache of the text extracted from the knowledge documents. Entries are keyed
+    by the absolute path, modification time and size of the document, so editing or
+    replacing a document invalidates its text.
+
+    The first level is an in-process LRU of `maxsize` texts; the second one is a directory
+    with one file per document, so the PDFs are parsed once per machine rather than once
+    per run. Concurrent requests for the same document share a single extraction.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = DEFAULT_CACHE_DIR, maxsize: int = 32, max_workers: int = 4):
+        """
+        Constructor for the KnowledgeCache class.
+
+        Args:
+            cache_dir (Optional[str]): The directory of the on-disk layer, None to keep the texts in memory only.
+            maxsize (int): The number of texts kept in memory.
+            max_workers (int): The number of documents extracted in parallel by `get_many` and `prefetch`.
+        """
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self.max_workers = max_workers
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'extractions': 0}
+        self._memory: OrderedDict = OrderedDict()
+        self._pending: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def _key(file_path: str) -> Tuple[str, int, int]:
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        return file_path, stat.st_mtime_ns, stat.st_size
+
+    def _disk_path(self, file_path: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(file_path.encode('utf-8')).hexdigest() + '.txt')
+
+    def _read_disk(self, key: Tuple[str, int, int]) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key[0]), 'r', encoding='utf-8', newline='') as file:
+                header = json.loads(file.readline())
+                if (header.get('path'), header.get('mtime_ns'), header.get('size'), header.get('version')) != (*key, EXTRACTOR_VERSION):
+                    return None
+                return file.read()
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: Tuple[str, int, int], text: str) -> None:
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        disk_path = self._disk_path(key[0])
+        tmp_path = f'{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        header = {'path': key[0], 'mtime_ns': key[1], 'size': key[2], 'version': EXTRACTOR_VERSION}
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+            file.write(json.dumps(header) + '\n')
+            file.write(text)
+        os.replace(tmp_path, disk_path)
+
+    def _remember(self, key: Tuple[str, int, int], text: str) -> None:
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, file_path: str) -> str:
+        """
+        Returns the text of a knowledge document, extracting it only if no layer has it.
+
+        Args:
+            file_path (str): Path to the document.
+
+        Returns:
+            str: The text of the document.
+
+        Raises:
+            FileNotFoundError: If the document does not exist.
+        """
+        key = self._key(file_path)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self._memory[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            text = self._read_disk(key)
+            if text is not None:
+                self.stats['disk_hits'] += 1
+            else:
+                text = extract_text(key[0])
+                self.stats['extractions'] += 1
+                self._write_disk(key, text)
+            with self._lock:
+                self._remember(key, text)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='knowledge')
+            return self._executor
+
+    def prefetch(self, file_paths: List[str]) -> List[Future]:
+        """
+        Starts loading documents in the background, e.g. while the first requests are prepared.
+
+        Args:
+            file_paths (List[str]): Paths to the documents.
+
+        Returns:
+            List[Future]: One future per document, resolving to its text.
+        """
+        executor = self._get_executor()
+        return [executor.submit(self.get, file_path) for file_path in file_paths]
+
+    def get_many(self, file_paths: List[str]) -> List[str]:
+        """
+        Returns the texts of several documents, extracting the missing ones in parallel.
+
+        Args:
+            file_paths (List[str]): Paths to the documents.
+
+        Returns:
+            List[str]: The texts, in the order of `file_paths`.
+        """
+        if len(file_paths) <= 1:
+            return [self.get(file_path) for file_path in file_paths]
+        return [future.result() for future in self.prefetch(file_paths)]
+
+    def clear(self, disk: bool = False) -> None:
+        """
+        Forgets the texts kept in memory, and those on disk if `disk` is True.
+        """
+        with self._lock:
+            self._memory.clear()
+        if disk and self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.txt'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+_default_cache: Optional[KnowledgeCache] = None
+_default_cache_lock = threading.Lock()
+
+def get_knowledge_cache() -> KnowledgeCache:
+    """
+    Returns the process-wide cache used by the clients unless they are given their own.
+
+    Returns:
+        KnowledgeCache: The cache, created on first use in `DEFAULT_CACHE_DIR`.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = KnowledgeCache()
+        return _default_cache
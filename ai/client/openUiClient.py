@@ -1,9 +1,18 @@
 import os
+import time
 import requests
 from dotenv import load_dotenv
 from typing import Optional, List
 import fitz
 
+from client.batching import batch_complete, batch_messages, commit_id, pack_batches, parse_batch_answer
+from client.knowledgeCache import KnowledgeCache, get_knowledge_cache
+from client.prompts import (CLASSIFICATION_TEMPLATE, LAYOUTS, QUALITY_TEMPLATE, PromptTemplate, build_classification_prompt,
+                            build_quality_prompt, commit_data, quality_payload)
+from client.rateLimiter import CircuitOpenError, RateLimiter, parse_retry_after
+from client.responseCache import CachedResponse, ResponseCache
+from client.streamParser import Completion, StreamedResponse, classification_complete, completion_body, quality_complete, read_stream
+
 def read_pdf_text(pdf_path: str) -> str:
     """
     Extracts and returns the full text from a PDF file.
@@ -21,21 +30,67 @@ def read_pdf_text(pdf_path: str) -> str:
         print(f"Error reading PDF {pdf_path}: {e}")
         return ""
 
+def read_knowledge_files(knowledge_files: List[str], cache: Optional[KnowledgeCache] = None) -> str:
+    """
+    Concatenates the text of the PDF files with the commit quality guidelines. The texts come
+    from the knowledge cache, which extracts the files missing from it in parallel.
+
+    Args:
+        knowledge_files (List[str]): Paths to the PDF files.
+        cache (Optional[KnowledgeCache]): The cache to read through. Defaults to the process-wide one.
+
+    Returns:
+        str: The text of every file, each followed by a blank line.
+    """
+    cache = cache or get_knowledge_cache()
+    combined_knowledge = ""
+    for path, future in zip(knowledge_files, cache.prefetch(knowledge_files)):
+        try:
+            text = future.result()
+        except Exception as e:
+            print(f"Error reading PDF {path}: {e}")
+            text = ""
+        combined_knowledge += text.strip() + "\n\n"
+    return combined_knowledge
+
 class OpenUiClient:
     # Load environment variables from env file
     load_dotenv()
     
 
-    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None):
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None, rate_limiter: Optional[RateLimiter] = None,
+                 knowledge_cache: Optional[KnowledgeCache] = None, response_cache: Optional[ResponseCache] = None,
+                 prompt_layout: str = 'legacy', classification_template: PromptTemplate = CLASSIFICATION_TEMPLATE,
+                 quality_template: PromptTemplate = QUALITY_TEMPLATE, stream: bool = False):
         """
         Constructor for the OpenUiClient class.
 
         Args:
             api_url (Optional[str]): The base URL of the API. Defaults to the value from the environment variable.
             api_key (Optional[str]): The API key for authentication. Defaults to the value from the environment variable.
+            rate_limiter (Optional[RateLimiter]): Throttles and retries the chat requests. Defaults to a `RateLimiter` with its default settings.
+            knowledge_cache (Optional[KnowledgeCache]): Where the knowledge files are read through. Defaults to the process-wide cache.
+            response_cache (Optional[ResponseCache]): Answers repeated chat requests without querying the model. Disabled if None.
+            prompt_layout (str): 'prefix' to send the guidelines in a leading message shared by every commit (see
+                `PromptTemplate`), 'legacy' to send the single user message of earlier runs. Defaults to 'legacy',
+                so new runs stay comparable with the recorded outputs unless the layout is chosen explicitly.
+            classification_template (PromptTemplate): The template of `chatWithModel` with the 'prefix' layout.
+            quality_template (PromptTemplate): The template of `evaluateCommitQualityChatWithModel` with the 'prefix' layout.
+            stream (bool): Whether answers are streamed, so the stream can be closed as soon as the expected
+                fields have been received instead of waiting for the trailing tokens of the model.
         """
+        if prompt_layout not in LAYOUTS:
+            raise ValueError(f"Unknown prompt layout {prompt_layout}, expected one of {LAYOUTS}.")
         self.api_url = api_url or self.__getApiUrl()
         self.api_key = api_key or self.__getApiKey()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.knowledge_cache = knowledge_cache or get_knowledge_cache()
+        self.response_cache = response_cache
+        self.prompt_layout = prompt_layout
+        self.classification_template = classification_template
+        self.quality_template = quality_template
+        self.stream = stream
+        self.session = requests.Session()
 
     def __getApiUrl(self) -> str:
         """
@@ -61,6 +116,76 @@ class OpenUiClient:
             raise ValueError("API key is not set in the environment variables.")
         return api_key
  
+    def __postChat(self, headers: dict, data: dict, is_complete: Optional[Completion] = None) -> Optional[requests.Response]:
+        """
+        Sends a chat completion request through the rate limiter (private method). Timeouts,
+        connection errors, 429 and 5xx answers are retried with jittered exponential backoff;
+        a request that still fails, or is refused by an open circuit, is reported and None returned.
+        With a response cache, a request answered before returns a `CachedResponse` instead.
+        When streaming, the answer is returned as a `StreamedResponse`, read until `is_complete`
+        recognizes it or the stream ends.
+
+        Args:
+            headers (dict): The request headers.
+            data (dict): The request body.
+            is_complete (Optional[Completion]): Recognizes a complete streamed answer.
+
+        Returns:
+            Optional[requests.Response]: The API response object if successful, None otherwise.
+        """
+        if self.response_cache is not None:
+            cached = self.response_cache.get(data)
+            if cached is not None:
+                return CachedResponse(cached)
+
+        model = data['model']
+        if self.stream:
+            data = {**data, 'stream': True}
+        retry = self.rate_limiter.retry
+        error = None
+        for attempt in range(retry.max_attempts):
+            try:
+                ticket = self.rate_limiter.acquire(model)
+            except CircuitOpenError as e:
+                error = e
+                if attempt + 1 >= retry.max_attempts:
+                    break
+                time.sleep(min(e.retry_in, retry.max_delay))
+                continue
+
+            status = None
+            retry_after = None
+            try:
+                response = self.session.post(f'{self.api_url}/chat/completions', headers=headers, json=data, stream=self.stream)
+                status = response.status_code
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.raise_for_status()
+                stopped_early = False
+                if self.stream:
+                    with response:
+                        text, stopped_early = read_stream(response.iter_lines(), is_complete)
+                    response = StreamedResponse(completion_body(text, model, stopped_early), status, dict(response.headers), stopped_early)
+                self.rate_limiter.release(ticket, status, retry_after)
+                if self.response_cache is not None and not stopped_early:
+                    try:
+                        self.response_cache.put(data, response.json())
+                    except ValueError:
+                        pass
+                return response
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+            except BaseException:
+                self.rate_limiter.cancel(ticket)
+                raise
+            self.rate_limiter.release(ticket, status, retry_after)
+
+            if not retry.should_retry(status, attempt):
+                break
+            time.sleep(retry.delay(attempt, retry_after))
+
+        print(f"Error performing the chat. Details: {error}")
+        return None
+
     def simpleChatWithModel(self, content: Optional[str] = None, model: str = 'llama3:8b') -> Optional[requests.Response]:
         """
         Sends a simple chat message to the specified model and retrieves the response.
@@ -84,13 +209,7 @@ class OpenUiClient:
             'messages': [{'role': 'user', 'content': content}]
         }
         
-        try:
-            response = requests.post(f'{self.api_url}/chat/completions', headers=headers, json=data)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            print(f"Error performing the chat. Details: {e}")
-            return None
+        return self.__postChat(headers, data)
 
     def chatWithModel(self, knowledge: Optional[str] = None, commit_data: Optional[str] = None, content: Optional[str] = None, model: str = 'llama3:8b') -> Optional[requests.Response]:
         """
@@ -108,58 +227,84 @@ class OpenUiClient:
         file_content = ""
         if knowledge:
             try:
-                with open(knowledge, 'r', encoding='utf-8') as file:
-                    file_content = file.read()
+                file_content = self.knowledge_cache.get(knowledge)
             except FileNotFoundError:
                 print(f"File not found: {knowledge}")
                 return None
 
-        context_instructions = (
-            "You are an AI code assistant. Read and understand carefully guidelines about maintenance types and modification requests classification below.\n"
-            "Do not generate anything yet. Wait for further instructions after reading.\n\n"
-            "Guidelines:\n"
-        )
-
-        if content is None:
-            content = (
-                "Now read and understand carefully the following commit data which consists of its message and its code content. Do not generate anything yet.\n"
-                "Wait for further instructions after reading.\n\n"
-                "Commit data:"
-            )
-
-        finalContent = (
-            "Based solely on the guidelines and commit data provided earlier, respond using ONLY the format below.\n"
-            "Do NOT include any explanations, comments, or extra text. Do NOT change the format. Do NOT skip any lines.\n"
-            "Use ONLY one of the allowed keywords listed in angle brackets <>. Follow the exact format below:\n\n"
-            "Modification Request Classification: <correction | enhancement>\n"
-            "Maintenance Type: <corrective | adaptive | preventive | perfective | additive>\n"
-        )
-
-        
         headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
+        if knowledge and self.prompt_layout == 'prefix':
+            messages = self.classification_template.messages(file_content, commit_data or '', content)
+        else:
+            messages = [{'role': 'user', 'content': build_classification_prompt(file_content if knowledge else None, commit_data, content)}]
         data = {
             'model': model,
-            'messages': [
-                {
-                    'role': 'user',
-                    'content': f"""{context_instructions} \n {file_content} 
-                    \n\n {content} \n {commit_data} 
-                    \n{finalContent}""" if knowledge else content
-                }
-            ]
+            'messages': messages
         }
+        return self.__postChat(headers, data, classification_complete if knowledge else None)
+
+    def classifyCommitsBatched(self, commits: List[dict], knowledge: Optional[str] = None, model: str = 'llama3:8b',
+                               context_budget: int = 8192, max_batch: int = 16) -> List[dict]:
+        """
+        Classifies several commits per request: the commits are packed into batches that fit
+        the context budget (see `pack_batches`), and the model answers each batch with a JSON
+        array of classifications keyed by SHA. The commits whose entry is missing or malformed,
+        and those of a failed batch, are classified again one by one with `chatWithModel`.
+
+        Args:
+            commits (List[dict]): The commits, with their 'sha', 'link', 'message' and 'files'.
+            knowledge (Optional[str]): Path to the text file with the guidelines, sent once per batch.
+            model (str): The model to interact with (default is 'llama3:8b').
+            context_budget (int): The tokens a request may take, answer included.
+            max_batch (int): The commits per request at most.
+
+        Returns:
+            List[dict]: The 'model', 'sha', 'link' and 'response' of each classified commit, in the
+            order of `commits`. The response has the format of the answers of `chatWithModel`.
+        """
         try:
-            response = requests.post(f'{self.api_url}/chat/completions', headers=headers, json=data)
-            response.raise_for_status()
-            if response.status_code != 200:
-                print(f"Chat failed with status code: {response.status_code}")
-            return response
-        except Exception as e:
-            print(f"Error performing the chat. Details: {e}")
-            return None
+            knowledge_text = self.knowledge_cache.get(knowledge) if knowledge else None
+        except FileNotFoundError:
+            print(f"File not found: {knowledge}")
+            return []
+
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        responses = {}
+        for batch in pack_batches(commits, knowledge_text, context_budget, max_batch):
+            classifications = {}
+            if len(batch) > 1:
+                chat_response = self.__postChat(headers, {'model': model, 'messages': batch_messages(batch, knowledge_text)}, batch_complete)
+                if chat_response is not None and chat_response.status_code == 200:
+                    try:
+                        answer = chat_response.json()['choices'][0]['message']['content']
+                        classifications = parse_batch_answer(answer, [commit_id(commit, index) for index, commit in batch])
+                    except (KeyError, IndexError, TypeError, ValueError) as e:
+                        print(f"Error processing the batch response. Details: {e}")
+
+            for index, commit in batch:
+                response = classifications.get(commit_id(commit, index))
+                if response is None:
+                    chat_response = self.chatWithModel(knowledge=knowledge, commit_data=commit_data(commit), model=model)
+                    try:
+                        response = chat_response.json()['choices'][0]['message']['content'] if chat_response is not None else None
+                    except (KeyError, IndexError, TypeError, ValueError) as e:
+                        print(f"Error processing the chat response. Details: {e}")
+                if response is None:
+                    print(f"Unable to classify commit {commit_id(commit, index)}.")
+                    continue
+                responses[index] = {
+                    'model': model,
+                    'sha': commit.get('sha', ''),
+                    'link': commit.get('link', ''),
+                    'response': response,
+                }
+        return [responses[index] for index in sorted(responses)]
 
     def evaluateCommitQualityChatWithModel(
         self, knowledge_files: Optional[List[str]] = None, commit_msg: Optional[str] = None,
@@ -180,67 +325,26 @@ class OpenUiClient:
             Optional[requests.Response]: The model's raw response in strict JSON format.
         """
 
-        combined_knowledge = ""
-        if knowledge_files:
-            for path in knowledge_files:
-                combined_knowledge += read_pdf_text(path).strip() + "\n\n"
-
-        context_instructions = (
-            "You are a Git commit analysis expert. Read the guidelines below carefully. "
-            "They explain how to identify high-quality commits based on software engineering research "
-            "regarding the presence of 'What' and 'Why' in commit messages, and the size of the change.\n\n"
-            "Do not produce output yet. Wait for commit data.\n\n"
-            "=== Guidelines ===\n"
-        )
-
-        if content is None:
-            content = (
-                "Now read the following Git commit data.\n"
-                "Do not generate output yet. Wait for explicit output instructions.\n\n"
-                "=== Commit Message ===\n"
-                f"{commit_msg.strip() if commit_msg else ''}\n\n"
-                "=== Files Changed ===\n"
-                f"{commit_files_changed if commit_files_changed is not None else 0}\n\n"
-            )
-
-        finalContent = (
-            "Based solely on the guidelines and commit data provided earlier, evaluate the commit quality.\n"
-            "Respond ONLY in the exact JSON format below. Do NOT include explanations, comments, or any other text.\n\n"
-            "Return this object (no modification, no extra keys):\n\n"
-            "{\n"
-            '  "what_present": <boolean value>,\n'
-            '  "why_present": <boolean value>,\n'
-            '  "files_changed": <integer value>\n'
-            "}\n\n"
-            "Use only boolean values (true/false) and an integer for files_changed.\n"
-        )
-
         headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
         
-        full_prompt = f"{context_instructions}{combined_knowledge}\n\n{content}\n\n{finalContent}" if knowledge_files else content
+        combined_knowledge = read_knowledge_files(knowledge_files, self.knowledge_cache) if knowledge_files else None
+        if combined_knowledge is not None and self.prompt_layout == 'prefix':
+            if content is None:
+                messages = self.quality_template.messages(combined_knowledge, quality_payload(commit_msg, commit_files_changed))
+            else:
+                messages = self.quality_template.messages(combined_knowledge, content, intro='')
+        else:
+            messages = [{'role': 'user', 'content': build_quality_prompt(combined_knowledge, commit_msg, commit_files_changed, content)}]
 
         data = {
             'model': model,
-            'messages': [
-                {
-                    'role': 'user',
-                    'content': full_prompt
-                }
-            ]
+            'messages': messages
         }
 
-        try:
-            response = requests.post(f'{self.api_url}/chat/completions', headers=headers, json=data)
-            response.raise_for_status()
-            if response.status_code != 200:
-                print(f"Chat failed with status code: {response.status_code}")
-            return response
-        except Exception as e:
-            print(f"Error performing the chat. Details: {e}")
-            return None
+        return self.__postChat(headers, data, quality_complete if combined_knowledge is not None and content is None else None)
 
 
     def getAvailableApiModels(self) -> Optional[list]:
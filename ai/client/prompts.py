@@ -0,0 +1,239 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+# 'prefix' sends the prompt templates below: a system message shared by every commit, then
+# the commit. 'legacy' sends the single user message the clients used to send.
+LAYOUTS = ('prefix', 'legacy')
+
+def commit_data(commit: dict) -> str:
+    """
+    Formats a commit of the golden or evaluation set as the commit data of the classification prompt.
+
+    Args:
+        commit (dict): The commit, with its 'message' and 'files'.
+
+    Returns:
+        str: The commit message followed by its files.
+    """
+    return f"Commit Message: {commit.get('message', '')}\nFiles in the commit:\n{commit.get('files', [])}"
+
+def quality_payload(commit_msg: Optional[str] = None, commit_files_changed: Optional[int] = None) -> str:
+    """
+    Formats the commit data of the commit quality prompt.
+
+    Args:
+        commit_msg (Optional[str]): The commit message as a string.
+        commit_files_changed (Optional[int]): The number of files changed.
+
+    Returns:
+        str: The commit message followed by the number of files changed.
+    """
+    return (
+        "=== Commit Message ===\n"
+        f"{commit_msg.strip() if commit_msg else ''}\n\n"
+        "=== Files Changed ===\n"
+        f"{commit_files_changed if commit_files_changed is not None else 0}\n"
+    )
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    A prompt laid out so that everything shared by the commits of a run comes first and is
+    byte-identical across requests: the instructions, the guidelines and (by default) the
+    output format go in a leading message, and the commit comes last. Inference servers
+    that cache the KV state of a prompt prefix (llama.cpp, Ollama, vLLM) then only process
+    the commit of each request.
+
+    Attributes:
+        name (str): The name of the template.
+        instructions (str): The text before the guidelines.
+        output_format (str): The instructions describing the expected answer.
+        payload_intro (str): The text before the commit data.
+        prefix_role (str): The role of the shared message; 'user' for models without a system role.
+        format_in_prefix (bool): Whether the output format is part of the shared message, or repeated after each commit.
+    """
+    name: str
+    instructions: str
+    output_format: str
+    payload_intro: str
+    prefix_role: str = 'system'
+    format_in_prefix: bool = True
+
+    def prefix(self, knowledge: Optional[str]) -> str:
+        """
+        Returns the content of the shared message.
+
+        Args:
+            knowledge (Optional[str]): The text of the guidelines.
+
+        Returns:
+            str: The instructions, the guidelines and, if `format_in_prefix`, the output format.
+        """
+        parts = [self.instructions + (knowledge or '').strip()]
+        if self.format_in_prefix:
+            parts.append(self.output_format)
+        return '\n\n'.join(parts)
+
+    def messages(self, knowledge: Optional[str], payload: str, intro: Optional[str] = None) -> List[dict]:
+        """
+        Builds the messages of a chat completion request.
+
+        Args:
+            knowledge (Optional[str]): The text of the guidelines.
+            payload (str): The commit data.
+            intro (Optional[str]): Overrides the text before the commit data; '' for none.
+
+        Returns:
+            List[dict]: The shared message, then the message with the commit.
+        """
+        intro = self.payload_intro if intro is None else intro
+        content = f"{intro}\n{payload}" if intro else payload
+        if not self.format_in_prefix:
+            content += f"\n\n{self.output_format}"
+        return [
+            {'role': self.prefix_role, 'content': self.prefix(knowledge)},
+            {'role': 'user', 'content': content},
+        ]
+
+CLASSIFICATION_TEMPLATE = PromptTemplate(
+    name='classification',
+    instructions=(
+        "You are an AI code assistant. Read and understand carefully the guidelines about maintenance types and "
+        "modification requests classification below. You will then be given the data of a commit, which consists "
+        "of its message and its code content, to classify.\n\n"
+        "Guidelines:\n"
+    ),
+    output_format=(
+        "Based solely on the guidelines and the commit data, respond using ONLY the format below.\n"
+        "Do NOT include any explanations, comments, or extra text. Do NOT change the format. Do NOT skip any lines.\n"
+        "Use ONLY one of the allowed keywords listed in angle brackets <>. Follow the exact format below:\n\n"
+        "Modification Request Classification: <correction | enhancement>\n"
+        "Maintenance Type: <corrective | adaptive | preventive | perfective | additive>\n"
+    ),
+    payload_intro="Commit data:",
+)
+
+BATCH_CLASSIFICATION_TEMPLATE = PromptTemplate(
+    name='batch_classification',
+    instructions=CLASSIFICATION_TEMPLATE.instructions.replace(
+        "You will then be given the data of a commit, which consists of its message and its code content, to classify.",
+        "You will then be given the data of several commits, each introduced by its SHA and consisting of its message "
+        "and its code content, to classify independently of each other."),
+    output_format=(
+        "Based solely on the guidelines and the commit data, classify every commit.\n"
+        "Respond ONLY with a JSON array containing exactly one object per commit, in the order of the commits. "
+        "Do NOT include any explanations, comments, or extra text. Do NOT skip any commit.\n"
+        "Use ONLY the allowed keywords listed in angle brackets <>. Each object must follow the exact format below:\n\n"
+        '{"sha": "<the SHA of the commit>", "modification_request": "<correction | enhancement>", '
+        '"maintenance_type": "<corrective | adaptive | preventive | perfective | additive>"}\n'
+    ),
+    payload_intro="Commits data:",
+)
+
+QUALITY_TEMPLATE = PromptTemplate(
+    name='quality',
+    instructions=(
+        "You are a Git commit analysis expert. Read the guidelines below carefully. "
+        "They explain how to identify high-quality commits based on software engineering research "
+        "regarding the presence of 'What' and 'Why' in commit messages, and the size of the change. "
+        "You will then be given the data of a Git commit to evaluate.\n\n"
+        "=== Guidelines ===\n"
+    ),
+    output_format=(
+        "Based solely on the guidelines and the commit data, evaluate the commit quality.\n"
+        "Respond ONLY in the exact JSON format below. Do NOT include explanations, comments, or any other text.\n\n"
+        "Return this object (no modification, no extra keys):\n\n"
+        "{\n"
+        '  "what_present": <boolean value>,\n'
+        '  "why_present": <boolean value>,\n'
+        '  "files_changed": <integer value>\n'
+        "}\n\n"
+        "Use only boolean values (true/false) and an integer for files_changed.\n"
+    ),
+    payload_intro="Git commit data:\n",
+)
+
+def build_classification_prompt(knowledge: Optional[str] = None, commit_data: Optional[str] = None, content: Optional[str] = None) -> str:
+    """
+    Builds the single-message maintenance classification prompt (the 'legacy' layout), where
+    the commit data is followed by the output format.
+
+    Args:
+        knowledge (Optional[str]): The text of the guidelines. If None, only the content is sent.
+        commit_data (Optional[str]): The commit message and files to classify.
+        content (Optional[str]): The message introducing the commit data. If None, a default prompt is used.
+
+    Returns:
+        str: The prompt.
+    """
+    context_instructions = (
+        "You are an AI code assistant. Read and understand carefully guidelines about maintenance types and modification requests classification below.\n"
+        "Do not generate anything yet. Wait for further instructions after reading.\n\n"
+        "Guidelines:\n"
+    )
+
+    if content is None:
+        content = (
+            "Now read and understand carefully the following commit data which consists of its message and its code content. Do not generate anything yet.\n"
+            "Wait for further instructions after reading.\n\n"
+            "Commit data:"
+        )
+
+    finalContent = (
+        "Based solely on the guidelines and commit data provided earlier, respond using ONLY the format below.\n"
+        "Do NOT include any explanations, comments, or extra text. Do NOT change the format. Do NOT skip any lines.\n"
+        "Use ONLY one of the allowed keywords listed in angle brackets <>. Follow the exact format below:\n\n"
+        "Modification Request Classification: <correction | enhancement>\n"
+        "Maintenance Type: <corrective | adaptive | preventive | perfective | additive>\n"
+    )
+
+    return f"""{context_instructions} \n {knowledge} 
+                    \n\n {content} \n {commit_data} 
+                    \n{finalContent}""" if knowledge is not None else content
+
+def build_quality_prompt(knowledge: Optional[str] = None, commit_msg: Optional[str] = None,
+                         commit_files_changed: Optional[int] = None, content: Optional[str] = None) -> str:
+    """
+    Builds the single-message commit quality prompt (the 'legacy' layout), where the commit
+    data is followed by the output format.
+
+    Args:
+        knowledge (Optional[str]): The text of the guidelines. If None, only the content is sent.
+        commit_msg (Optional[str]): The commit message as a string.
+        commit_files_changed (Optional[int]): The number of files changed.
+        content (Optional[str]): Optional override content prompt.
+
+    Returns:
+        str: The prompt.
+    """
+    context_instructions = (
+        "You are a Git commit analysis expert. Read the guidelines below carefully. "
+        "They explain how to identify high-quality commits based on software engineering research "
+        "regarding the presence of 'What' and 'Why' in commit messages, and the size of the change.\n\n"
+        "Do not produce output yet. Wait for commit data.\n\n"
+        "=== Guidelines ===\n"
+    )
+
+    if content is None:
+        content = (
+            "Now read the following Git commit data.\n"
+            "Do not generate output yet. Wait for explicit output instructions.\n\n"
+            "=== Commit Message ===\n"
+            f"{commit_msg.strip() if commit_msg else ''}\n\n"
+            "=== Files Changed ===\n"
+            f"{commit_files_changed if commit_files_changed is not None else 0}\n\n"
+        )
+
+    finalContent = (
+        "Based solely on the guidelines and commit data provided earlier, evaluate the commit quality.\n"
+        "Respond ONLY in the exact JSON format below. Do NOT include explanations, comments, or any other text.\n\n"
+        "Return this object (no modification, no extra keys):\n\n"
+        "{\n"
+        '  "what_present": <boolean value>,\n'
+        '  "why_present": <boolean value>,\n'
+        '  "files_changed": <integer value>\n'
+        "}\n\n"
+        "Use only boolean values (true/false) and an integer for files_changed.\n"
+    )
+
+    return f"{context_instructions}{knowledge}\n\n{content}\n\n{finalContent}" if knowledge is not None else content
@@ -0,0 +1,414 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to a model whose circuit is open.
+    """
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"Circuit open for model {model}, retrying in {retry_in:.1f}s")
+        self.model = model
+        self.retry_in = retry_in
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header, given in seconds or as an HTTP date.
+
+    Args:
+        value (Optional[str]): The value of the header.
+
+    Returns:
+        Optional[float]: The seconds to wait, None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    When and how long to wait before sending a failed request again.
+
+    Attributes:
+        max_attempts (int): The number of times a request is sent at most.
+        base_delay (float): The seconds waited after the first failure; doubled after each one.
+        max_delay (float): The upper bound of the exponential delay.
+        retry_statuses (Tuple[int, ...]): The HTTP status codes worth retrying. Connection errors and timeouts (no status) always are.
+    """
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    retry_statuses: Tuple[int, ...] = (408, 429, 500, 502, 503, 504)
+
+    def should_retry(self, status: Optional[int], attempt: int) -> bool:
+        """
+        Args:
+            status (Optional[int]): The status of the failed attempt, None for a connection error or timeout.
+            attempt (int): The zero-based number of the failed attempt.
+
+        Returns:
+            bool: Whether the request should be sent again.
+        """
+        return attempt + 1 < self.max_attempts and (status is None or status in self.retry_statuses)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Returns the seconds to wait after a failed attempt: the server's Retry-After if it
+        sent one, otherwise an exponential backoff with "equal jitter" (half fixed, half
+        random), so clients that failed together do not retry together.
+
+        Args:
+            attempt (int): The zero-based number of the failed attempt.
+            retry_after (Optional[float]): The seconds asked for by the server.
+
+        Returns:
+            float: The seconds to wait.
+        """
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+class TokenBucket:
+    """
+    Lets requests through at `rate` per second on average, with bursts of up to `burst`.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1):
+        """
+        Args:
+            rate (Optional[float]): The requests per second, None for no limit.
+            burst (int): The number of requests that can be sent at once after an idle period.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def take(self, now: float) -> float:
+        """
+        Takes a token if one is available (not thread-safe, see `RateLimiter`).
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate is None:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, now: float, seconds: float) -> None:
+        """
+        Lets no request through for `seconds`, e.g. after a 429 with a Retry-After header.
+        """
+        self.paused_until = max(self.paused_until, now + seconds)
+
+class AdaptiveConcurrency:
+    """
+    An AIMD controller of the number of requests in flight. The limit grows by one request
+    per window of successful requests (additive increase) and is halved (multiplicative
+    decrease) when the server shows it is saturated: a 429/5xx answer, a timeout, or a
+    latency above `latency_tolerance` times the lowest latency seen recently.
+
+    Only requests started after the last decrease can decrease the limit again, so the
+    burst of failures caused by one overload halves it once, not once per request.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32,
+                 latency_tolerance: float = 2.0, decrease_ratio: float = 0.5):
+        """
+        Args:
+            initial (int): The limit before any request completed.
+            minimum (int): The lowest the limit goes.
+            maximum (int): The highest the limit goes.
+            latency_tolerance (float): The latency, relative to the baseline, above which the server is considered saturated.
+            decrease_ratio (float): The factor applied to the limit on saturation.
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_ratio = decrease_ratio
+        self.baseline: Optional[float] = None
+        self.last_decrease = 0.0
+
+    def on_success(self, latency: float, started: float) -> None:
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Drift slowly towards the current latency, so a baseline measured on a short
+            # prompt does not make every longer one look like saturation forever.
+            self.baseline += (latency - self.baseline) * 0.01
+
+        if latency > self.baseline * self.latency_tolerance:
+            self.on_overload(started)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self, started: float) -> None:
+        if started >= self.last_decrease:
+            self.limit = max(self.minimum, self.limit * self.decrease_ratio)
+            self.last_decrease = time.monotonic()
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a model after `failure_threshold` failures in a row, for
+    `reset_timeout` seconds. Then a single probe request is let through: if it succeeds
+    the circuit closes, otherwise it stays open for another timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def retry_in(self, now: float) -> float:
+        """
+        Returns:
+            float: 0 if a request may be sent, otherwise the seconds until the next probe.
+        """
+        if self.opened_at is None:
+            return 0.0
+        retry_in = self.opened_at + self.reset_timeout - now
+        if retry_in > 0:
+            return retry_in
+        # While the probe is in flight the others wait for its outcome
+        return self.reset_timeout if self.probing else 0.0
+
+    def on_send(self) -> None:
+        if self.opened_at is not None:
+            self.probing = True
+
+    def on_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def on_failure(self, now: float) -> None:
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = now
+            self.probing = False
+
+@dataclass
+class Ticket:
+    """
+    A granted permission to send one request, returned to `RateLimiter.release`.
+    """
+    model: str
+    started: float = field(default_factory=time.monotonic)
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+class RateLimiter:
+    """
+    Client-side flow control for the LLM API, shared by every request of a client (and by
+    several clients, if they are given the same instance). Each request takes a token from
+    a `TokenBucket` and a slot from an `AdaptiveConcurrency` limit, and is refused while
+    the `CircuitBreaker` of its model is open. The outcome of each request, passed to
+    `release`, drives the concurrency limit and the breaker; `retry` says how to retry.
+
+    It is thread-safe, and can be used from blocking code (`acquire`) and from asyncio
+    (`acquire_async`).
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1, initial_concurrency: int = 4,
+                 min_concurrency: int = 1, max_concurrency: int = 32, latency_tolerance: float = 2.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, retry: Optional[RetryPolicy] = None):
+        """
+        Constructor for the RateLimiter class.
+
+        Args:
+            rate (Optional[float]): The requests per second sent at most, None for no limit.
+            burst (int): The number of requests that can be sent at once after an idle period.
+            initial_concurrency (int): The requests in flight allowed before any completed.
+            min_concurrency (int): The lowest the concurrency limit goes.
+            max_concurrency (int): The highest the concurrency limit goes.
+            latency_tolerance (float): The latency, relative to the baseline, above which the server is considered saturated.
+            failure_threshold (int): The failures in a row after which a model's circuit opens.
+            reset_timeout (float): The seconds a model's circuit stays open.
+            retry (Optional[RetryPolicy]): The retry policy, the default one if None.
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, min_concurrency, max_concurrency, latency_tolerance)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry = retry or RetryPolicy()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.in_flight = 0
+        self.counts = {'requests': 0, 'succeeded': 0, 'overloaded': 0, 'failed': 0}
+        self._condition = threading.Condition()
+        # The futures of the coroutines waiting in `acquire_async`, woken up on `release`
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.breakers[model]
+
+    def _try_acquire(self, model: str) -> Tuple[Optional[Ticket], float]:
+        """Returns a ticket, or None and the seconds to wait before trying again."""
+        now = time.monotonic()
+        breaker = self._breaker(model)
+        retry_in = breaker.retry_in(now)
+        if retry_in > 0:
+            raise CircuitOpenError(model, retry_in)
+        if self.in_flight >= int(self.concurrency.limit):
+            # Woken up by `release` long before that
+            return None, 1.0
+        wait = self.bucket.take(now)
+        if wait > 0:
+            return None, wait
+        breaker.on_send()
+        self.in_flight += 1
+        self.counts['requests'] += 1
+        return Ticket(model), 0.0
+
+    def acquire(self, model: str) -> Ticket:
+        """
+        Blocks until a request to `model` may be sent.
+
+        Args:
+            model (str): The model the request is for.
+
+        Returns:
+            Ticket: The permission, to be passed to `release` once the request completed.
+
+        Raises:
+            CircuitOpenError: If the model's circuit is open.
+        """
+        with self._condition:
+            while True:
+                ticket, wait = self._try_acquire(model)
+                if ticket is not None:
+                    return ticket
+                self._condition.wait(wait)
+
+    async def acquire_async(self, model: str) -> Ticket:
+        """
+        Waits without blocking the event loop until a request to `model` may be sent.
+
+        Args:
+            model (str): The model the request is for.
+
+        Returns:
+            Ticket: The permission, to be passed to `release` once the request completed.
+
+        Raises:
+            CircuitOpenError: If the model's circuit is open.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                ticket, wait = self._try_acquire(model)
+                if ticket is not None:
+                    return ticket
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await asyncio.wait([waiter[1]], timeout=wait)
+            finally:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def _notify(self) -> None:
+        """Wakes up every waiting caller (with the lock held)."""
+        self._condition.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        self._waiters.clear()
+
+    def release(self, ticket: Ticket, status: Optional[int], retry_after: Optional[float] = None) -> None:
+        """
+        Records the outcome of a request and frees its slot.
+
+        Args:
+            ticket (Ticket): The permission the request was sent with.
+            status (Optional[int]): The HTTP status code, None for a connection error or timeout.
+            retry_after (Optional[float]): The seconds the server asked to wait, if any.
+        """
+        now = time.monotonic()
+        latency = now - ticket.started
+        with self._condition:
+            self.in_flight -= 1
+            breaker = self._breaker(ticket.model)
+            if status is not None and status < 400:
+                self.counts['succeeded'] += 1
+                self.concurrency.on_success(latency, ticket.started)
+                breaker.on_success()
+            elif status is None or status in self.retry.retry_statuses:
+                self.counts['overloaded'] += 1
+                self.concurrency.on_overload(ticket.started)
+                breaker.on_failure(now)
+                if status == 429 and retry_after:
+                    self.bucket.pause(now, retry_after)
+            else:
+                # A client error says nothing about the load of the server, but it answered,
+                # so a probe that gets one closes the circuit; any other error ends the probe
+                self.counts['failed'] += 1
+                if status < 500:
+                    breaker.on_success()
+                else:
+                    breaker.probing = False
+            self._notify()
+
+    def cancel(self, ticket: Ticket) -> None:
+        """
+        Frees the slot of a request abandoned by the caller (e.g. interrupted), without
+        drawing any conclusion about the server from it.
+
+        Args:
+            ticket (Ticket): The permission the request was sent with.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            breaker = self._breaker(ticket.model)
+            if breaker.probing:
+                breaker.probing = False
+            self._notify()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The current concurrency limit and latency baseline, the requests in flight,
+            the request counts by outcome and the state of each model's circuit.
+        """
+        with self._condition:
+            return {
+                'concurrency_limit': round(self.concurrency.limit, 2),
+                'baseline_latency': self.concurrency.baseline,
+                'in_flight': self.in_flight,
+                **self.counts,
+                'circuits': {model: breaker.state for model, breaker in self.breakers.items()},
+            }
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'responses.sqlite3')
+
+# Request fields that are not sampling parameters
+_NON_SAMPLING_FIELDS = {'model', 'messages', 'stream'}
+
+def normalize_messages(messages: List[dict]) -> List[dict]:
+    """
+    Normalizes a chat message list for hashing: only the role, content and name of each
+    message are kept, line endings are unified and the content is stripped, so prompts
+    that differ only in whitespace around them share an entry.
+
+    Args:
+        messages (List[dict]): The messages of a chat completion request.
+
+    Returns:
+        List[dict]: The normalized messages.
+    """
+    normalized = []
+    for message in messages:
+        entry = {'role': str(message.get('role', '')).lower(), 'content': message.get('content')}
+        if isinstance(entry['content'], str):
+            entry['content'] = entry['content'].replace('\r\n', '\n').strip()
+        if message.get('name'):
+            entry['name'] = message['name']
+        normalized.append(entry)
+    return normalized
+
+def request_key(data: dict) -> str:
+    """
+    Returns the cache key of a chat completion request: a SHA-256 of its model, normalized
+    messages and sampling parameters (temperature, seed, ...).
+
+    Args:
+        data (dict): The body of the request.
+
+    Returns:
+        str: The hexadecimal key.
+    """
+    params = {name: value for name, value in data.items() if name not in _NON_SAMPLING_FIELDS}
+    canonical = json.dumps({'model': data.get('model'), 'messages': normalize_messages(data.get('messages', [])), 'params': params},
+                           sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class CachedResponse:
+    """
+    A stand-in for `requests.Response` returned by `OpenUiClient` for cache hits, so the
+    notebooks read `status_code` and `json()` the same way.
+    """
+    status_code = 200
+    ok = True
+    from_cache = True
+
+    def __init__(self, body: dict):
+        self._body = body
+        self.text = json.dumps(body)
+        self.headers = {'Content-Type': 'application/json', 'X-Cache': 'hit'}
+
+    def json(self) -> dict:
+        return self._body
+
+    def raise_for_status(self) -> None:
+        pass
+
+class ResponseCache:
+    """
+    A persistent cache of chat completion responses in a local SQLite database, keyed by
+    `request_key`. Entries older than `ttl` seconds are ignored and deleted; beyond
+    `max_entries` entries or `max_bytes` of responses, the least recently used ones are
+    evicted. The database is opened in WAL mode, so several processes can share it.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None, evict_every: int = 50):
+        """
+        Constructor for the ResponseCache class.
+
+        Args:
+            db_path (str): The path of the SQLite database, created if needed.
+            ttl (Optional[float]): The seconds an entry is valid for, None for no expiry.
+            max_entries (Optional[int]): The number of entries kept at most, None for no limit.
+            max_bytes (Optional[int]): The total size of the responses kept at most, None for no limit.
+            evict_every (int): The number of stored entries after which the limits are enforced.
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.counts = {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evicted': 0}
+        self.models: dict = {}
+        self._since_eviction = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            body TEXT,
+            size INTEGER,
+            created_at REAL,
+            last_used REAL,
+            hits INTEGER DEFAULT 0
+        );""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);")
+        self._conn.commit()
+
+    def _count(self, model: str, outcome: str) -> None:
+        self.counts[outcome] += 1
+        per_model = self.models.setdefault(model, {'hits': 0, 'misses': 0})
+        if outcome in per_model:
+            per_model[outcome] += 1
+
+    def get(self, data: dict) -> Optional[dict]:
+        """
+        Returns the cached response to a chat completion request.
+
+        Args:
+            data (dict): The body of the request.
+
+        Returns:
+            Optional[dict]: The JSON body of the response, None on a miss.
+        """
+        key = request_key(data)
+        model = data.get('model')
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT body, created_at FROM responses WHERE key = ?;", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?;", (key,))
+                self._conn.commit()
+                self.counts['expired'] += 1
+                row = None
+            if row is None:
+                self._count(model, 'misses')
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?;", (now, key))
+            self._conn.commit()
+            self._count(model, 'hits')
+        return json.loads(row[0])
+
+    def put(self, data: dict, body: dict) -> None:
+        """
+        Stores the response to a chat completion request.
+
+        Args:
+            data (dict): The body of the request.
+            body (dict): The JSON body of the response.
+        """
+        serialized = json.dumps(body, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""INSERT OR REPLACE INTO responses (key, model, body, size, created_at, last_used, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0);""", (request_key(data), data.get('model'), serialized, len(serialized), now, now))
+            self._conn.commit()
+            self.counts['stores'] += 1
+            self._since_eviction += 1
+            if self._since_eviction >= self.evict_every:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Deletes the expired entries, then the least recently used ones beyond the limits (with the lock held)."""
+        self._since_eviction = 0
+        if self.ttl is not None:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?;", (time.time() - self.ttl,))
+            self.counts['expired'] += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self._conn.execute("""DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?);""", (self.max_entries,))
+            self.counts['evicted'] += cursor.rowcount
+        if self.max_bytes is not None:
+            cursor = self._conn.execute("""DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running FROM responses
+                ) WHERE running > ?);""", (self.max_bytes,))
+            self.counts['evicted'] += cursor.rowcount
+        self._conn.commit()
+
+    def evict(self) -> None:
+        """
+        Enforces the TTL and size limits now.
+        """
+        with self._lock:
+            self._evict()
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: The hits, misses, hit rate, stores, expired and evicted entries of this
+            session, the hits and misses per model, and the entries and bytes in the database.
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses;").fetchone()
+            lookups = self.counts['hits'] + self.counts['misses']
+            return {
+                **self.counts,
+                'hit_rate': self.counts['hits'] / lookups if lookups else 0.0,
+                'models': {model: dict(counts) for model, counts in self.models.items()},
+                'entries': entries,
+                'bytes': size,
+            }
+
+    def clear(self) -> None:
+        """
+        Deletes every entry.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM responses;")
+            self._conn.commit()
+
+    def close(self) -> None:
+        """
+        Enforces the limits and closes the database.
+        """
+        with self._lock:
+            self._evict()
+            self._conn.close()
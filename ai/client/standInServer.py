@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from aiohttp import web
+
+MAINTENANCE_TYPES = ['corrective', 'adaptive', 'preventive', 'perfective', 'additive']
+
+def fake_answer(prompt: str, miss_rate: float = 0.0) -> str:
+    """
+    Returns a well-formed answer to the prompts of `OpenUiClient`. The answer is derived from
+    a hash of the prompt, so the same commit always gets the same answer.
+
+    Args:
+        prompt (str): The content of the messages.
+        miss_rate (float): The fraction of the commits of a batched classification left out of the answer.
+
+    Returns:
+        str: A classification, a JSON array of classifications, a quality evaluation in JSON, or a short greeting.
+    """
+    digest = hashlib.sha1(prompt.encode('utf-8')).digest()
+    if '"maintenance_type"' in prompt:
+        entries = []
+        for sha in re.findall(r'^=== Commit (\S+) ===$', prompt, re.MULTILINE):
+            if random.random() < miss_rate:
+                continue
+            sha_digest = hashlib.sha1(sha.encode('utf-8')).digest()
+            entries.append({
+                'sha': sha,
+                'modification_request': 'correction' if sha_digest[0] % 2 else 'enhancement',
+                'maintenance_type': MAINTENANCE_TYPES[sha_digest[1] % len(MAINTENANCE_TYPES)],
+            })
+        return json.dumps(entries, indent=2)
+    if 'Maintenance Type:' in prompt:
+        return (
+            f"Modification Request Classification: {'correction' if digest[0] % 2 else 'enhancement'}\n"
+            f"Maintenance Type: {MAINTENANCE_TYPES[digest[1] % len(MAINTENANCE_TYPES)]}\n"
+        )
+    if '"what_present"' in prompt:
+        return (
+            "{\n"
+            f'  "what_present": {"true" if digest[0] % 4 else "false"},\n'
+            f'  "why_present": {"true" if digest[1] % 2 else "false"},\n'
+            f'  "files_changed": {digest[2] % 10 + 1}\n'
+            "}"
+        )
+    return "Hello! I am a stand-in model used to test the clients offline."
+
+def flatten_messages(messages: List[dict]) -> str:
+    """
+    Returns the messages of a request as the single text a model would read, role by role.
+
+    Args:
+        messages (List[dict]): The messages of a chat completion request.
+
+    Returns:
+        str: The prompt text.
+    """
+    return ''.join(f"<|{message.get('role', 'user')}|>\n{message.get('content') or ''}\n" for message in messages)
+
+def common_prefix_length(a: str, b: str) -> int:
+    """
+    Returns the length of the longest common prefix of two strings, by bisecting on slice
+    comparisons rather than comparing long prompts a character at a time.
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+class StandInServer:
+    """
+    A local OpenAI-compatible chat completions server that answers like the models used by
+    the clients, after a configurable latency. It makes it possible to load-test the clients
+    offline, and records how many requests were served and in flight at once.
+
+    With a `prefill_rate`, reading the prompt takes time too, except for the part it shares
+    with one of the last prompts when `prefix_cache` is on, like the prefix caching of vLLM or
+    llama.cpp. Requests with `"stream": true` are answered with server-sent events, the first
+    one right after the prompt is read, so the time to first token can be measured.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000, latency: float = 0.5, jitter: float = 0.0,
+                 error_rate: float = 0.0, models: Optional[list] = None, capacity: Optional[int] = None,
+                 max_queue: Optional[int] = None, prefill_rate: Optional[float] = None, prefix_cache: bool = True,
+                 cache_slots: int = 8, batch_miss_rate: float = 0.0, ramble_words: int = 0):
+        """
+        Constructor for the StandInServer class.
+
+        Args:
+            host (str): The interface to listen on.
+            port (int): The port to listen on, 0 to pick a free one.
+            latency (float): The seconds each completion takes.
+            jitter (float): The maximum seconds randomly added to the latency.
+            error_rate (float): The fraction of completions answered with a 503 error.
+            models (Optional[list]): The model IDs listed by `/models`.
+            capacity (Optional[int]): The completions computed at once, like the parallel slots of an
+                inference server; the others queue, so their latency grows. None for no limit.
+            max_queue (Optional[int]): The completions that may wait for a slot; more are answered with
+                a 429 and a Retry-After header. None for no limit.
+            prefill_rate (Optional[float]): The prompt characters read per second before the answer
+                starts. None to read prompts instantly.
+            prefix_cache (bool): Whether the part of a prompt shared with a recent one is read instantly.
+            cache_slots (int): The number of recent prompts kept for the prefix cache.
+            batch_miss_rate (float): The fraction of the commits of batched classifications left out of the answers.
+            ramble_words (int): The words of explanation added after each answer, like models that do not stop
+                at the requested format. They take as long to generate as the words of the answer.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.models = models or ['llama3:8b', 'llama3.1:8b']
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.prefill_rate = prefill_rate
+        self.prefix_cache = prefix_cache
+        self.cache_slots = cache_slots
+        self.batch_miss_rate = batch_miss_rate
+        self.ramble_words = ramble_words
+        self.requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.prompt_chars = 0
+        self.cached_chars = 0
+        self.generated_words = 0
+        self._recent_prompts: List[str] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/chat/completions', self._chat_completions)
+        app.router.add_get('/models', self._models)
+        return app
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self.capacity is None:
+            yield
+            return
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.capacity)
+        async with self._slots:
+            yield
+
+    def _cached_length(self, prompt: str) -> int:
+        """Returns the length of the longest prefix `prompt` shares with a recent prompt, and remembers it."""
+        if not self.prefix_cache:
+            return 0
+        best, best_index = 0, None
+        for index, recent in enumerate(self._recent_prompts):
+            length = common_prefix_length(prompt, recent)
+            if length > best:
+                best, best_index = length, index
+        if best_index is not None and best == len(self._recent_prompts[best_index]):
+            # The new prompt extends the cached one, so it replaces it
+            self._recent_prompts.pop(best_index)
+        self._recent_prompts.append(prompt)
+        del self._recent_prompts[:-self.cache_slots]
+        return best
+
+    async def _prefill(self, prompt: str) -> None:
+        cached = self._cached_length(prompt)
+        self.prompt_chars += len(prompt)
+        self.cached_chars += cached
+        if self.prefill_rate:
+            await asyncio.sleep((len(prompt) - cached) / self.prefill_rate)
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        if self.max_queue is not None and self.capacity is not None and self.in_flight >= self.capacity + self.max_queue:
+            self.rejected += 1
+            # Asks to come back once a slot is likely to be free
+            return web.json_response({'detail': 'Too many requests'}, status=429, headers={'Retry-After': f'{self.latency:g}'})
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            body = await request.json()
+            prompt = flatten_messages(body['messages'])
+            async with self._slot():
+                await self._prefill(prompt)
+                if random.random() < self.error_rate:
+                    return web.json_response({'detail': 'Model is overloaded'}, status=503)
+
+                answer = fake_answer(prompt, self.batch_miss_rate)
+                # The latency is the time to generate the answer; rambling takes as long per word
+                word_delay = (self.latency + random.uniform(0, self.jitter)) / max(len(answer.split()), 1)
+                if self.ramble_words:
+                    answer += "\n\nExplanation:" + " because" * self.ramble_words
+                pieces = re.findall(r'\s*\S+|\s+$', answer) or ['']
+                if body.get('stream'):
+                    return await self._stream(request, body, pieces, word_delay)
+                await asyncio.sleep(word_delay * len(pieces))
+                self.generated_words += len(pieces)
+                return web.json_response({
+                    'id': f'chatcmpl-{self.requests}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': body.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(answer) // 4}
+                })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request: web.Request, body: dict, pieces: List[str], word_delay: float) -> web.StreamResponse:
+        """Sends the words of an answer as server-sent events, one every `word_delay` seconds."""
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        chunk = {'id': f'chatcmpl-{self.requests}', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body.get('model')}
+        try:
+            for index, piece in enumerate(pieces):
+                if index:
+                    await asyncio.sleep(word_delay)
+                self.generated_words += 1
+                delta = {'role': 'assistant', 'content': piece} if index == 0 else {'content': piece}
+                choice = {'index': 0, 'delta': delta, 'finish_reason': None}
+                await response.write(f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\n".encode('utf-8'))
+            choice = {'index': 0, 'delta': {}, 'finish_reason': 'stop'}
+            await response.write(f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\ndata: [DONE]\n\n".encode('utf-8'))
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client stopped reading, e.g. once it had the part of the answer it needed
+            pass
+        return response
+
+    async def _models(self, request: web.Request) -> web.Response:
+        return web.json_response({'object': 'list', 'data': [{'id': model, 'object': 'model'} for model in self.models]})
+
+    async def start(self) -> None:
+        """
+        Starts serving on the running event loop.
+        """
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if self.port == 0:
+            self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        """
+        Stops serving and closes the open connections.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> 'StandInServer':
+        """
+        Starts serving from a background thread with its own event loop, so blocking clients
+        (like `OpenUiClient`) can be tested from the same process.
+
+        Returns:
+            StandInServer: The server, once it accepts connections.
+        """
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        """
+        Stops a server started with `start_in_thread`.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+            self._thread = None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serves an OpenAI-compatible stand-in for the models used by the clients.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds each completion takes.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum seconds randomly added to the latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of completions answered with a 503.')
+    parser.add_argument('--capacity', type=int, default=None, help='Completions computed at once; the others queue.')
+    parser.add_argument('--max-queue', type=int, default=None, help='Completions that may queue before answering 429.')
+    parser.add_argument('--prefill-rate', type=float, default=None, help='Prompt characters read per second.')
+    parser.add_argument('--no-prefix-cache', action='store_true', help='Read every prompt in full, even its part shared with recent prompts.')
+    parser.add_argument('--ramble-words', type=int, default=0, help='Words of explanation added after each answer.')
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                           capacity=args.capacity, max_queue=args.max_queue, prefill_rate=args.prefill_rate,
+                           prefix_cache=not args.no_prefix_cache, ramble_words=args.ramble_words)
+    print(f"Serving on {server.api_url} (set API_URL to it)")
+    web.run_app(server._app(), host=args.host, port=args.port, print=None)
+
+if __name__ == '__main__':
+    main()
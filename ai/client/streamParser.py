@@ -0,0 +1,189 @@
+import json
+import re
+from typing import AsyncIterator, Callable, Iterable, Optional, Tuple
+
+# Tells whether the text received so far holds the whole answer, so the stream can be closed
+Completion = Callable[[str], bool]
+
+_CLASSIFICATION = re.compile(
+    r"Modification Request Classification:\W*(correction|enhancement)(?![A-Za-z]|\s*\|).*?"
+    r"Maintenance Type:\W*(corrective|adaptive|preventive|perfective|additive)(?![A-Za-z]|\s*\|)",
+    re.IGNORECASE | re.DOTALL)
+_QUALITY_KEYS = ('what_present', 'why_present', 'files_changed')
+
+def classification_complete(text: str) -> bool:
+    """
+    Tells whether a classification answer holds both required fields with an allowed keyword.
+    No keyword is the prefix of another, so a keyword is complete as soon as it is matched;
+    the list of allowed keywords (an echo of the format) does not count.
+
+    Args:
+        text (str): The answer received so far.
+
+    Returns:
+        bool: True once both fields have been received.
+    """
+    return _CLASSIFICATION.search(text) is not None
+
+def quality_complete(text: str) -> bool:
+    """
+    Tells whether a commit quality answer holds a complete JSON object with the required keys.
+
+    Args:
+        text (str): The answer received so far.
+
+    Returns:
+        bool: True once the object has been closed.
+    """
+    decoder = json.JSONDecoder()
+    start = text.find('{')
+    while start != -1:
+        try:
+            value, _ = decoder.raw_decode(text, start)
+            if isinstance(value, dict) and all(key in value for key in _QUALITY_KEYS):
+                return True
+        except ValueError:
+            pass
+        start = text.find('{', start + 1)
+    return False
+
+def parse_sse_line(line: str) -> Optional[str]:
+    """
+    Returns the content delta of a line of a streamed chat completion.
+
+    Args:
+        line (str): A line of the server-sent events.
+
+    Returns:
+        Optional[str]: The text of the delta ('' for events without text), None at the end of the stream.
+
+    Raises:
+        ValueError: If the event is not valid JSON.
+    """
+    if not line.startswith('data:'):
+        return ''
+    payload = line[5:].strip()
+    if payload == '[DONE]':
+        return None
+    choices = json.loads(payload).get('choices') or [{}]
+    return (choices[0].get('delta') or {}).get('content') or ''
+
+class StreamAssembler:
+    """
+    Accumulates the deltas of a streamed chat completion and tells when the answer is
+    complete, either because the stream ended or because `is_complete` recognizes it.
+    """
+
+    def __init__(self, is_complete: Optional[Completion] = None):
+        """
+        Constructor for the StreamAssembler class.
+
+        Args:
+            is_complete (Optional[Completion]): Recognizes a complete answer, None to read the stream to its end.
+        """
+        self.is_complete = is_complete
+        self.parts = []
+        self.done = False
+        self.stopped_early = False
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+    def feed(self, line: str) -> bool:
+        """
+        Adds a line of the stream.
+
+        Args:
+            line (str): A line of the server-sent events.
+
+        Returns:
+            bool: True once no more lines are needed.
+        """
+        delta = parse_sse_line(line.strip())
+        if delta is None:
+            self.done = True
+        elif delta:
+            self.parts.append(delta)
+            if self.is_complete is not None and self.is_complete(self.text):
+                self.done = self.stopped_early = True
+        return self.done
+
+# The finish reason of an answer whose stream was closed once `is_complete` recognized it
+EARLY_STOP = 'early_stop'
+
+def completion_body(text: str, model: Optional[str], stopped_early: bool = False) -> dict:
+    """
+    Returns a streamed answer in the format of a non-streamed chat completion, so it is read
+    like one. An answer left before the end of its stream is marked with the `EARLY_STOP`
+    finish reason, and is not cached since it lacks the trailing text of the full completion.
+
+    Args:
+        text (str): The answer.
+        model (Optional[str]): The model that answered.
+        stopped_early (bool): Whether the stream was left before its end.
+
+    Returns:
+        dict: The chat completion.
+    """
+    return {
+        'object': 'chat.completion',
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': EARLY_STOP if stopped_early else 'stop'}],
+    }
+
+class StreamedResponse:
+    """
+    A stand-in for `requests.Response` returned by `OpenUiClient` for streamed requests, so
+    the notebooks read `status_code` and `json()` the same way.
+    """
+    ok = True
+    from_cache = False
+
+    def __init__(self, body: dict, status_code: int, headers: dict, stopped_early: bool):
+        self._body = body
+        self.status_code = status_code
+        self.headers = headers
+        self.stopped_early = stopped_early
+        self.text = json.dumps(body)
+
+    def json(self) -> dict:
+        return self._body
+
+    def raise_for_status(self) -> None:
+        pass
+
+def read_stream(lines: Iterable[bytes], is_complete: Optional[Completion] = None) -> Tuple[str, bool]:
+    """
+    Reads the lines of a streamed chat completion until the answer is complete. The lines
+    are decoded as UTF-8, which server-sent events always are, whatever the headers say.
+
+    Args:
+        lines (Iterable[bytes]): The lines of the server-sent events, e.g. `response.iter_lines()`.
+        is_complete (Optional[Completion]): Recognizes a complete answer, None to read to the end.
+
+    Returns:
+        Tuple[str, bool]: The answer, and whether the stream was left before its end.
+    """
+    assembler = StreamAssembler(is_complete)
+    for line in lines:
+        if assembler.feed(line.decode('utf-8')):
+            break
+    return assembler.text, assembler.stopped_early
+
+async def read_stream_async(lines: AsyncIterator[bytes], is_complete: Optional[Completion] = None) -> Tuple[str, bool]:
+    """
+    Reads the lines of a streamed chat completion until the answer is complete, like `read_stream`.
+
+    Args:
+        lines (AsyncIterator[bytes]): The lines of the server-sent events, e.g. `response.content`.
+        is_complete (Optional[Completion]): Recognizes a complete answer, None to read to the end.
+
+    Returns:
+        Tuple[str, bool]: The answer, and whether the stream was left before its end.
+    """
+    assembler = StreamAssembler(is_complete)
+    async for line in lines:
+        if assembler.feed(line.decode('utf-8')):
+            break
+    return assembler.text, assembler.stopped_early
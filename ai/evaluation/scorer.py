@@ -0,0 +1,312 @@
+import argparse
+import csv
+import json
+import re
+import sys
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
+from os import path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+MODIFICATION_REQUESTS = ('correction', 'enhancement')
+MAINTENANCE_TYPES = ('corrective', 'adaptive', 'preventive', 'perfective', 'additive')
+BOOLEANS = ('false', 'true')
+
+# Modification request implied by each maintenance type in the guidelines; adaptive changes
+# may be either, so they are left out when scoring modification requests
+IMPLIED_MODIFICATION_REQUEST = {
+    'corrective': 'correction',
+    'preventive': 'correction',
+    'perfective': 'enhancement',
+    'additive': 'enhancement',
+}
+
+# Codes of the predictions that cannot be scored as a label
+INVALID = -1
+# Code of the commits left out of a task
+UNSCORED = -2
+
+# Keyword lists echoed from the prompt, e.g. "<correction | enhancement>"
+_ECHOED_CHOICES = re.compile(r'<[^<>]*\|[^<>]*>')
+_MODIFICATION_REQUEST = re.compile(r'modification\s+request(?:\s+classification)?\W*(correction|enhancement)\b', re.IGNORECASE)
+_MAINTENANCE_TYPE = re.compile(r'maintenance\s+type\W*(corrective|adaptive|preventive|perfective|additive)\b', re.IGNORECASE)
+_BARE_MODIFICATION_REQUEST = re.compile(r'\b(correction|enhancement)\b', re.IGNORECASE)
+_BARE_MAINTENANCE_TYPE = re.compile(r'\b(corrective|adaptive|preventive|perfective|additive)\b', re.IGNORECASE)
+_JSON_OBJECT = re.compile(r'\{.*?\}', re.DOTALL)
+
+@dataclass(frozen=True)
+class Task:
+    """
+    A label scored against the golden set.
+
+    Attributes:
+        name (str): The name of the task.
+        labels (Tuple[str, ...]): The allowed labels, in the order of the confusion matrices.
+        field (str): The field of the normalized response holding the label.
+    """
+    name: str
+    labels: Tuple[str, ...]
+    field: str
+
+TASKS = (
+    Task('modification_request', MODIFICATION_REQUESTS, 'modification_request'),
+    Task('maintenance_type', MAINTENANCE_TYPES, 'maintenance_type'),
+    Task('what', BOOLEANS, 'what_present'),
+    Task('why', BOOLEANS, 'why_present'),
+)
+
+def _boolean(value) -> Optional[str]:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str) and value.strip().lower() in BOOLEANS:
+        return value.strip().lower()
+    return None
+
+def _first(pattern: re.Pattern, fallback: re.Pattern, text: str) -> Optional[str]:
+    match = pattern.search(text)
+    if match is None:
+        # Answers like "Correction\nCorrective" that drop the field names
+        matches = {keyword.lower() for keyword in fallback.findall(text)}
+        return matches.pop() if len(matches) == 1 else None
+    return match.group(1).lower()
+
+@lru_cache(maxsize=65536)
+def _normalize_text(text: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    fields = {}
+    cleaned = _ECHOED_CHOICES.sub(' ', text).replace('<', ' ').replace('>', ' ')
+    fields['modification_request'] = _first(_MODIFICATION_REQUEST, _BARE_MODIFICATION_REQUEST, cleaned)
+    fields['maintenance_type'] = _first(_MAINTENANCE_TYPE, _BARE_MAINTENANCE_TYPE, cleaned)
+    for candidate in _JSON_OBJECT.findall(text):
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            fields['what_present'] = _boolean(value.get('what_present'))
+            fields['why_present'] = _boolean(value.get('why_present'))
+            break
+    return tuple(fields.items())
+
+def normalize_response(response: Union[str, dict, None]) -> Dict[str, Optional[str]]:
+    """
+    Extracts the labels of a model response, whatever its form: the classification answers
+    ("Modification Request Classification: <correction>", with or without the angle brackets,
+    blank lines or the field names) and the quality answers (a JSON object, parsed or not).
+
+    Args:
+        response (Union[str, dict, None]): The response saved by the notebooks.
+
+    Returns:
+        Dict[str, Optional[str]]: The 'modification_request', 'maintenance_type', 'what_present'
+        and 'why_present' found, None for those missing or ambiguous.
+    """
+    fields = {'modification_request': None, 'maintenance_type': None, 'what_present': None, 'why_present': None}
+    if isinstance(response, dict):
+        fields['what_present'] = _boolean(response.get('what_present'))
+        fields['why_present'] = _boolean(response.get('why_present'))
+    elif isinstance(response, str):
+        fields.update(_normalize_text(response))
+    return fields
+
+def load_golden_labels(golden_set_path: str, chosen_commits_path: str) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """
+    Loads the commits of the golden set and their labels from the annotated commits.
+
+    Args:
+        golden_set_path (str): Path to `golden_set.json`, which gives the commits scored.
+        chosen_commits_path (str): Path to `data/chosen_commits.csv`, with the 'opinion_1', 'what' and 'why' of each commit.
+
+    Returns:
+        Tuple[List[str], Dict[str, np.ndarray]]: The SHAs of the scored commits, and the label codes of
+        each task (UNSCORED for the commits a task leaves out).
+    """
+    with open(golden_set_path, 'r', encoding='utf-8') as file:
+        golden_set = json.load(file)
+    with open(chosen_commits_path, 'r', encoding='utf-8', newline='') as file:
+        annotations = {row['sha']: row for row in csv.DictReader(file)}
+
+    shas = [commit['sha'] for repo in golden_set['repos'] for commit in repo['commits'] if commit['sha'] in annotations]
+    truth = {}
+    for task in TASKS:
+        codes = np.full(len(shas), UNSCORED, dtype=np.int64)
+        for index, sha in enumerate(shas):
+            row = annotations[sha]
+            maintenance_type = row['opinion_1'].strip().lower()
+            if task.name == 'maintenance_type':
+                label = maintenance_type
+            elif task.name == 'modification_request':
+                label = IMPLIED_MODIFICATION_REQUEST.get(maintenance_type)
+            else:
+                label = _boolean(row[task.name])
+            if label in task.labels:
+                codes[index] = task.labels.index(label)
+        truth[task.name] = codes
+    return shas, truth
+
+def load_model_outputs(file_paths: List[str]) -> Dict[str, Dict[str, Union[str, dict, None]]]:
+    """
+    Loads the responses saved by the notebooks: JSON objects mapping each model to its list of
+    responses, or lists of responses with their 'model'. A model found in several files is
+    named after the file too.
+
+    Args:
+        file_paths (List[str]): Paths to the output files.
+
+    Returns:
+        Dict[str, Dict[str, Union[str, dict, None]]]: The response of each model to each SHA.
+    """
+    runs = {}
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        if isinstance(data, list):
+            grouped = {}
+            for record in data:
+                grouped.setdefault(record.get('model', path.basename(file_path)), []).append(record)
+            data = grouped
+        for model, records in data.items():
+            name = model if model not in runs else f'{model} ({path.basename(file_path)})'
+            runs[name] = {record['sha']: record.get('response') for record in records}
+    return runs
+
+def encode_predictions(runs: Dict[str, Dict[str, Union[str, dict, None]]], shas: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Normalizes the responses of every run and encodes their labels.
+
+    Args:
+        runs (Dict[str, Dict[str, Union[str, dict, None]]]): The response of each model to each SHA.
+        shas (List[str]): The SHAs of the scored commits.
+
+    Returns:
+        Dict[str, np.ndarray]: The (models, commits) label codes of each task, INVALID for the
+        responses missing or without the label.
+    """
+    predictions = {task.name: np.full((len(runs), len(shas)), INVALID, dtype=np.int64) for task in TASKS}
+    indexes = {task.name: {label: code for code, label in enumerate(task.labels)} for task in TASKS}
+    for row, responses in enumerate(runs.values()):
+        for column, sha in enumerate(shas):
+            if sha not in responses:
+                continue
+            fields = normalize_response(responses[sha])
+            for task in TASKS:
+                predictions[task.name][row, column] = indexes[task.name].get(fields[task.field], INVALID)
+    return predictions
+
+def score_task(truth: np.ndarray, predictions: np.ndarray, labels: Tuple[str, ...]) -> dict:
+    """
+    Scores the predictions of every model for a task at once.
+
+    Args:
+        truth (np.ndarray): The (commits,) label codes of the golden set.
+        predictions (np.ndarray): The (models, commits) label codes predicted.
+        labels (Tuple[str, ...]): The labels of the task.
+
+    Returns:
+        dict: Per model, the 'commits' scored, 'accuracy', 'kappa' (Cohen's), 'invalid' responses,
+        per-label 'precision' and 'recall', and the 'confusion' matrix whose last column counts the
+        invalid responses.
+    """
+    models = predictions.shape[0]
+    k = len(labels)
+    scored = truth != UNSCORED
+    truth, predictions = truth[scored], predictions[:, scored]
+    n = truth.shape[0]
+
+    # Invalid predictions get their own column, so they count against every metric
+    predicted = np.where(predictions == INVALID, k, predictions)
+    cells = (np.arange(models)[:, None] * k + truth[None, :]) * (k + 1) + predicted
+    confusion = np.bincount(cells.ravel(), minlength=models * k * (k + 1)).reshape(models, k, k + 1)
+
+    correct = np.trace(confusion[:, :, :k], axis1=1, axis2=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diagonal = confusion[:, np.arange(k), np.arange(k)]
+        precision = diagonal / confusion[:, :, :k].sum(axis=1)
+        recall = diagonal / confusion.sum(axis=2)
+        observed = correct / n
+        expected = (confusion.sum(axis=2) * confusion[:, :, :k].sum(axis=1)).sum(axis=1) / n ** 2
+        kappa = (observed - expected) / (1 - expected)
+
+    return {
+        'commits': n,
+        'accuracy': observed,
+        'kappa': kappa,
+        'invalid': confusion[:, :, k].sum(axis=1),
+        'precision': precision,
+        'recall': recall,
+        'confusion': confusion,
+    }
+
+def score_runs(runs: Dict[str, Dict[str, Union[str, dict, None]]], shas: List[str], truth: Dict[str, np.ndarray]) -> Dict[str, dict]:
+    """
+    Scores every run on every task.
+
+    Args:
+        runs (Dict[str, Dict[str, Union[str, dict, None]]]): The response of each model to each SHA.
+        shas (List[str]): The SHAs of the scored commits.
+        truth (Dict[str, np.ndarray]): The label codes of each task, see `load_golden_labels`.
+
+    Returns:
+        Dict[str, dict]: The scores of each task (see `score_task`), with its 'models' and 'labels'.
+        Tasks no run answered are left out.
+    """
+    predictions = encode_predictions(runs, shas)
+    scores = {}
+    for task in TASKS:
+        answered = (predictions[task.name] != INVALID).any(axis=1)
+        if not answered.any():
+            continue
+        task_scores = score_task(truth[task.name], predictions[task.name][answered], task.labels)
+        task_scores['models'] = [model for model, keep in zip(runs, answered) if keep]
+        task_scores['labels'] = task.labels
+        scores[task.name] = task_scores
+    return scores
+
+def summary_rows(scores: Dict[str, dict]) -> List[dict]:
+    """
+    Flattens the scores into one row per model and task, with the per-label precision and recall.
+
+    Args:
+        scores (Dict[str, dict]): The scores returned by `score_runs`.
+
+    Returns:
+        List[dict]: The rows.
+    """
+    rows = []
+    for task, task_scores in scores.items():
+        for index, model in enumerate(task_scores['models']):
+            row = {
+                'model_name': model,
+                'task': task,
+                'commits': task_scores['commits'],
+                'accuracy': round(float(task_scores['accuracy'][index]), 4),
+                'kappa': round(float(task_scores['kappa'][index]), 4),
+                'invalid': int(task_scores['invalid'][index]),
+            }
+            for label_index, label in enumerate(task_scores['labels']):
+                row[f'precision_{label}'] = round(float(task_scores['precision'][index, label_index]), 4)
+                row[f'recall_{label}'] = round(float(task_scores['recall'][index, label_index]), 4)
+            rows.append(row)
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Scores model outputs against the labels of the golden set.')
+    parser.add_argument('outputs', nargs='+', help='Output files saved by the notebooks.')
+    parser.add_argument('--golden-set', default='golden_set.json', help='Path to golden_set.json.')
+    parser.add_argument('--labels', default=path.join('data', 'chosen_commits.csv'), help='Path to the annotated commits.')
+    parser.add_argument('--csv', default=None, help='Writes the scores to this CSV file instead of printing them.')
+    args = parser.parse_args()
+
+    shas, truth = load_golden_labels(args.golden_set, args.labels)
+    rows = summary_rows(score_runs(load_model_outputs(args.outputs), shas, truth))
+    fieldnames = list(dict.fromkeys(name for row in rows for name in row))
+    # sys.stdout is only borrowed, so it is not closed with the CSV file
+    with (open(args.csv, 'w', encoding='utf-8', newline='') if args.csv else nullcontext(sys.stdout)) as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+from os import path
+from sys import path as sys_path
+import argparse
+import asyncio
+import json
+import time
+
+for parent_dir in (path.abspath(path.join('.')), path.abspath(path.join('.', 'ai'))):
+    if parent_dir not in sys_path:
+        sys_path.append(parent_dir)
+
+from client.asyncOpenUiClient import AsyncOpenUiClient
+from client.openUiClient import OpenUiClient
+from client.rateLimiter import RateLimiter, RetryPolicy
+from client.standInServer import StandInServer
+
+def load_commits(file_path: str, limit: int) -> list:
+    """Reads the commits of `evaluate_set.json`, repeating them up to `limit` commits."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    commits = [commit for repo in data['repos'] for commit in repo['commits']]
+    return [commits[i % len(commits)] for i in range(limit)]
+
+def run_sync(client: OpenUiClient, commits: list) -> int:
+    ok = 0
+    for commit in commits:
+        response = client.evaluateCommitQualityChatWithModel(commit_msg=commit['message'], commit_files_changed=commit['files_changed'])
+        ok += response is not None
+    return ok
+
+async def run_async(api_url: str, commits: list, concurrency: int, rate_limiter: RateLimiter) -> int:
+    ok = 0
+    async with AsyncOpenUiClient(api_url, 'stand-in', concurrency=concurrency, rate_limiter=rate_limiter) as client:
+        async for result in client.evaluate_many(commits):
+            ok += result.ok
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measures the throughput of the LLM clients against a local stand-in server.')
+    parser.add_argument('--commits', type=int, default=100, help='Number of commits evaluated.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stand-in takes per completion.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum requests in flight for the async client.')
+    parser.add_argument('--capacity', type=int, default=None, help='Completions the stand-in computes at once; the others queue.')
+    parser.add_argument('--max-queue', type=int, default=None, help='Completions the stand-in queues before answering 429.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of completions the stand-in fails with a 503.')
+    parser.add_argument('--skip-sync', action='store_true', help='Only measure the async client.')
+    args = parser.parse_args()
+
+    commits = load_commits('evaluate_set.json', args.commits)
+    server = StandInServer(port=0, latency=args.latency, error_rate=args.error_rate,
+                           capacity=args.capacity, max_queue=args.max_queue).start_in_thread()
+    retry = RetryPolicy(base_delay=args.latency)
+    try:
+        if not args.skip_sync:
+            start = time.perf_counter()
+            ok = run_sync(OpenUiClient(server.api_url, 'stand-in', RateLimiter(retry=retry)), commits)
+            elapsed = time.perf_counter() - start
+            print(f"{'OpenUiClient':<25} {elapsed:>8.2f}s  {ok / elapsed:>7.1f} commits/s  ({ok} ok)")
+
+        for name, rate_limiter in [
+            ('fixed concurrency', RateLimiter(initial_concurrency=args.concurrency, min_concurrency=args.concurrency, max_concurrency=args.concurrency,
+                                              latency_tolerance=float('inf'), failure_threshold=10 ** 9, retry=retry)),
+            ('adaptive concurrency', RateLimiter(max_concurrency=args.concurrency, retry=retry)),
+        ]:
+            server.max_in_flight = server.rejected = server.requests = 0
+            start = time.perf_counter()
+            ok = asyncio.run(run_async(server.api_url, commits, args.concurrency, rate_limiter))
+            elapsed = time.perf_counter() - start
+            stats = rate_limiter.stats()
+            print(f"{name:<25} {elapsed:>8.2f}s  {ok / elapsed:>7.1f} commits/s  ({ok} ok, "
+                  f"{server.requests} requests, {server.rejected} rejected, {server.max_in_flight} in flight at most, "
+                  f"final limit {stats['concurrency_limit']})")
+    finally:
+        server.stop_thread()
+
+if __name__ == '__main__':
+    main()
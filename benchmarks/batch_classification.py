@@ -0,0 +1,58 @@
+from os import path
+from sys import path as sys_path
+import argparse
+import json
+import time
+
+for parent_dir in (path.abspath(path.join('.')), path.abspath(path.join('.', 'ai'))):
+    if parent_dir not in sys_path:
+        sys_path.append(parent_dir)
+
+from client.knowledgeCache import KnowledgeCache
+from client.openUiClient import OpenUiClient
+from client.prompts import commit_data
+from client.rateLimiter import RateLimiter
+from client.standInServer import StandInServer
+
+KNOWLEDGE = 'ai/knowledge/Guidelines.txt'
+
+def load_commits(file_path: str) -> list:
+    """Reads the commits of `evaluate_set.json`."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    return [commit for repo in data['repos'] for commit in repo['commits']]
+
+def classify_one_by_one(client: OpenUiClient, commits: list) -> int:
+    ok = 0
+    for commit in commits:
+        ok += client.chatWithModel(knowledge=KNOWLEDGE, commit_data=commit_data(commit)) is not None
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compares classifying the commits of evaluate_set.json one per request and in batches, on a local stand-in server.')
+    parser.add_argument('--context-budget', type=int, default=32768, help='Tokens a batched request may take.')
+    parser.add_argument('--max-batch', type=int, default=16, help='Commits per batched request at most.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stand-in takes to generate an answer.')
+    parser.add_argument('--prefill-rate', type=float, default=200000, help='Prompt characters the stand-in reads per second.')
+    parser.add_argument('--miss-rate', type=float, default=0.05, help='Fraction of the commits the stand-in leaves out of batched answers.')
+    args = parser.parse_args()
+
+    commits = load_commits('evaluate_set.json')
+    for name, run in [
+        ('one commit per request', lambda client: classify_one_by_one(client, commits)),
+        ('batched', lambda client: len(client.classifyCommitsBatched(commits, KNOWLEDGE, context_budget=args.context_budget, max_batch=args.max_batch))),
+    ]:
+        server = StandInServer(port=0, latency=args.latency, prefill_rate=args.prefill_rate, prefix_cache=False,
+                               batch_miss_rate=args.miss_rate).start_in_thread()
+        client = OpenUiClient(server.api_url, 'stand-in', RateLimiter(), knowledge_cache=KnowledgeCache(cache_dir=None))
+        try:
+            start = time.perf_counter()
+            ok = run(client)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.stop_thread()
+        print(f"{name:<24} {elapsed:>8.2f}s  {ok}/{len(commits)} classified  {server.requests:>4} requests  "
+              f"{server.prompt_chars / 1e6:>7.2f}M prompt characters")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from os import path
+from sys import path as sys_path
+import argparse
+import subprocess
+import time
+
+parent_dir = path.abspath(path.join('.'))
+if parent_dir not in sys_path:
+    sys_path.append(parent_dir)
+
+from models.file import File, BinaryPolicy
+from utils.git import get_cat_file
+
+def legacy_is_binary(content: bytes) -> bool:
+    """The byte-by-byte loop `File.is_binary` used before, kept as the baseline."""
+    for byte in content:
+        if byte == 0:
+            return True
+        if (byte < 32 or byte > 126) and byte not in [9, 10, 13]:
+            return True
+    return False
+
+def load_blobs(repo_path: str, max_bytes: int) -> list:
+    """Reads the blobs of a repository until `max_bytes` have been collected."""
+    result = subprocess.run(
+        ['git', 'cat-file', '--batch-all-objects', '--batch-check=%(objectname) %(objecttype) %(objectsize)'],
+        cwd=repo_path, stdout=subprocess.PIPE, check=True
+    )
+    cat_file = get_cat_file(repo_path)
+    blobs = []
+    total = 0
+    for line in result.stdout.decode().splitlines():
+        sha, object_type, size = line.split(' ')
+        if object_type != 'blob':
+            continue
+        _, content = cat_file.read(sha)
+        blobs.append(content)
+        total += int(size)
+        if total >= max_bytes:
+            break
+    return blobs
+
+def timed(label: str, func, blobs: list) -> list:
+    start = time.perf_counter()
+    results = func(blobs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:>9.3f}s  ({sum(results)} binary)")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compares the binary content detectors on the blobs of a repository.')
+    parser.add_argument('repo_path', help='Path to a (bare) clone, e.g. download/orgs/aws-samples/<repo>.')
+    parser.add_argument('--max-mb', type=int, default=200, help='Stop reading blobs after this many megabytes.')
+    args = parser.parse_args()
+
+    blobs = load_blobs(args.repo_path, args.max_mb * 1024 * 1024)
+    print(f"{len(blobs)} blobs, {sum(len(blob) for blob in blobs) / 1024 / 1024:.1f} MB")
+
+    baseline = timed('legacy loop', lambda contents: [legacy_is_binary(c) for c in contents], blobs)
+    single = timed('File.is_binary', lambda contents: [File.is_binary(c) for c in contents], blobs)
+    batch = timed('File.are_binary', File.are_binary, blobs)
+    timed('are_binary, 8000 byte prefix', lambda contents: File.are_binary(contents, BinaryPolicy(prefix_limit=8000)), blobs)
+    timed('are_binary, UTF-8 allowed', lambda contents: File.are_binary(contents, BinaryPolicy(allow_high_bytes=True)), blobs)
+
+    assert baseline == single == batch, 'The default policy must classify like the legacy loop'
+
+if __name__ == '__main__':
+    main()
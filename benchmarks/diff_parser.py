@@ -0,0 +1,104 @@
+from os import path
+from sys import path as sys_path
+import argparse
+import re
+import subprocess
+import time
+
+parent_dir = path.abspath(path.join('.'))
+if parent_dir not in sys_path:
+    sys_path.append(parent_dir)
+
+from utils.diff import MetadataHelper, parse_diff
+
+def legacy_parse(stdout: str) -> list:
+    """The line loop `CommitFile.get_metadata` used before, kept as the baseline."""
+    all_metadata = []
+    current_metadata = None
+    hunk_pattern = re.compile(r'@@ -(\d+),(\d+) \+(\d+),(\d+) @@')
+    file_name_pattern = re.compile(r'---\s+(a\/[\w.\-\/]+|\/dev\/null)[\r\n]+\+\+\+\s+(b\/[\w.\-\/]+|\/dev\/null)')
+    change_type_pattern = re.compile(r'(new file mode|deleted file mode|rename|copy)')
+    file_mode_pattern = re.compile(r'(100\d{3})')
+    index_info_pattern = re.compile(r'^(index ([0-9a-f]+)\.\.([0-9a-f]+))$')
+
+    old_name = new_name = change_type = file_mode = index_info = None
+    lines = stdout.split('\n')
+    for index in range(len(lines)):
+        if index != (len(lines) - 1):
+            file_match = file_name_pattern.match(lines[index] + '\n' + lines[index + 1])
+            if file_match:
+                old_name, new_name = file_match.groups()
+
+        change_match = change_type_pattern.match(lines[index])
+        if change_match:
+            change_type = change_match.group(1)
+        elif 'index' in lines[index] and change_type is None:
+            change_type = 'modified'
+            modified_match = re.compile(r'index ([0-9a-f]+)\.\.([0-9a-f]+) ([0-9]+)').match(lines[index])
+            if modified_match:
+                old_sha, new_sha, file_mode = modified_match.groups()
+                index_info = f'index {old_sha}..{new_sha}'
+
+        file_mode_match = file_mode_pattern.search(lines[index])
+        if file_mode_match:
+            file_mode = file_mode_match.group(1)
+
+        index_info_match = index_info_pattern.match(lines[index])
+        if index_info_match:
+            index_info = index_info_match.group(1)
+
+        match = hunk_pattern.match(lines[index])
+        if match:
+            if current_metadata:
+                all_metadata.append(current_metadata)
+            old_start, old_length, new_start, new_length = map(int, match.groups())
+            current_metadata = MetadataHelper(None, 'repo', 'org', None, old_start, old_length, new_start, new_length,
+                                              [], old_name, new_name, change_type, file_mode, index_info)
+        elif current_metadata is not None:
+            current_metadata.lines.append(lines[index])
+
+    if current_metadata:
+        all_metadata.append(current_metadata)
+    return all_metadata
+
+def synthetic_patch(files: int, hunks: int, hunk_lines: int) -> bytes:
+    """Builds a multi-file patch with `hunks` hunks of `hunk_lines` lines per file."""
+    out = ['commit ' + 'a' * 40, 'Author: bench <bench@example.com>', '', '    Synthetic commit', '']
+    for f in range(files):
+        out += [f'diff --git a/src/module_{f}.py b/src/module_{f}.py', 'index 0123456..89abcde 100644',
+                f'--- a/src/module_{f}.py', f'+++ b/src/module_{f}.py']
+        for h in range(hunks):
+            start = h * (hunk_lines + 10) + 1
+            out.append(f'@@ -{start},{hunk_lines} +{start},{hunk_lines} @@ def function_{h}():')
+            for i in range(hunk_lines // 2):
+                out.append(f'-    value = compute({i}, "old") + offset  # index {i}')
+                out.append(f'+    value = compute({i}, "new") + offset  # index {i}')
+    return ('\n'.join(out) + '\n').encode()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measures the throughput of the unified diff parsers.')
+    parser.add_argument('--repo', default=None, help='Parse `git log -p` of this clone instead of a synthetic patch.')
+    parser.add_argument('--max-commits', type=int, default=2000, help='Number of commits read with --repo.')
+    parser.add_argument('--files', type=int, default=500, help='Files in the synthetic patch.')
+    args = parser.parse_args()
+
+    if args.repo:
+        patch = subprocess.run(['git', 'log', '-p', '--no-color', f'-n{args.max_commits}'],
+                               cwd=args.repo, stdout=subprocess.PIPE, check=True).stdout
+    else:
+        patch = synthetic_patch(args.files, 20, 40)
+    megabytes = len(patch) / 1024 / 1024
+    print(f"{megabytes:.1f} MB of patch")
+
+    start = time.perf_counter()
+    legacy = legacy_parse(patch.decode('utf-8', errors='replace'))
+    elapsed = time.perf_counter() - start
+    print(f"{'legacy line loop':<20} {elapsed:>8.3f}s  {megabytes / elapsed:>7.1f} MB/s  ({len(legacy)} hunks)")
+
+    start = time.perf_counter()
+    count = sum(1 for _ in parse_diff(patch.splitlines(True), 'repo', 'org'))
+    elapsed = time.perf_counter() - start
+    print(f"{'DiffParser':<20} {elapsed:>8.3f}s  {megabytes / elapsed:>7.1f} MB/s  ({count} hunks)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from os import path
+from sys import path as sys_path
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+for parent_dir in (path.abspath(path.join('.')), path.abspath(path.join('.', 'ai'))):
+    if parent_dir not in sys_path:
+        sys_path.append(parent_dir)
+
+from client.knowledgeCache import KnowledgeCache
+from client.openUiClient import read_knowledge_files
+from client.prompts import (CLASSIFICATION_TEMPLATE, QUALITY_TEMPLATE, build_classification_prompt, build_quality_prompt,
+                            commit_data, quality_payload)
+from client.standInServer import StandInServer
+
+QUALITY_KNOWLEDGE = ['ai/knowledge/what_makes_a_good_commit_message.pdf',
+                     'ai/knowledge/the_corrective_commit_probability_code_quality_metric.pdf']
+
+def load_commits(file_path: str, limit: int) -> list:
+    """Reads the commits of `evaluate_set.json`, repeating them up to `limit` commits."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    commits = [commit for repo in data['repos'] for commit in repo['commits']]
+    return [commits[i % len(commits)] for i in range(limit)]
+
+def build_messages(task: str, layout: str, knowledge: str, commit: dict) -> list:
+    """Returns the messages the clients send for `commit` with the given prompt layout."""
+    if task == 'classify':
+        if layout == 'prefix':
+            return CLASSIFICATION_TEMPLATE.messages(knowledge, commit_data(commit))
+        return [{'role': 'user', 'content': build_classification_prompt(knowledge, commit_data(commit))}]
+    if layout == 'prefix':
+        return QUALITY_TEMPLATE.messages(knowledge, quality_payload(commit['message'], commit['files_changed']))
+    return [{'role': 'user', 'content': build_quality_prompt(knowledge, commit['message'], commit['files_changed'])}]
+
+async def time_to_first_token(session: aiohttp.ClientSession, api_url: str, messages: list) -> float:
+    """Streams a completion and returns the seconds until its first event, then reads the rest."""
+    start = time.perf_counter()
+    ttft = None
+    async with session.post(f'{api_url}/chat/completions', json={'model': 'llama3:8b', 'messages': messages, 'stream': True}) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            if ttft is None and line.startswith(b'data:'):
+                ttft = time.perf_counter() - start
+    return ttft
+
+async def run(api_url: str, messages: list) -> list:
+    async with aiohttp.ClientSession() as session:
+        return [await time_to_first_token(session, api_url, commit_messages) for commit_messages in messages]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measures the time to first token with and without a stable prompt prefix on a local stand-in server.')
+    parser.add_argument('--commits', type=int, default=30, help='Number of commits sent, one at a time.')
+    parser.add_argument('--task', choices=['classify', 'evaluate'], default='evaluate', help='The prompts sent.')
+    parser.add_argument('--prefill-rate', type=float, default=8000, help='Prompt characters the stand-in reads per second.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stand-in takes to generate an answer.')
+    args = parser.parse_args()
+
+    commits = load_commits('evaluate_set.json', args.commits)
+    if args.task == 'classify':
+        knowledge = KnowledgeCache(cache_dir=None).get('ai/knowledge/Guidelines.txt')
+    else:
+        knowledge = read_knowledge_files(QUALITY_KNOWLEDGE, KnowledgeCache(cache_dir=None))
+
+    print(f"{len(commits)} commits, guidelines of {len(knowledge)} characters, prefill at {args.prefill_rate:g} characters/s")
+    for name, layout, prefix_cache in [
+        ('no prefix cache', 'prefix', False),
+        ('legacy layout', 'legacy', True),
+        ('prefix layout', 'prefix', True),
+    ]:
+        messages = [build_messages(args.task, layout, knowledge, commit) for commit in commits]
+        server = StandInServer(port=0, latency=args.latency, prefill_rate=args.prefill_rate, prefix_cache=prefix_cache).start_in_thread()
+        try:
+            ttfts = asyncio.run(run(server.api_url, messages))
+        finally:
+            server.stop_thread()
+        print(f"{name:<18} TTFT mean {statistics.mean(ttfts) * 1000:>8.1f} ms  p50 {statistics.median(ttfts) * 1000:>8.1f} ms  "
+              f"max {max(ttfts) * 1000:>8.1f} ms  ({server.cached_chars / server.prompt_chars:.0%} of the prompt characters cached)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+from os import path
+from sys import path as sys_path
+import argparse
+import json
+import time
+
+for parent_dir in (path.abspath(path.join('.')), path.abspath(path.join('.', 'ai'))):
+    if parent_dir not in sys_path:
+        sys_path.append(parent_dir)
+
+from client.knowledgeCache import KnowledgeCache
+from client.openUiClient import OpenUiClient
+from client.prompts import commit_data
+from client.rateLimiter import RateLimiter
+from client.standInServer import StandInServer
+
+def load_commits(file_path: str, limit: int) -> list:
+    """Reads the commits of `evaluate_set.json`, repeating them up to `limit` commits."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    commits = [commit for repo in data['repos'] for commit in repo['commits']]
+    return [commits[i % len(commits)] for i in range(limit)]
+
+def run(client: OpenUiClient, task: str, commits: list) -> int:
+    ok = 0
+    for commit in commits:
+        if task == 'classify':
+            response = client.chatWithModel(knowledge='ai/knowledge/Guidelines.txt', commit_data=commit_data(commit))
+        else:
+            response = client.evaluateCommitQualityChatWithModel(knowledge_files=['ai/knowledge/Guidelines.pdf'], commit_msg=commit['message'],
+                                                                 commit_files_changed=commit['files_changed'])
+        ok += response is not None
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compares waiting for whole completions with streaming them and closing the stream once the answer is parsed, on a local stand-in server.')
+    parser.add_argument('--commits', type=int, default=20, help='Number of commits sent, one at a time.')
+    parser.add_argument('--task', choices=['classify', 'evaluate'], default='classify', help='The prompts sent.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stand-in takes to generate an answer.')
+    parser.add_argument('--ramble-words', type=int, default=60, help='Words of explanation the stand-in adds after each answer.')
+    args = parser.parse_args()
+
+    commits = load_commits('evaluate_set.json', args.commits)
+    for name, stream in [('whole completions', False), ('streamed, early close', True)]:
+        server = StandInServer(port=0, latency=args.latency, ramble_words=args.ramble_words).start_in_thread()
+        client = OpenUiClient(server.api_url, 'stand-in', RateLimiter(), knowledge_cache=KnowledgeCache(cache_dir=None), stream=stream)
+        try:
+            start = time.perf_counter()
+            ok = run(client, args.task, commits)
+            elapsed = time.perf_counter() - start
+            # Lets the server notice the closed streams before reading its counters
+            time.sleep(args.latency)
+        finally:
+            server.stop_thread()
+        print(f"{name:<22} {elapsed / len(commits) * 1000:>8.1f} ms per commit  ({ok} ok, "
+              f"{server.generated_words / len(commits):.1f} words generated per commit)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from typing import List, Optional
+from utils.git import git_blob_id
+from utils.postgres import general_add_in_batches, general_fetch_by_args, general_filter_new_in_batches
+
+@dataclass
+class Blob:
+    blob_id: str
+    content: str
+
+    def __str__(self):
+        return f"{self.blob_id} ({len(self.content)} characters)"
+
+    def __repr__(self):
+        return self.__str__()
+
+    @staticmethod
+    def from_content(content: str) -> 'Blob':
+        """Creates the blob of a content, keyed by its git blob id.
+
+        Args:
+            content (str) - The content of the blob.
+
+        Returns:
+            Blob: The blob holding the content.
+        """
+        return Blob(git_blob_id(content), content)
+
+    @staticmethod
+    def filter_new(blobs: List['Blob']) -> List['Blob']:
+        """Keeps only the blobs that are not in the database yet. Only the ids are sent
+        for the check, so known contents are never transferred again.
+
+        Args:
+            blobs (List[Blob]) - The blobs to check.
+
+        Returns:
+            List[Blob]: The blobs missing from the database, in their original order.
+        """
+        new_ids = {row['blob_id'] for row in general_filter_new_in_batches('blobs', [{'blob_id': blob.blob_id} for blob in blobs])}
+        return [blob for blob in blobs if blob.blob_id in new_ids]
+
+    @staticmethod
+    def add_blobs_in_batches(blobs: List['Blob']) -> None:
+        """Adds blobs to the database in batches, skipping the ones already in it.
+
+        Args:
+            blobs (List[Blob]) - The blobs to add.
+        """
+        general_add_in_batches('blobs', [blob.__dict__ for blob in blobs])
+
+    @staticmethod
+    def fetch_content(blob_id: str) -> Optional[str]:
+        """Fetches the content of a blob from the database.
+
+        Args:
+            blob_id (str) - The id of the blob.
+
+        Returns:
+            Optional[str]: The content, or None if the blob is not in the database.
+        """
+        row = general_fetch_by_args('blobs', {'blob_id': blob_id})
+        return row[1] if row else None
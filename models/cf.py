@@ -1,28 +1,19 @@
 from dataclasses import dataclass
 from utils.postgres import general_add, general_exists,\
-    general_exists_in_batches, general_add_in_batches
+    general_exists_in_batches, general_add_in_batches, general_copy_in_batches,\
+    general_iter_all, general_iter_keyset, general_add_in_transaction, iter_batches
 from utils.git import is_merge_commit
-from typing import List, Optional
-import re
+from utils.diff import DiffParser, MetadataHelper
+from utils.keys import commit_ids, file_ids, require
+from models.blob import Blob
+from models.hunk import Hunk
+from typing import Iterable, Iterator, List, Optional, Tuple
 import subprocess
+import tempfile
 import os
 
-@dataclass
-class MetadataHelper:
-    file_name: str    
-    repo_name: str
-    org_name: str
-    sha: str
-    old_start: int
-    old_length: int
-    new_start: int
-    new_length: int
-    lines: list[str]
-    old_name: Optional[str] = None
-    new_name: Optional[str] = None
-    change_type: Optional[str] = None
-    file_mode: Optional[str] = None
-    index_info: Optional[str] = None
+# The columns of `commit_files_view` in the order of the CommitFile fields
+COMMIT_FILE_COLUMNS = ['repo_name', 'org_name', 'file_name', 'sha', 'content', 'change_type', 'file_mode', 'index_info']
 
 @dataclass
 class CommitFile:
@@ -45,6 +36,36 @@ class CommitFile:
     def __repr__(self):
         return self.__str__()
     
+    @staticmethod
+    def to_rows(cfs: List['CommitFile']) -> Tuple[List[dict], List[Blob]]:
+        """Converts commit files to `commit_files` rows, which reference their commit and
+        file by id and their content by blob id, and collects the distinct contents that
+        are not in `blobs` yet.
+        
+        Args:
+            cfs (List[CommitFile]) - The commit files to convert.
+            
+        Returns:
+            Tuple[List[dict], List[Blob]]: The rows, and the blobs to add before them.
+        """
+        commit_keys = [(cf.repo_name, cf.org_name, cf.sha) for cf in cfs]
+        file_keys = [(cf.repo_name, cf.org_name, cf.file_name) for cf in cfs]
+        commits = require(commit_ids(commit_keys), commit_keys, 'Commit')
+        files = require(file_ids(file_keys), file_keys, 'File')
+        
+        rows = []
+        blobs = {}
+        for commit_id, file_id, cf in zip(commits, files, cfs):
+            row = {'commit_id': commit_id, 'file_id': file_id, 'blob_id': None,
+                   'change_type': cf.change_type, 'file_mode': cf.file_mode, 'index_info': cf.index_info}
+            if cf.content is not None:
+                blob = Blob.from_content(cf.content)
+                blobs.setdefault(blob.blob_id, blob)
+                row['blob_id'] = blob.blob_id
+            rows.append(row)
+        
+        return rows, Blob.filter_new(list(blobs.values())) if blobs else []
+    
     @staticmethod
     def add_commit_file(commit_file: 'CommitFile') -> None:
         """Adds a commit file to the database.
@@ -55,7 +76,10 @@ class CommitFile:
         Returns:
             None
         """
-        general_add('commit_files', commit_file.__dict__)
+        rows, blobs = CommitFile.to_rows([commit_file])
+        if blobs:
+            Blob.add_blobs_in_batches(blobs)
+        general_add('commit_files', rows[0])
         
     @staticmethod
     def exists(commit_file: 'CommitFile') -> bool:
@@ -67,7 +91,7 @@ class CommitFile:
         Returns:
             bool: True if the commit file is in the database, False otherwise.
         """
-        return general_exists('commit_files', commit_file)
+        return general_exists('commit_files_view', commit_file)
     
     @staticmethod
     def exists_in_batches(cfs: List['CommitFile']) -> List[bool]:
@@ -79,19 +103,78 @@ class CommitFile:
         Returns:
             List[bool]: A list of booleans indicating if each commit file is in the database.
         """
-        return general_exists_in_batches('commit_files', [{'file_name': cf.file_name, 'sha': cf.sha, 'repo_name': cf.repo_name, 'org_name': cf.org_name} for cf in cfs])
+        commits = commit_ids((cf.repo_name, cf.org_name, cf.sha) for cf in cfs)
+        files = file_ids((cf.repo_name, cf.org_name, cf.file_name) for cf in cfs)
+        return general_exists_in_batches('commit_files', [{'commit_id': commit_id, 'file_id': file_id} for commit_id, file_id in zip(commits, files)])
     
     @staticmethod
-    def add_cfs_in_batches(cfs: List['CommitFile']):
-        """Adds a list of cfs to the database in batches.
+    def filter_new(cfs: List['CommitFile']) -> List['CommitFile']:
+        """Keeps only the commit files that are not in the database yet.
         
         Args:
-            cfs (list) - The list of cfs to add.
+            cfs (List[CommitFile]) - The list of commit files to check.
+            
+        Returns:
+            List[CommitFile]: The commit files missing from the database, in their original order.
         """
-        general_add_in_batches('commit_files', [cf.__dict__ for cf in cfs])
+        return [cf for cf, exists in zip(cfs, CommitFile.exists_in_batches(cfs)) if not exists]
+    
+    @staticmethod
+    def add_cfs_in_batches(cfs: Iterable['CommitFile'], use_copy: bool = False, batch_size: int = 3000):
+        """Adds a list of cfs to the database in batches. The cfs are read `batch_size` at a
+        time, so a generator is never materialised; the ids and new blobs of each batch are
+        resolved before its rows are written, never while a connection is held for them.
         
+        Args:
+            cfs (Iterable[CommitFile]) - The cfs to add.\n
+            use_copy (bool) - If True, the cfs are streamed through `COPY` instead of batched INSERTs.\n
+            batch_size (int) - The number of cfs resolved and written at a time.
+        """
+        for batch in iter_batches(cfs, batch_size):
+            rows, blobs = CommitFile.to_rows(batch)
+            if blobs:
+                Blob.add_blobs_in_batches(blobs)
+            if use_copy:
+                general_copy_in_batches('commit_files', rows)
+            else:
+                general_add_in_batches('commit_files', rows)
+    
     @staticmethod
-    def get_metadata(org_name: str, repo_name: str, sha: str, file_name: str, is_playground: bool = False) -> List['MetadataHelper']:
+    def add_cfs_and_hunks_in_batches(cfs: List['CommitFile'], hunks: List[Hunk]):
+        """Adds commit files and their Hunks to the database in a single transaction,
+        commit files first so the Hunks' foreign keys are satisfied.
+        
+        Args:
+            cfs (List[CommitFile]) - The commit files to add.\n
+            hunks (List[Hunk]) - The Hunks of those commit files.
+        """
+        rows, blobs = CommitFile.to_rows(cfs)
+        general_add_in_transaction([
+            ('blobs', [blob.__dict__ for blob in blobs]),
+            ('commit_files', rows),
+            ('hunks', Hunk.to_rows(hunks)),
+        ])
+        
+    @staticmethod
+    def iter_all(itersize: int = 500, keyset: bool = False) -> Iterator['CommitFile']:
+        """Streams all commit files from the database with constant memory.
+        
+        Args:
+            itersize (int) - The number of commit files fetched per round-trip.\n
+            keyset (bool) - If True, pages by primary key instead of holding a server-side cursor open.
+        
+        Yields:
+            CommitFile: The commit files in the database.
+        """
+        if keyset:
+            rows = general_iter_keyset('commit_files_view', COMMIT_FILE_COLUMNS, itersize, ['commit_id', 'file_id'])
+        else:
+            rows = general_iter_all('commit_files_view', COMMIT_FILE_COLUMNS, itersize)
+        for row in rows:
+            yield CommitFile(*row)
+        
+    @staticmethod
+    def get_metadata(org_name: str, repo_name: str, sha: str, file_name: str, is_playground: bool = False, repo_path: Optional[str] = None) -> List['MetadataHelper']:
         """Fetches all Hunks from a specific commit and file using `git show`.
 
         Args:
@@ -100,15 +183,15 @@ class CommitFile:
             sha (str): The commit SHA to fetch the diffs from.
             file_name (str): The file name to check for in the commit.
             is_playground (bool): If True, uses path suitable for running the code inside the playground folder.
+            repo_path (Optional[str]): Path to the repository, overriding the one derived from `is_playground`.
 
         Returns:
             list[Hunk]: A list of all Hunks parsed from the git diff output.
         """
         try:
-            repo_path = None
-            if is_playground:
+            if repo_path is None and is_playground:
                 repo_path = os.path.join('download', 'orgs', org_name, repo_name)
-            else:
+            elif repo_path is None:
                 repo_path = os.path.join('..', 'download', 'orgs', org_name, repo_name)
 
             git_cmd = ['git', 'show', sha, '--', file_name]
@@ -117,90 +200,24 @@ class CommitFile:
             if is_merge:
                 git_cmd.insert(2, '-m')
             
-            process = subprocess.Popen(
-                git_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=repo_path,
-                encoding='utf-8',
-                errors='replace'
-            )
-            
-            stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                raise RuntimeError(f"Error executing git show: {stderr.strip()}")
-            
-            all_metadata = []
-            current_metadata = None
-            hunk_pattern = re.compile(r'@@ -(\d+),(\d+) \+(\d+),(\d+) @@')
-            file_name_pattern = re.compile(r'---\s+(a\/[\w.\-\/]+|\/dev\/null)[\r\n]+\+\+\+\s+(b\/[\w.\-\/]+|\/dev\/null)')
-            change_type_pattern = re.compile(r'(new file mode|deleted file mode|rename|copy)')
-            file_mode_pattern = re.compile(r'(100\d{3})')
-            index_info_pattern = re.compile(r'^(index ([0-9a-f]+)\.\.([0-9a-f]+))$')
-            
-            old_name = None
-            new_name = None
-            change_type = None
-            file_mode = None
-            index_info = None
-            
-            if stdout:
-                lines = stdout.split('\n')
-                for index in range(len(lines)):
-                    if index != (len(lines) - 1):
-                        candidate_names = lines[index] + '\n'+lines[index+1]
-                        file_match = file_name_pattern.match(candidate_names)
-                        if file_match:
-                            old_name, new_name = file_match.groups()
-                    
-                    change_match = change_type_pattern.match(lines[index])
-                    if change_match:
-                        change_type = change_match.group(1)
-                    elif 'index' in lines[index] and change_type is None:
-                        change_type = 'modified'
-                        modified_pattern = re.compile(r'index ([0-9a-f]+)\.\.([0-9a-f]+) ([0-9]+)')
-                        modified_match = modified_pattern.match(lines[index])
-                        if modified_match:
-                            old_sha, new_sha, mode_of_file = modified_match.groups()
-                            index_info = f'index {old_sha}..{new_sha}'
-                            file_mode = mode_of_file
-                    
-                    file_mode_match = file_mode_pattern.search(lines[index])
-                    if file_mode_match:
-                        file_mode = file_mode_match.group(1)
-                        
-                    index_info_match = index_info_pattern.match(lines[index])
-                    if index_info_match:
-                        index_info = index_info_match.group(1)
-                    
-                    match = hunk_pattern.match(lines[index])
-                    if match:
-                        if current_metadata:
-                            all_metadata.append(current_metadata)
-                        
-                        old_start, old_length, new_start, new_length = map(int, match.groups())
-                        current_metadata = MetadataHelper(
-                            file_name=file_name,
-                            sha=sha,
-                            repo_name=repo_name,
-                            org_name=org_name,
-                            old_start=old_start,
-                            old_length=old_length,
-                            new_start=new_start,
-                            new_length=new_length,
-                            lines=[],
-                            old_name=old_name,
-                            new_name=new_name,
-                            change_type=change_type,
-                            file_mode=file_mode,
-                            index_info=index_info
-                        )
-                    elif current_metadata is not None:
-                        current_metadata.lines.append(lines[index])
-                
-                if current_metadata:
-                    all_metadata.append(current_metadata)
+            # stderr goes to a file, so git never blocks on it while stdout is being parsed
+            with tempfile.TemporaryFile() as stderr_file:
+                process = subprocess.Popen(
+                    git_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr_file,
+                    cwd=repo_path
+                )
                 
+                parser = DiffParser(repo_name, org_name, sha, file_name)
+                all_metadata = list(parser.parse(process.stdout))
+                process.stdout.close()
+                if process.wait() != 0:
+                    stderr_file.seek(0)
+                    stderr = stderr_file.read().decode('utf-8', errors='replace')
+                    raise RuntimeError(f"Error executing git show: {stderr.strip()}")
+            
+            if parser.lines_read:
                 return all_metadata
             else:
                 print(org_name, repo_name, sha, file_name)
@@ -1,12 +1,16 @@
 from datetime import datetime
 from dataclasses import dataclass
-from utils.postgres import general_add, general_exists, general_fetch_all, general_fetch_by_args, general_add_in_batches, general_exists_in_batches
-from utils.git import is_merge_commit
+from utils.postgres import general_add, general_exists, general_fetch_all, general_fetch_by_args, general_fetch_all_by_args, general_add_in_batches, general_exists_in_batches, general_copy_in_batches, general_iter_all, general_iter_keyset, iter_batches
+from utils.git import is_merge_commit, repo_and_org_from_path
+from utils.keys import repo_ids, require
 import pytz
 import subprocess
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 from git import Repo
 
+# The columns of `commits_view` in the order of the Commit fields
+COMMIT_COLUMNS = ['sha', 'repo_name', 'org_name', 'timestamp', 'message']
+
 @dataclass
 class Commit:
     sha: str
@@ -29,6 +33,21 @@ class Commit:
             return False
         return (self.sha, self.repo_name, self.org_name) == (other.sha, other.repo_name, other.org_name)
     
+    @staticmethod
+    def to_rows(commits: List['Commit']) -> List[dict]:
+        """Converts commits to `commits` rows, which reference their repository by id.
+        
+        Args:
+            commits (List[Commit]) - The commits to convert.
+            
+        Returns:
+            List[dict]: The rows, aligned with `commits`.
+        """
+        keys = [(commit.repo_name, commit.org_name) for commit in commits]
+        ids = require(repo_ids(keys), keys, 'Repository')
+        return [{'repo_id': repo_id, 'sha': commit.sha, 'timestamp': commit.timestamp, 'message': commit.message}
+                for repo_id, commit in zip(ids, commits)]
+    
     @staticmethod
     def add_commit(commit: 'Commit') -> 'Commit':
         """Adds a commit to the database.
@@ -39,7 +58,7 @@ class Commit:
         Returns:
             None
         """
-        general_add('commits', commit.__dict__)
+        general_add('commits', Commit.to_rows([commit])[0])
         return commit
 
     @staticmethod
@@ -52,7 +71,7 @@ class Commit:
         Returns:
             bool: True if the commit is in the database, False otherwise.
         """
-        return general_exists('commits', commit.__dict__)
+        return general_exists('commits_view', commit.__dict__)
 
     @staticmethod
     def add_all_commits_from_repo(repo_path: str, cutoff_date: datetime):
@@ -100,23 +119,24 @@ class Commit:
             return []
        
     @staticmethod     
-    def get_commit_data(repo_path: str, cutoff_date: datetime, playground: bool = False) -> List['Commit']:
+    def get_commit_data(repo_path: str, cutoff_date: datetime, playground: bool = False, since: Optional[str] = None) -> List['Commit']:
         """Extracts commit data from the repository and stores it in a list of Commit objects.
 
         Args:
             repo_path (str) - The path to the repository to extract commit data from.\n
             cutoff_date (datetime) - The date to fetch commits until.\n
+            playground (bool) - If True, commits already in the database are kept.\n
+            since (Optional[str]) - Only walk the commits after this one (`since..HEAD`).\n
             
         Returns:
             List[Commit]: A list of Commit objects containing the commit data.
         """
         repo = Repo(repo_path)
 
-        repo_name = repo_path.split("\\")[-1]
-        org_name = repo_path.split("\\")[-2]
+        repo_name, org_name = repo_and_org_from_path(repo_path)
         commits = []
 
-        for commit in repo.iter_commits():
+        for commit in repo.iter_commits(f'{since}..HEAD' if since else None):
             commit_date = datetime.fromtimestamp(commit.committed_date, tz=pytz.UTC)
             if commit_date > cutoff_date:
                 continue
@@ -132,11 +152,10 @@ class Commit:
                     message=message,
                 )
             
-            if not playground:
-                if not Commit.exists(candidate):
-                    commits.append(candidate)
-            else:
-                commits.append(candidate)
+            commits.append(candidate)
+
+        if not playground and commits:
+            commits = Commit.filter_new(commits)
 
         return commits
     
@@ -147,7 +166,38 @@ class Commit:
         Returns:
             list[Commit]: A list of all commits in the database.
         """
-        return [Commit(*commit) for commit in general_fetch_all('commits')]
+        return [Commit(*commit) for commit in general_fetch_all('commits_view', COMMIT_COLUMNS)]
+    
+    @staticmethod
+    def fetch_by_repo(repo_name: str, org_name: str) -> List['Commit']:
+        """Fetches all commits of a repository from the database.
+        
+        Args:
+            repo_name (str) - The name of the repository.\n
+            org_name (str) - The name of the organization the repository belongs to.
+        
+        Returns:
+            List[Commit]: The commits of the repository.
+        """
+        return [Commit(*commit) for commit in general_fetch_all_by_args('commits_view', {'repo_name': repo_name, 'org_name': org_name}, COMMIT_COLUMNS)]
+    
+    @staticmethod
+    def iter_all_commits(itersize: int = 2000, keyset: bool = False) -> Iterator['Commit']:
+        """Streams all commits from all repositories in the database with constant memory.
+        
+        Args:
+            itersize (int) - The number of commits fetched per round-trip.\n
+            keyset (bool) - If True, pages by primary key instead of holding a server-side cursor open.
+        
+        Yields:
+            Commit: The commits in the database.
+        """
+        if keyset:
+            rows = general_iter_keyset('commits_view', COMMIT_COLUMNS, itersize, ['commit_id'])
+        else:
+            rows = general_iter_all('commits_view', COMMIT_COLUMNS, itersize)
+        for row in rows:
+            yield Commit(*row)
     
     @staticmethod
     def fetch_by_commit_sha_and_repo_name(commit_sha: str, repo_name: str) -> 'Commit':
@@ -160,19 +210,28 @@ class Commit:
         Returns:
             Commit: The commit fetched from the database.
         """
-        return Commit(*general_fetch_by_args('commits', {'sha': commit_sha, 'repo_name': repo_name}))
+        return Commit(*general_fetch_by_args('commits_view', {'sha': commit_sha, 'repo_name': repo_name}, COMMIT_COLUMNS))
 
     @staticmethod
-    def add_commit_in_batches(commits: List['Commit']) -> None:
-        """Adds a list of commits to the database in batches.
+    def add_commit_in_batches(commits: Iterable['Commit'], use_copy: bool = False, batch_size: int = 3000) -> None:
+        """Adds a list of commits to the database in batches. The commits are read `batch_size` at a
+        time, so a generator is never materialised; the repository ids of each batch are resolved
+        before its rows are written, never while a connection is held for them.
         
         Args:
-            commits (List[Commit]) - The list of commits to add.
+            commits (Iterable[Commit]) - The commits to add.\n
+            use_copy (bool) - If True, the commits are streamed through `COPY` instead of batched INSERTs.\n
+            batch_size (int) - The number of commits resolved and written at a time.
             
         Returns:
             None
         """
-        general_add_in_batches('commits', [commit.__dict__ for commit in commits])
+        for batch in iter_batches(commits, batch_size):
+            rows = Commit.to_rows(batch)
+            if use_copy:
+                general_copy_in_batches('commits', rows)
+            else:
+                general_add_in_batches('commits', rows)
         
     @staticmethod
     def exist_commits_in_batches(commits: List['Commit']) -> List[bool]:
@@ -184,4 +243,17 @@ class Commit:
         Returns:
             List[bool]: A list of booleans indicating if each commit exists in the database.
         """
-        return general_exists_in_batches('commits', [commit.__dict__ for commit in commits])
\ No newline at end of file
+        ids = repo_ids((commit.repo_name, commit.org_name) for commit in commits)
+        return general_exists_in_batches('commits', [{'repo_id': repo_id, 'sha': commit.sha} for repo_id, commit in zip(ids, commits)])
+    
+    @staticmethod
+    def filter_new(commits: List['Commit']) -> List['Commit']:
+        """Keeps only the commits that are not in the database yet.
+        
+        Args:
+            commits (List[Commit]) - The list of commits to check.
+            
+        Returns:
+            List[Commit]: The commits missing from the database, in their original order.
+        """
+        return [commit for commit, exists in zip(commits, Commit.exist_commits_in_batches(commits)) if not exists]
\ No newline at end of file
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
-from utils.postgres import db_conn, general_add, general_exists, general_fetch_all
+from typing import List
+from utils.postgres import general_add, general_add_in_batches, general_exists, general_fetch_all, general_fetch_by_args
 
 @dataclass
 class Ecosystem:
@@ -20,6 +21,15 @@ class Ecosystem:
         """
         general_add('ecosystems', ecosystem.__dict__)
         
+    @staticmethod
+    def add_ecosystems_in_batches(ecosystems: List['Ecosystem']) -> None:
+        """Adds a list of ecosystems to the database, skipping the ones already in it.
+        
+        Args:
+            ecosystems (List[Ecosystem]) - The ecosystems to add to the database.
+        """
+        general_add_in_batches('ecosystems', [ecosystem.__dict__ for ecosystem in ecosystems])
+        
     @staticmethod
     def is_ecosystem_in_db(ecosystem: 'Ecosystem') -> bool:
         """Checks if an ecosystem is already in the database.
@@ -52,14 +62,6 @@ class Ecosystem:
         Returns:
             Ecosystem: The ecosystem with the specified name.
         """
-        conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-        
-        cursor = conn.cursor()
-        cursor.execute(f"""SELECT * FROM ecosystems WHERE eco_name = '{name}';""")
-        
-        ecosystem = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        ecosystem = general_fetch_by_args('ecosystems', {'eco_name': name})
         
         return Ecosystem(ecosystem[0])
\ No newline at end of file
@@ -1,10 +1,38 @@
 from utils.postgres import general_add, general_exists, general_fetch_all, \
-    general_add_in_batches, general_exists_in_batches
+    general_add_in_batches, general_exists_in_batches, general_copy_in_batches, \
+    general_iter_all, general_iter_keyset, iter_batches
+from utils.git import get_cat_file
+from utils.keys import repo_ids, require
 from dataclasses import dataclass
-from typing import List, Tuple
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
 import re
 import subprocess
 
+# The columns of `files_view` in the order of the File fields
+FILE_COLUMNS = ['file_name', 'repo_name', 'org_name', 'type']
+
+# Printable ASCII plus tab, newline and carriage return
+_PRINTABLE_BYTES = bytes([9, 10, 13]) + bytes(range(32, 127))
+
+@dataclass(frozen=True)
+class BinaryPolicy:
+    """How `File.is_binary` tells binary contents from text.
+
+    The defaults flag any byte outside printable ASCII, tab, newline and carriage
+    return, over the whole content.
+    """
+    # Only the first `prefix_limit` bytes are inspected, all of them if None
+    prefix_limit: Optional[int] = None
+    # If True, bytes above 127 (e.g. UTF-8 encoded text) do not make a content binary
+    allow_high_bytes: bool = False
+
+_binary_policy = BinaryPolicy()
+
+@lru_cache(2)
+def _text_bytes(allow_high_bytes: bool) -> bytes:
+    return _PRINTABLE_BYTES + bytes(range(128, 256)) if allow_high_bytes else _PRINTABLE_BYTES
+
 @dataclass
 class File:
     file_name: str
@@ -27,6 +55,20 @@ class File:
         return (self.file_name, self.repo_name, self.org_name, self.type) == \
                (other.file_name, other.repo_name, other.org_name, other.type)
     
+    @staticmethod
+    def to_rows(files: List['File']) -> List[dict]:
+        """Converts files to `files` rows, which reference their repository by id.
+        
+        Args:
+            files (List[File]) - The files to convert.
+            
+        Returns:
+            List[dict]: The rows, aligned with `files`.
+        """
+        keys = [(file.repo_name, file.org_name) for file in files]
+        ids = require(repo_ids(keys), keys, 'Repository')
+        return [{'repo_id': repo_id, 'file_name': file.file_name, 'type': file.type} for repo_id, file in zip(ids, files)]
+    
     @staticmethod
     def add_file(file: 'File') -> None:
         """Adds a file to the database.
@@ -37,16 +79,25 @@ class File:
         Returns:
             None
         """
-        general_add('files', file.__dict__)
+        general_add('files', File.to_rows([file])[0])
         
     @staticmethod
-    def add_files_in_batches(files: List['File']):
-        """Adds a list of files to the database in batches.
+    def add_files_in_batches(files: Iterable['File'], use_copy: bool = False, batch_size: int = 3000):
+        """Adds a list of files to the database in batches. The files are read `batch_size` at a
+        time, so a generator is never materialised; the repository ids of each batch are resolved
+        before its rows are written, never while a connection is held for them.
         
         Args:
-            files (list) - The list of files to add.
+            files (Iterable[File]) - The files to add.\n
+            use_copy (bool) - If True, the files are streamed through `COPY` instead of batched INSERTs.\n
+            batch_size (int) - The number of files resolved and written at a time.
         """
-        general_add_in_batches('files', [file.__dict__ for file in files])
+        for batch in iter_batches(files, batch_size):
+            rows = File.to_rows(batch)
+            if use_copy:
+                general_copy_in_batches('files', rows)
+            else:
+                general_add_in_batches('files', rows)
         
     @staticmethod
     def exists(file: 'File') -> bool:
@@ -58,7 +109,7 @@ class File:
         Returns:
             bool: True if the file is in the database, False otherwise.
         """
-        return general_exists('files', file.__dict__)
+        return general_exists('files_view', file.__dict__)
     
     @staticmethod
     def exists_by_args(file_name: str, sha: str, repo_name: str, org_name: str) -> bool:
@@ -73,7 +124,7 @@ class File:
         Returns:
             bool: True if the file is in the database, False otherwise.
         """
-        return general_exists('files', {'file_name': file_name, 'sha': sha, 'repo_name': repo_name, 'org_name': org_name})
+        return general_exists('files_view', {'file_name': file_name, 'sha': sha, 'repo_name': repo_name, 'org_name': org_name})
     
     @staticmethod
     def exists_in_batches(files: List['File']) -> List[bool]:
@@ -85,7 +136,20 @@ class File:
         Returns:
             list: A list of booleans indicating if each file is in the database.
         """
-        return general_exists_in_batches('files', [file.__dict__ for file in files])
+        ids = repo_ids((file.repo_name, file.org_name) for file in files)
+        return general_exists_in_batches('files', [{'repo_id': repo_id, 'file_name': file.file_name} for repo_id, file in zip(ids, files)])
+    
+    @staticmethod
+    def filter_new(files: List['File']) -> List['File']:
+        """Keeps only the files that are not in the database yet.
+        
+        Args:
+            files (list) - The list of files to check.
+            
+        Returns:
+            list: The files missing from the database, in their original order.
+        """
+        return [file for file, exists in zip(files, File.exists_in_batches(files)) if not exists]
     
     @staticmethod
     def fetch_all() -> List['File']:
@@ -94,7 +158,25 @@ class File:
         Returns:
             list: A list of all files in the database.
         """
-        return [File(*file) for file in general_fetch_all('files')]
+        return [File(*file) for file in general_fetch_all('files_view', FILE_COLUMNS)]
+    
+    @staticmethod
+    def iter_all(itersize: int = 2000, keyset: bool = False) -> Iterator['File']:
+        """Streams all files from the database with constant memory.
+        
+        Args:
+            itersize (int) - The number of files fetched per round-trip.\n
+            keyset (bool) - If True, pages by primary key instead of holding a server-side cursor open.
+        
+        Yields:
+            File: The files in the database.
+        """
+        if keyset:
+            rows = general_iter_keyset('files_view', FILE_COLUMNS, itersize, ['file_id'])
+        else:
+            rows = general_iter_all('files_view', FILE_COLUMNS, itersize)
+        for row in rows:
+            yield File(*row)
     
     @staticmethod
     def get_file_status(repo_path: str, commit_sha: str, file_path: str) -> str:
@@ -112,11 +194,7 @@ class File:
             Exception: If there is an error running the git command.
         """
         try:
-            result = subprocess.check_output(
-                ['git', 'diff', '--name-status', f'{commit_sha}^', commit_sha],
-                cwd=repo_path,
-                text=True
-            )
+            result = File._name_status(repo_path, commit_sha)
             if re.search(rf'^D\t{re.escape(file_path)}$', result, re.MULTILINE):
                 return 'deleted'
             if re.search(rf'^M\t{re.escape(file_path)}$', result, re.MULTILINE):
@@ -132,10 +210,22 @@ class File:
         except subprocess.CalledProcessError as e:
             raise Exception(f"Error determining file status: {e.stderr.strip()}")
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _name_status(repo_path: str, commit_sha: str) -> str:
+        """Runs `git diff --name-status` once per commit, since every file of the commit
+        shares the same output."""
+        return subprocess.check_output(
+            ['git', 'diff', '--name-status', f'{commit_sha}^', commit_sha],
+            cwd=repo_path,
+            text=True
+        )
+
     @staticmethod
     def get_file_content(repo_path: str, commit_sha: str, file_path: str) -> Tuple[str, str]:
         """
         Returns the content of the file as a string, handling deleted files and submodules.
+        The content is read through the pooled `git cat-file --batch` process of the repository.
 
         Args:
             repo_path (str): Path to the git repository.
@@ -157,47 +247,75 @@ class File:
         if file_status == 'renamed':
             return 'File was renamed in this commit', file_path
         else:
-            try:
-                file_content = subprocess.check_output(
-                    ['git', 'show', f'{commit_sha}:{file_path}'],
-                    cwd=repo_path,
-                    stderr=subprocess.PIPE
-                )
-
-                if File.is_binary(file_content):
-                    return '<binary content>', file_path
-                
-                file_content = file_content.decode('utf-8', errors='replace')
-                
-                if not file_content.strip():
-                    return "File is empty", file_path
-                
-                return file_content, file_path
-            
-            except subprocess.CalledProcessError as e:
-                if "does not exist" in e.stderr.decode():
-                    return "Couldn't retrieve content", file_path
-                print(f"Error occurred while retrieving file: {e.stderr.strip()}")
+            _, file_content = get_cat_file(repo_path).read(f'{commit_sha}:{file_path}')
+            if file_content is None:
+                return "Couldn't retrieve content", file_path
+
+            if File.is_binary(file_content):
+                return '<binary content>', file_path
+
+            file_content = file_content.decode('utf-8', errors='replace')
+
+            if not file_content.strip():
+                return "File is empty", file_path
+
+            return file_content, file_path
 
     @staticmethod
-    def is_binary(content: bytes) -> bool:
+    def is_binary(content: bytes, policy: Optional['BinaryPolicy'] = None) -> bool:
         """
         Determines if the content is binary by checking for non-printable characters.
+        The check runs in C: the printable bytes are deleted with `bytes.translate` and
+        the content is binary if anything is left.
         Args:
             content (bytes): The content of the file in byte form.
+            policy (Optional[BinaryPolicy]): The policy to apply, the one set with
+                `File.set_binary_policy` if None.
         
         Returns:
             bool: True if the file is binary, False if it's a text file.
         """
-        for byte in content:
-            if byte == 0:  # Null byte
-                return True
-            # Check for non-printable ASCII characters (excluding carriage return (13), newlines (10), tabs (9))
-            if (byte < 32 or byte > 126) and byte not in [9, 10, 13]:
-                        return True
+        policy = policy or _binary_policy
+        if policy.prefix_limit is not None:
+            content = content[:policy.prefix_limit]
+
+        if b'\x00' in content:
+            return True
+        return bool(content.translate(None, _text_bytes(policy.allow_high_bytes)))
+
+    @staticmethod
+    def are_binary(contents: Iterable[bytes], policy: Optional['BinaryPolicy'] = None) -> List[bool]:
+        """
+        Classifies many contents at once with the same policy.
+        Args:
+            contents (Iterable[bytes]): The contents of the files in byte form.
+            policy (Optional[BinaryPolicy]): The policy to apply, the one set with
+                `File.set_binary_policy` if None.
         
-        return False
+        Returns:
+            List[bool]: Whether each content is binary, in the same order.
+        """
+        policy = policy or _binary_policy
+        limit = policy.prefix_limit
+        text_bytes = _text_bytes(policy.allow_high_bytes)
 
+        results = []
+        for content in contents:
+            if limit is not None:
+                content = content[:limit]
+            results.append(b'\x00' in content or bool(content.translate(None, text_bytes)))
+        return results
+
+    @staticmethod
+    def set_binary_policy(policy: 'BinaryPolicy') -> None:
+        """
+        Sets the policy `File.is_binary` applies by default, e.g. to only inspect the
+        first 8000 bytes of each content like git does.
+        Args:
+            policy (BinaryPolicy): The new default policy.
+        """
+        global _binary_policy
+        _binary_policy = policy
 
     @staticmethod
     def is_submodule(repo_path: str, commit_sha: str, file_path: str) -> bool:
@@ -211,17 +329,4 @@ class File:
         Returns:
             bool: True if the file is a submodule, False otherwise.
         """
-        try:
-            result = subprocess.check_output(
-                ['git', 'ls-tree', commit_sha, file_path],
-                cwd=repo_path,
-                stderr=subprocess.PIPE
-            ).decode().strip()
-
-            if result.startswith('160000'):
-                return True  # 160000 is the object type for submodules
-
-            return False
-
-        except subprocess.CalledProcessError:
-            return False
\ No newline at end of file
+        return get_cat_file(repo_path).mode(commit_sha, file_path) == '160000'  # 160000 is the object type for submodules
@@ -1,10 +1,16 @@
 from dataclasses import dataclass
-from utils.postgres import general_add, general_exists, general_fetch_all, general_add_in_batches
-from typing import List, Optional
+from utils.postgres import general_add, general_exists, general_fetch_all, general_add_in_batches, general_copy_in_batches, \
+    general_iter_all, general_iter_keyset, iter_batches
+from utils.keys import commit_ids, file_ids, require
+from typing import Iterable, Iterator, List, Optional
 import re
 import subprocess
 import os
 
+# The columns of `hunks_view` in the order of the Hunk fields
+HUNK_COLUMNS = ['id', 'file_name', 'repo_name', 'org_name', 'sha', 'old_start', 'old_length',
+                'new_start', 'new_length', 'lines', 'old_name', 'new_name']
+
 @dataclass
 class Hunk:
     id: int
@@ -33,6 +39,34 @@ class Hunk:
     def __repr__(self):
         return self.__str__()
     
+    @staticmethod
+    def to_rows(hunks: List['Hunk']) -> List[dict]:
+        """Converts Hunks to `hunks` rows, which reference their commit file by the ids
+        of its commit and file. The ids are left for the database to assign.
+        
+        Args:
+            hunks (List[Hunk]) - The Hunks to convert.
+            
+        Returns:
+            List[dict]: The rows, aligned with `hunks`.
+        """
+        commit_keys = [(hunk.repo_name, hunk.org_name, hunk.sha) for hunk in hunks]
+        file_keys = [(hunk.repo_name, hunk.org_name, hunk.file_name) for hunk in hunks]
+        commits = require(commit_ids(commit_keys), commit_keys, 'Commit')
+        files = require(file_ids(file_keys), file_keys, 'File')
+        
+        return [{
+            'commit_id': commit_id,
+            'file_id': file_id,
+            'old_start': hunk.old_start,
+            'old_length': hunk.old_length,
+            'new_start': hunk.new_start,
+            'new_length': hunk.new_length,
+            'lines': hunk.lines,
+            'old_name': hunk.old_name,
+            'new_name': hunk.new_name
+        } for commit_id, file_id, hunk in zip(commits, files, hunks)]
+    
     @staticmethod
     def add_hunk(hunk: 'Hunk') -> None:
         """Adds a Hunk to the database.
@@ -43,28 +77,28 @@ class Hunk:
         Returns:
             None
         """
-        hunk_dict = hunk.__dict__
-        if not hunk_dict["id"]: del hunk_dict['id']
-        
-        general_add('hunks', hunk_dict)
+        general_add('hunks', Hunk.to_rows([hunk])[0])
         
     @staticmethod
-    def add_hunks_in_batches(hunks: List['Hunk']) -> None:
-        """Adds a list of Hunks to the database in batches.
+    def add_hunks_in_batches(hunks: Iterable['Hunk'], use_copy: bool = False, batch_size: int = 3000) -> None:
+        """Adds a list of Hunks to the database in batches. The Hunks are read `batch_size` at a
+        time, so a generator is never materialised; the commit and file ids of each batch are resolved
+        before its rows are written, never while a connection is held for them.
         
         Args:
-            hunks (list) - The list of Hunks to add to the database.
+            hunks (Iterable[Hunk]) - The Hunks to add to the database.\n
+            use_copy (bool) - If True, the Hunks are streamed through `COPY` instead of batched INSERTs.\n
+            batch_size (int) - The number of Hunks resolved and written at a time.
             
         Returns:
             None
         """
-        hunks_in_dict = []
-        for hunk in hunks:
-            hunk_dict = hunk.__dict__
-            del hunk_dict['id']
-            hunks_in_dict.append(hunk_dict)
-        
-        general_add_in_batches('hunks', hunks_in_dict)
+        for batch in iter_batches(hunks, batch_size):
+            rows = Hunk.to_rows(batch)
+            if use_copy:
+                general_copy_in_batches('hunks', rows)
+            else:
+                general_add_in_batches('hunks', rows)
     
     @staticmethod
     def exists(hunk: 'Hunk') -> bool:
@@ -77,7 +111,7 @@ class Hunk:
             bool: True if the Hunk exists in the database, False otherwise.
         """
         
-        return general_exists('hunks', hunk.__dict__)
+        return general_exists('hunks_view', hunk.__dict__)
     
     @staticmethod
     def fetch_all() -> List['Hunk']:
@@ -87,4 +121,23 @@ class Hunk:
             list: A list of all Hunks in the database.
         """
         
-        return general_fetch_all('hunks')
+        return general_fetch_all('hunks_view', ['id', 'file_name', 'repo_name', 'org_name', 'sha', 'old_start', 'new_start',
+                                                'old_length', 'new_length', 'old_name', 'new_name', 'lines'])
+    
+    @staticmethod
+    def iter_all(itersize: int = 2000, keyset: bool = False) -> Iterator['Hunk']:
+        """Streams all Hunks from the database with constant memory.
+        
+        Args:
+            itersize (int) - The number of Hunks fetched per round-trip.\n
+            keyset (bool) - If True, pages by id instead of holding a server-side cursor open.
+        
+        Yields:
+            Hunk: The Hunks in the database.
+        """
+        if keyset:
+            rows = general_iter_keyset('hunks_view', HUNK_COLUMNS, itersize, ['id'])
+        else:
+            rows = general_iter_all('hunks_view', HUNK_COLUMNS, itersize)
+        for row in rows:
+            yield Hunk(*row)
\ No newline at end of file
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
-from utils.postgres import general_add, general_exists, general_fetch_all
+from typing import List
+from utils.postgres import general_add, general_add_in_batches, general_exists, general_fetch_all
 
 @dataclass
 class Organization:
@@ -22,6 +23,15 @@ class Organization:
         """
         general_add('organizations', organization.__dict__)
         
+    @staticmethod
+    def add_organizations_in_batches(organizations: List['Organization']) -> None:
+        """Adds a list of organizations to the database, skipping the ones already in it.
+        
+        Args:
+            organizations (List[Organization]) - The organizations to add to the database.
+        """
+        general_add_in_batches('organizations', [organization.__dict__ for organization in organizations])
+        
     @staticmethod
     def is_organization_in_db(organization: 'Organization') -> bool:
         """Checks if an organization is already in the database.
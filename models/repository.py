@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from datetime import datetime
-from utils.postgres import general_add, general_exists, db_conn
+from os import path
+from typing import List
+from utils.postgres import general_add, general_add_in_batches, general_exists, general_fetch_by_args
 import pandas as pd
 
 @dataclass
@@ -32,6 +34,15 @@ class Repository:
         """
         general_add('repositories', repo.__dict__)
         
+    @staticmethod
+    def add_repositories_in_batches(repos: List['Repository']) -> None:
+        """Adds a list of repositories to the database in batches, skipping the ones already in it.
+        
+        Args:
+            repos (List[Repository]) - The repositories to add to the database.
+        """
+        general_add_in_batches('repositories', [repo.__dict__ for repo in repos])
+        
     @staticmethod
     def is_repo_in_db(repo_name: str) -> bool:
         """Checks if a repository is in the database.
@@ -56,15 +67,7 @@ class Repository:
             Repository - The repository fetched from the database.
         """
         
-        conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-        cursor = conn.cursor()
-        
-        cursor.execute(f"SELECT * FROM repositories WHERE repo_name = '{repo_name}' AND org_name = '{org_name}';")
-        
-        row = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        row = general_fetch_by_args('repositories', {'repo_name': repo_name, 'org_name': org_name})
         
         repo = Repository.tuple_to_Repository(row)
         return repo
@@ -123,11 +126,14 @@ class Repository:
         except Exception as e:
             print(e)
             
-    def get_repo_path(self) -> str:
+    def get_repo_path(self, parent_folder: str = path.join('download', 'orgs')) -> str:
         """Returns the path to the repository.
         
+        Args:
+            parent_folder (str) - The path to the folder containing all organizations.
+        
         Returns:
             str - The path to the repository.
         """
         
-        return f'download\\orgs\\{self.org_name}\\{self.repo_name}'
\ No newline at end of file
+        return path.join(parent_folder, self.org_name, self.repo_name)
\ No newline at end of file
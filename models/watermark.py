@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from utils.postgres import general_fetch_by_args, general_upsert
+
+@dataclass
+class Watermark:
+    repo_name: str
+    org_name: str
+    last_sha: str
+    refs_state: str
+    updated_at: datetime
+    
+    def __str__(self):
+        return f"{self.org_name}/{self.repo_name} @ {self.last_sha} ({self.updated_at})"
+    
+    def __repr__(self):
+        return self.__str__()
+    
+    @staticmethod
+    def fetch(repo_name: str, org_name: str) -> Optional['Watermark']:
+        """Fetches the watermark of a repository from the database.
+        
+        Args:
+            repo_name (str) - The name of the repository.\n
+            org_name (str) - The name of the organization.
+            
+        Returns:
+            Optional[Watermark]: The watermark, or None if the repository was never ingested incrementally.
+        """
+        row = general_fetch_by_args('repo_watermarks', {'repo_name': repo_name, 'org_name': org_name})
+        return Watermark(*row) if row else None
+    
+    @staticmethod
+    def save(watermark: 'Watermark') -> None:
+        """Adds or replaces the watermark of a repository in the database.
+        
+        Args:
+            watermark (Watermark) - The watermark to save.
+        """
+        general_upsert('repo_watermarks', watermark.__dict__, ['repo_name', 'org_name'])
@@ -0,0 +1,204 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Union
+import re
+
+HUNK_PATTERN = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+MODE_PATTERN = re.compile(r'^(?:new file mode|deleted file mode|new mode) (\d{6})$')
+INDEX_PATTERN = re.compile(r'^(index [0-9a-f]+\.\.[0-9a-f]+)(?: (\d{6}))?$')
+CHANGE_TYPE_PATTERN = re.compile(r'^(new file mode|deleted file mode|rename|copy)')
+COMMIT_PATTERN = re.compile(r'^commit ([0-9a-f]{40})')
+
+@dataclass
+class MetadataHelper:
+    file_name: str
+    repo_name: str
+    org_name: str
+    sha: str
+    old_start: int
+    old_length: int
+    new_start: int
+    new_length: int
+    lines: list[str]
+    old_name: Optional[str] = None
+    new_name: Optional[str] = None
+    change_type: Optional[str] = None
+    file_mode: Optional[str] = None
+    index_info: Optional[str] = None
+
+def unquote_path(raw: str) -> str:
+    """Undoes the C-style quoting git applies to paths with unusual characters.
+
+    Args:
+        raw (str) - The path as printed by git.
+
+    Returns:
+        str: The unquoted path.
+    """
+    if not (raw.startswith('"') and raw.endswith('"')):
+        return raw
+    return raw[1:-1].encode('ascii').decode('unicode_escape').encode('latin-1').decode('utf-8', errors='replace')
+
+def _strip_prefix(name: Optional[str]) -> Optional[str]:
+    if name is None or name == '/dev/null':
+        return None
+    return name[2:] if name[:2] in ('a/', 'b/') else name
+
+def _path_from_diff_git(line: str) -> Optional[str]:
+    """Returns the new path of a `diff --git a/<old> b/<new>` line. Unquoted paths
+    containing ' b/' are ambiguous there; the `+++`/`rename to` lines settle them."""
+    rest = line[len('diff --git '):]
+    if rest.endswith('"'):
+        return _strip_prefix(unquote_path(rest[rest.rindex(' "') + 1:]))
+    index = rest.rfind(' b/')
+    return rest[index + 3:] if index != -1 else None
+
+class DiffParser:
+    """A single-pass state machine over the output of `git show`, `git log -p` or
+    `git diff`, including multi-file patches and the one-diff-per-parent output of
+    `-m` on merges. Every line is looked at once, and only the header lines are
+    matched against a regular expression.
+
+    A hunk's body is delimited by the line counts of its `@@` header, so removed lines
+    that look like headers (e.g. `--- a`) are kept in the hunk. Omitted lengths
+    (`@@ -1 +1 @@`) count as 1.
+    """
+
+    def __init__(self, repo_name: str, org_name: str, sha: Optional[str] = None, file_name: Optional[str] = None):
+        self.repo_name = repo_name
+        self.org_name = org_name
+        self.sha = sha
+        self.fixed_sha = sha is not None
+        self.file_name = file_name
+        self.lines_read = 0
+        self._reset_section(None)
+        self.hunk: Optional[MetadataHelper] = None
+        self.old_remaining = 0
+        self.new_remaining = 0
+
+    def _reset_section(self, path: Optional[str]) -> None:
+        self.path = path
+        self.old_name = None
+        self.new_name = None
+        self.change_type = None
+        self.file_mode = None
+        self.index_info = None
+
+    def parse(self, lines: Iterable[Union[str, bytes]]) -> Iterator[MetadataHelper]:
+        """Parses the lines of a diff, given as text or as the raw bytes read from a
+        subprocess pipe, and yields each hunk once its last line has been read.
+
+        Args:
+            lines (Iterable[Union[str, bytes]]) - The lines of the diff.
+
+        Yields:
+            MetadataHelper: The hunks, with the header fields of their file section.
+        """
+        for raw_line in lines:
+            line = raw_line.decode('utf-8', errors='replace') if isinstance(raw_line, bytes) else raw_line
+            if line.endswith('\n'):
+                line = line[:-1]
+            self.lines_read += 1
+
+            hunk = self.hunk
+            if hunk is not None:
+                first = line[:1]
+                if self.old_remaining > 0 or self.new_remaining > 0:
+                    if first == ' ' or first == '':
+                        self.old_remaining -= 1
+                        self.new_remaining -= 1
+                        hunk.lines.append(line)
+                        continue
+                    if first == '-':
+                        self.old_remaining -= 1
+                        hunk.lines.append(line)
+                        continue
+                    if first == '+':
+                        self.new_remaining -= 1
+                        hunk.lines.append(line)
+                        continue
+                if first == '\\':
+                    hunk.lines.append(line)
+                    continue
+
+                self.hunk = None
+                yield hunk
+
+            self._feed_header(line)
+
+        if self.hunk is not None:
+            yield self.hunk
+            self.hunk = None
+
+    def _feed_header(self, line: str) -> None:
+        if line.startswith('@@ '):
+            match = HUNK_PATTERN.match(line)
+            if match:
+                self._start_hunk(match)
+            return
+
+        if line.startswith('diff --git '):
+            self._reset_section(_path_from_diff_git(line))
+        elif line.startswith('commit '):
+            match = COMMIT_PATTERN.match(line)
+            if match and not self.fixed_sha:
+                self.sha = match.group(1)
+        elif line.startswith('index '):
+            match = INDEX_PATTERN.match(line)
+            if match:
+                self.index_info = match.group(1)
+                if match.group(2):
+                    self.file_mode = match.group(2)
+                if self.change_type is None:
+                    self.change_type = 'modified'
+        elif line.startswith('--- '):
+            self.old_name = unquote_path(line[4:].rstrip('\t'))
+        elif line.startswith('+++ '):
+            self.new_name = unquote_path(line[4:].rstrip('\t'))
+            self.path = _strip_prefix(self.new_name) or _strip_prefix(self.old_name) or self.path
+        elif line.startswith(('new file mode ', 'deleted file mode ', 'new mode ', 'rename ', 'copy ')):
+            change_match = CHANGE_TYPE_PATTERN.match(line)
+            if change_match:
+                self.change_type = change_match.group(1)
+            mode_match = MODE_PATTERN.match(line)
+            if mode_match:
+                self.file_mode = mode_match.group(1)
+            if line.startswith(('rename to ', 'copy to ')):
+                self.path = unquote_path(line.split(' ', 2)[2])
+
+    def _start_hunk(self, match: re.Match) -> None:
+        old_start, old_length, new_start, new_length = match.groups()
+        old_length = int(old_length) if old_length is not None else 1
+        new_length = int(new_length) if new_length is not None else 1
+        self.old_remaining = old_length
+        self.new_remaining = new_length
+        self.hunk = MetadataHelper(
+            file_name=self.file_name or self.path,
+            repo_name=self.repo_name,
+            org_name=self.org_name,
+            sha=self.sha,
+            old_start=int(old_start),
+            old_length=old_length,
+            new_start=int(new_start),
+            new_length=new_length,
+            lines=[],
+            old_name=self.old_name,
+            new_name=self.new_name,
+            change_type=self.change_type,
+            file_mode=self.file_mode,
+            index_info=self.index_info
+        )
+
+def parse_diff(lines: Iterable[Union[str, bytes]], repo_name: str, org_name: str, sha: Optional[str] = None, file_name: Optional[str] = None) -> Iterator[MetadataHelper]:
+    """Streams the hunks of a diff as `MetadataHelper` records.
+
+    Args:
+        lines (Iterable[Union[str, bytes]]) - The lines of the diff, e.g. a subprocess' stdout.\n
+        repo_name (str) - The repository name set on every record.\n
+        org_name (str) - The organization name set on every record.\n
+        sha (Optional[str]) - The commit of the diff; taken from the `commit <sha>` lines if None.\n
+        file_name (Optional[str]) - The file name set on every record; taken from each file's header if None.
+
+    Yields:
+        MetadataHelper: The hunks of the diff, in order.
+    """
+    return DiffParser(repo_name, org_name, sha, file_name).parse(lines)
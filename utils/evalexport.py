@@ -0,0 +1,224 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import logging
+
+from models.cf import CommitFile
+from models.commit import Commit
+from models.file import File
+from utils.evalset import EvalSetWriter
+from utils.worker import get_optimal_max_workers
+
+# The labels that follow the sha and message of a commit in the evaluation set
+LABEL_FIELDS = ('what', 'why', 'files_changed')
+
+def export_commit(repo_path: str, org_name: str, repo_name: str, commit_info: tuple) -> Tuple[Optional[dict], List[str]]:
+    """Builds the entry of a commit of a golden or evaluation set: its message, link, labels and,
+    for every file with changes, its current content and the lines of its hunks.
+
+    Args:
+        repo_path (str) - The path to the repository.\n
+        org_name (str) - The organization of the repository.\n
+        repo_name (str) - The name of the repository.\n
+        commit_info (tuple) - The sha and message of the commit, then its `LABEL_FIELDS` for an evaluation set.\n
+
+    Returns:
+        Tuple[Optional[dict], List[str]]: The entry of the commit, None if it has no files, and the errors met.
+    """
+    sha, message = commit_info[0], commit_info[1]
+    errors = []
+    try:
+        try:
+            file_names = Commit.get_file_names_from_commit(repo_path, sha)
+        except Exception as e:
+            errors.append(f"Error getting files for commit {sha} in {org_name}/{repo_name}: {str(e)}")
+            file_names = []
+
+        if not file_names:
+            errors.append(f"No files found for commit {sha} in {org_name}/{repo_name}")
+            return None, errors
+
+        files = []
+        try:
+            for name in file_names:
+                file_content, _ = File.get_file_content(repo_path, sha, name)
+                metadata_list = CommitFile.get_metadata(org_name, repo_name, sha, name, repo_path=repo_path)
+                diffs = [metadata.lines for metadata in metadata_list]
+                if diffs:
+                    files.append({'name': name, 'content': {'current': file_content, 'diffs': diffs}})
+        except Exception as e:
+            errors.append(f"Error processing content for commit {sha} in {org_name}/{repo_name}: {str(e)}")
+            return None, errors
+
+        if not files:
+            errors.append(f"No valid files found for commit {sha} in {org_name}/{repo_name}")
+            return None, errors
+
+        entry = {
+            'message': message,
+            'sha': sha,
+            'link': f"https://github.com/{org_name}/{repo_name}/commit/{sha}",
+            'files': files
+        }
+        entry.update(zip(LABEL_FIELDS, commit_info[2:]))
+        return entry, errors
+    except Exception as e:
+        errors.append(f"Unexpected error processing commit {sha} in {org_name}/{repo_name}: {str(e)}")
+        return None, errors
+
+def _plan(coms_data: Dict[str, Dict[str, Dict[str, List[tuple]]]], num_commits: int, repos_path: str) -> Iterator[tuple]:
+    """Yields the work of an export in output order: ('error', message), ('commit', org_name,
+    repo_name, repo_path, commit_info) and ('end', org_name, repo_name) after the commits of a repository."""
+    for org_name, repos in coms_data.items():
+        for repo_name, repo_data in repos.items():
+            try:
+                if not repo_data or 'commits' not in repo_data:
+                    yield 'error', f"Skipping invalid repository data for {org_name}/{repo_name}"
+                    continue
+
+                commits = repo_data['commits']
+                if not commits:
+                    yield 'error', f"No commits found for repository: {org_name}/{repo_name}"
+                    continue
+
+                if min(num_commits, len(commits)) < num_commits:
+                    yield 'error', f"Requested {num_commits} commits but only {len(commits)} available for {org_name}/{repo_name}"
+
+                repo_path = path.join(repos_path, org_name, repo_name)
+                for commit_info in commits:
+                    yield 'commit', org_name, repo_name, repo_path, commit_info
+                yield 'end', org_name, repo_name
+            except Exception as e:
+                yield 'error', f"Unexpected error processing repository {org_name}/{repo_name}: {str(e)}"
+
+def iter_export(coms_data: Dict[str, Dict[str, Dict[str, List[tuple]]]], num_commits: int,
+                workers: Optional[int] = None, repos_path: str = path.join('download', 'orgs')) -> Iterator[tuple]:
+    """Exports the commits of every repository in a bounded pool of threads (the git work
+    runs in subprocesses, so it scales with the cores), while yielding the results in the order
+    of `coms_data`, so the output does not depend on the scheduling. At most a few results per
+    worker are held ahead of the one being yielded.
+
+    Args:
+        coms_data (Dict[str, Dict[str, Dict[str, List[tuple]]]]) - The commits to export, as {"org_name": {"repo_name": {"commits": [...]}}}.\n
+        num_commits (int) - The number of commits expected per repository.\n
+        workers (Optional[int]) - The number of commits exported at the same time, by default `get_optimal_max_workers()`.\n
+        repos_path (str) - The directory with the clones of the organizations.\n
+
+    Yields:
+        tuple: ('error', message), ('commit', org_name, repo_name, entry) for each exported commit,
+        and ('end', org_name, repo_name, exported) after the commits of a repository.
+    """
+    workers = workers or get_optimal_max_workers()
+    window: deque = deque()
+    exported = 0
+
+    def drain(limit: int) -> Iterator[tuple]:
+        nonlocal exported
+        while len(window) > limit:
+            item = window.popleft()
+            if item[0] == 'commit':
+                entry, errors = item[3].result()
+                for error in errors:
+                    yield 'error', error
+                if entry is not None:
+                    exported += 1
+                    yield 'commit', item[1], item[2], entry
+            elif item[0] == 'end':
+                yield 'end', item[1], item[2], exported
+                exported = 0
+            else:
+                yield item
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in _plan(coms_data, num_commits, repos_path):
+            if item[0] == 'commit':
+                _, org_name, repo_name, repo_path, commit_info = item
+                item = ('commit', org_name, repo_name, executor.submit(export_commit, repo_path, org_name, repo_name, commit_info))
+            window.append(item)
+            yield from drain(workers * 2)
+        yield from drain(0)
+
+def _validate(coms_data: Dict[str, Any], num_commits: int) -> List[str]:
+    if not coms_data:
+        return ["No repository data provided"]
+    if num_commits <= 0:
+        return [f"Invalid num_commits value: {num_commits}"]
+    return []
+
+def _log_errors(errors: List[str]) -> None:
+    if errors:
+        logging.warning(f"Encountered {len(errors)} errors during export:")
+        for error in errors:
+            logging.warning(f" - {error}")
+
+def export_to_json(coms_data: Dict[str, Dict[str, Dict[str, List[tuple]]]], num_commits: int, workers: Optional[int] = None,
+                   repos_path: str = path.join('download', 'orgs')) -> Dict[str, Any]:
+    """Exports a golden or evaluation set to the nested JSON structure of `golden_set.json` and
+    `evaluate_set.json`, see `iter_export`.
+
+    Args:
+        coms_data (Dict[str, Dict[str, Dict[str, List[tuple]]]]) - The commits to export, as {"org_name": {"repo_name": {"commits": [...]}}}.\n
+        num_commits (int) - The number of commits expected per repository.\n
+        workers (Optional[int]) - The number of commits exported at the same time.\n
+        repos_path (str) - The directory with the clones of the organizations.\n
+
+    Returns:
+        Dict[str, Any]: The 'errors' met and the 'repos' with their commits.
+    """
+    result = {
+        'errors': _validate(coms_data, num_commits),
+        'repos': []
+    }
+    if result['errors']:
+        return result
+
+    commits = []
+    for item in iter_export(coms_data, num_commits, workers, repos_path):
+        if item[0] == 'error':
+            result['errors'].append(item[1])
+        elif item[0] == 'commit':
+            commits.append(item[3])
+        elif commits:
+            result['repos'].append({'repo_name': item[2], 'org_name': item[1], 'commits': commits})
+            commits = []
+        else:
+            result['errors'].append(f"No valid commits found for repository {item[1]}/{item[2]}")
+
+    _log_errors(result['errors'])
+    return result
+
+def export_to_jsonl(coms_data: Dict[str, Dict[str, Dict[str, List[tuple]]]], file_path: str, num_commits: int,
+                    workers: Optional[int] = None, repos_path: str = path.join('download', 'orgs')) -> List[str]:
+    """Exports a golden or evaluation set to indexed JSON Lines (see `utils.evalset`), writing each
+    commit as soon as the ones before it are written, so memory stays flat however large the set.
+
+    Args:
+        coms_data (Dict[str, Dict[str, Dict[str, List[tuple]]]]) - The commits to export, as {"org_name": {"repo_name": {"commits": [...]}}}.\n
+        file_path (str) - The path of the set.\n
+        num_commits (int) - The number of commits expected per repository.\n
+        workers (Optional[int]) - The number of commits exported at the same time.\n
+        repos_path (str) - The directory with the clones of the organizations.\n
+
+    Returns:
+        List[str]: The errors met, also written to the set.
+    """
+    errors = _validate(coms_data, num_commits)
+    with EvalSetWriter(file_path) as writer:
+        for error in errors:
+            writer.write_error(error)
+        items = iter_export(coms_data, num_commits, workers, repos_path) if not errors else []
+        for item in items:
+            error = None
+            if item[0] == 'commit':
+                writer.write_commit(item[1], item[2], item[3])
+            elif item[0] == 'error':
+                error = item[1]
+            elif not item[3]:
+                error = f"No valid commits found for repository {item[1]}/{item[2]}"
+            if error is not None:
+                errors.append(error)
+                writer.write_error(error)
+
+    _log_errors(errors)
+    return errors
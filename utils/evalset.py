@@ -0,0 +1,340 @@
+from itertools import groupby
+from os import path, replace, remove, stat
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import uuid
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx'
+
+def index_path(file_path: str) -> str:
+    """Returns the path of the sidecar index of a set."""
+    return file_path + INDEX_SUFFIX
+
+def _data_stamp(file_path: str) -> Tuple[int, int]:
+    """Returns the size and modification time of a set, which tell whether its index is current."""
+    stats = stat(file_path)
+    return stats.st_size, stats.st_mtime_ns
+
+class EvalSetWriter:
+    """
+    Writes a golden or evaluation set as JSON Lines, one commit per line, as the commits are
+    produced: each line is the commit of the JSON set with its 'repo_name' and 'org_name', and
+    errors are lines with an 'error' only. Only the offset of each commit is kept in memory, so
+    sets with thousands of commits per repository are written with flat memory.
+
+    The set is written to a scratch file, moved in place on `close`, and then indexed by SHA
+    in a sidecar file (`<path>.idx`), so readers never see a half written set.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Constructor for the EvalSetWriter class.
+
+        Args:
+            file_path (str): The path of the set, conventionally ending in `.jsonl`.
+        """
+        self.file_path = file_path
+        self.commits: Dict[str, Tuple[int, int]] = {}
+        self.errors = 0
+        self._tmp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+        self._file: Optional[BinaryIO] = open(self._tmp_path, 'wb')
+
+    def __enter__(self) -> 'EvalSetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, record: dict) -> Tuple[int, int]:
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        offset = self._file.tell()
+        self._file.write(line)
+        return offset, len(line)
+
+    def write_commit(self, org_name: str, repo_name: str, commit: dict) -> None:
+        """
+        Appends a commit. A SHA written twice is indexed at its first line.
+
+        Args:
+            org_name (str): The organization of the repository.
+            repo_name (str): The repository of the commit.
+            commit (dict): The commit, with its 'sha', 'message', 'link', 'files'...
+        """
+        location = self._write({'repo_name': repo_name, 'org_name': org_name, **commit})
+        self.commits.setdefault(commit['sha'], location)
+
+    def write_error(self, message: str) -> None:
+        """
+        Appends an error met while producing the set.
+
+        Args:
+            message (str): The error.
+        """
+        self._write({'error': message})
+        self.errors += 1
+
+    def close(self) -> None:
+        """
+        Moves the set in place and writes its index.
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        replace(self._tmp_path, self.file_path)
+        size, mtime_ns = _data_stamp(self.file_path)
+        _write_index(self.file_path, {'version': INDEX_VERSION, 'size': size, 'mtime_ns': mtime_ns,
+                                      'errors': self.errors, 'commits': self.commits})
+
+    def abort(self) -> None:
+        """
+        Discards the set written so far, leaving any previous set in place.
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        remove(self._tmp_path)
+
+def _write_index(file_path: str, index: dict) -> None:
+    tmp_path = f'{index_path(file_path)}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(index, file, separators=(',', ':'))
+    replace(tmp_path, index_path(file_path))
+
+def build_index(file_path: str) -> dict:
+    """
+    Indexes a set by scanning it line by line, and saves the index next to it.
+
+    Args:
+        file_path (str): The path of the set.
+
+    Returns:
+        dict: The index, with the offset and length of the line of each SHA.
+    """
+    size, mtime_ns = _data_stamp(file_path)
+    commits: Dict[str, Tuple[int, int]] = {}
+    errors = 0
+    offset = 0
+    with open(file_path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                if 'error' in record and 'sha' not in record:
+                    errors += 1
+                else:
+                    commits.setdefault(record['sha'], (offset, len(line)))
+            offset += len(line)
+    index = {'version': INDEX_VERSION, 'size': size, 'mtime_ns': mtime_ns, 'errors': errors, 'commits': commits}
+    _write_index(file_path, index)
+    return index
+
+class EvalSetReader:
+    """
+    Reads a set written by `EvalSetWriter` lazily: iterating streams the commits from disk one
+    line at a time, and `get` seeks to a commit by SHA through the sidecar index, which is
+    rebuilt if it is missing or older than the set.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Constructor for the EvalSetReader class.
+
+        Args:
+            file_path (str): The path of the set.
+        """
+        self.file_path = file_path
+        self._index: Optional[dict] = None
+        self._file: Optional[BinaryIO] = None
+
+    def __enter__(self) -> 'EvalSetReader':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            index = None
+            if path.exists(index_path(self.file_path)):
+                with open(index_path(self.file_path), 'r', encoding='utf-8') as file:
+                    index = json.load(file)
+                size, mtime_ns = _data_stamp(self.file_path)
+                if (index.get('version'), index.get('size'), index.get('mtime_ns')) != (INDEX_VERSION, size, mtime_ns):
+                    index = None
+            self._index = index or build_index(self.file_path)
+        return self._index
+
+    def __len__(self) -> int:
+        return len(self.index['commits'])
+
+    def __contains__(self, sha: str) -> bool:
+        return sha in self.index['commits']
+
+    def shas(self) -> List[str]:
+        """
+        Returns:
+            List[str]: The SHA of every commit, in the order of the set.
+        """
+        return list(self.index['commits'])
+
+    def get(self, sha: str) -> Optional[dict]:
+        """
+        Reads a single commit, without reading the commits before it.
+
+        Args:
+            sha (str): The SHA of the commit.
+
+        Returns:
+            Optional[dict]: The commit with its 'repo_name' and 'org_name', None if the set does not have it.
+        """
+        location = self.index['commits'].get(sha)
+        if location is None:
+            return None
+        if self._file is None:
+            self._file = open(self.file_path, 'rb')
+        self._file.seek(location[0])
+        return json.loads(self._file.read(location[1]))
+
+    def _records(self) -> Iterator[dict]:
+        with open(self.file_path, 'rb') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __iter__(self) -> Iterator[dict]:
+        """
+        Yields:
+            dict: Each commit with its 'repo_name' and 'org_name', in the order of the set.
+        """
+        return (record for record in self._records() if 'sha' in record)
+
+    def errors(self) -> List[str]:
+        """
+        Returns:
+            List[str]: The errors met while producing the set.
+        """
+        return [record['error'] for record in self._records() if 'sha' not in record]
+
+    def repos(self) -> Iterator[Tuple[str, str, Iterator[dict]]]:
+        """
+        Yields the commits grouped by repository, as the legacy JSON sets nest them. The
+        commits of a repository are expected to be contiguous, as the writer produces them.
+
+        Yields:
+            Tuple[str, str, Iterator[dict]]: The organization, the repository and its commits.
+        """
+        for (org_name, repo_name), commits in groupby(self, key=lambda commit: (commit['org_name'], commit['repo_name'])):
+            yield org_name, repo_name, commits
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def iter_commits(file_path: str) -> Iterator[dict]:
+    """
+    Yields the commits of a set in either format, each with its 'repo_name' and 'org_name':
+    lazily from JSON Lines, or from a legacy JSON set (which has to be loaded whole).
+
+    Args:
+        file_path (str): The path of the set, `.jsonl` for JSON Lines.
+
+    Yields:
+        dict: Each commit of the set.
+    """
+    if file_path.endswith('.jsonl'):
+        yield from EvalSetReader(file_path)
+        return
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    for repo in data.get('repos', []):
+        for commit in repo['commits']:
+            yield {'repo_name': repo['repo_name'], 'org_name': repo['org_name'], **commit}
+
+def convert_legacy(json_path: str, jsonl_path: str) -> int:
+    """
+    Converts a legacy JSON set (`{'errors': [...], 'repos': [...]}`) to JSON Lines.
+
+    Args:
+        json_path (str): The path of the legacy set.
+        jsonl_path (str): The path of the set to write.
+
+    Returns:
+        int: The number of commits written.
+    """
+    with open(json_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    with EvalSetWriter(jsonl_path) as writer:
+        for repo in data.get('repos', []):
+            for commit in repo['commits']:
+                writer.write_commit(repo['org_name'], repo['repo_name'], commit)
+        for error in data.get('errors', []):
+            writer.write_error(error)
+    return len(writer.commits)
+
+def export_legacy(jsonl_path: str, json_path: str) -> int:
+    """
+    Writes a JSON Lines set in the legacy JSON format, for the consumers that still expect it,
+    formatted like `json.dump(..., indent=4)`. The JSON is written repository by repository,
+    so the set is never held in memory.
+
+    Args:
+        jsonl_path (str): The path of the set.
+        json_path (str): The path of the legacy set to write.
+
+    Returns:
+        int: The number of commits written.
+    """
+    count = 0
+    tmp_path = f'{json_path}.{uuid.uuid4().hex}.tmp'
+    reader = EvalSetReader(jsonl_path)
+    errors = json.dumps(reader.errors(), indent=4).replace('\n', '\n    ')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(f'{{\n    "errors": {errors},\n    "repos": [')
+        for repo_index, (org_name, repo_name, commits) in enumerate(reader.repos()):
+            file.write(',' if repo_index else '')
+            file.write(f'\n        {{\n            "repo_name": {json.dumps(repo_name)},\n'
+                       f'            "org_name": {json.dumps(org_name)},\n            "commits": [')
+            for commit_index, commit in enumerate(commits):
+                commit = {name: value for name, value in commit.items() if name not in ('repo_name', 'org_name')}
+                text = json.dumps(commit, indent=4).replace('\n', '\n                ')
+                file.write(f"{',' if commit_index else ''}\n                {text}")
+                count += 1
+            file.write('\n            ]\n        }')
+        file.write('\n    ]\n}' if count else ']\n}')
+    replace(tmp_path, json_path)
+    return count
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m utils.evalset',
+        description='Converts the golden and evaluation sets between the legacy JSON format and indexed JSON Lines.'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    to_jsonl = subparsers.add_parser('to-jsonl', help='Converts a legacy JSON set to JSON Lines and indexes it.')
+    to_jsonl.add_argument('source')
+    to_jsonl.add_argument('target')
+    to_json = subparsers.add_parser('to-json', help='Writes a JSON Lines set in the legacy JSON format.')
+    to_json.add_argument('source')
+    to_json.add_argument('target')
+    index = subparsers.add_parser('index', help='Rebuilds the index of a JSON Lines set.')
+    index.add_argument('source')
+    args = parser.parse_args(argv)
+
+    if args.command == 'to-jsonl':
+        print(f"{convert_legacy(args.source, args.target)} commits written to {args.target}")
+    elif args.command == 'to-json':
+        print(f"{export_legacy(args.source, args.target)} commits written to {args.target}")
+    else:
+        print(f"{len(build_index(args.source)['commits'])} commits indexed in {index_path(args.source)}")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
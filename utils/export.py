@@ -0,0 +1,318 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from os import path, makedirs, replace
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+import argparse
+import json
+import shutil
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.postgres import connection, general_fetch_all
+
+# Hive's name for the directory of rows whose partition value is NULL
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+PARTITION_COLUMNS = ['eco_name', 'org_name']
+MANIFEST_NAME = 'manifest.json'
+
+@dataclass(frozen=True)
+class ExportTable:
+    """A table of the dataset as it is written to Parquet. Partitioned tables are read
+    one repository at a time, so their query takes the `repo_id` as its only parameter
+    and selects every column of the schema but the leading `repo_id` and `repo_name`,
+    which are filled in from the repository."""
+    name: str
+    schema: pa.Schema
+    query: str
+    partitioned: bool
+    dictionary: Tuple[str, ...] = ()
+    row_group_size: int = 50000
+
+# In the order of the notebooks. The repeated names (repositories, shas, file names,
+# change types...) are dictionary encoded, so they cost a few bytes per row on disk
+# instead of a copy of the string.
+EXPORT_TABLES: Dict[str, ExportTable] = {table.name: table for table in [
+    ExportTable('ecosystems', pa.schema([
+        ('eco_name', pa.string()),
+    ]), """SELECT eco_name FROM ecosystems ORDER BY eco_name""", False),
+    ExportTable('organizations', pa.schema([
+        ('org_name', pa.string()),
+        ('eco_name', pa.string()),
+        ('url', pa.string()),
+    ]), """SELECT org_name, eco_name, url FROM organizations ORDER BY org_name""", False, ('eco_name',)),
+    ExportTable('repositories', pa.schema([
+        ('repo_id', pa.int32()),
+        ('repo_name', pa.string()),
+        ('eco_name', pa.string()),
+        ('org_name', pa.string()),
+        ('stars', pa.int32()),
+        ('forks', pa.int32()),
+        ('watchers', pa.int32()),
+        ('contributors', pa.int32()),
+        ('language', pa.string()),
+        ('size', pa.float64()),
+        ('loc', pa.float64()),
+        ('archived', pa.bool_()),
+    ]), """SELECT repo_id, repo_name, eco_name, org_name, stars, forks, watchers, contributors,
+        language, size, loc, archived FROM repositories ORDER BY repo_id""", False,
+        ('eco_name', 'org_name', 'language')),
+    ExportTable('commits', pa.schema([
+        ('repo_id', pa.int32()),
+        ('repo_name', pa.string()),
+        ('commit_id', pa.int64()),
+        ('sha', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('message', pa.string()),
+    ]), """SELECT commit_id, sha, timestamp, message FROM commits
+        WHERE repo_id = %s ORDER BY commit_id""", True, ('repo_name',)),
+    ExportTable('files', pa.schema([
+        ('repo_id', pa.int32()),
+        ('repo_name', pa.string()),
+        ('file_id', pa.int64()),
+        ('file_name', pa.string()),
+        ('type', pa.string()),
+    ]), """SELECT file_id, file_name, type FROM files
+        WHERE repo_id = %s ORDER BY file_id""", True, ('repo_name', 'type')),
+    ExportTable('blobs', pa.schema([
+        ('blob_id', pa.string()),
+        ('content', pa.string()),
+    ]), """SELECT blob_id, content FROM blobs ORDER BY blob_id""", False, (), 2000),
+    ExportTable('commit_files', pa.schema([
+        ('repo_id', pa.int32()),
+        ('repo_name', pa.string()),
+        ('commit_id', pa.int64()),
+        ('file_id', pa.int64()),
+        ('sha', pa.string()),
+        ('file_name', pa.string()),
+        ('blob_id', pa.string()),
+        ('change_type', pa.string()),
+        ('file_mode', pa.string()),
+        ('index_info', pa.string()),
+    ]), """SELECT cf.commit_id, cf.file_id, c.sha, f.file_name, cf.blob_id, cf.change_type, cf.file_mode, cf.index_info
+        FROM commit_files cf
+        JOIN commits c ON c.commit_id = cf.commit_id
+        JOIN files f ON f.file_id = cf.file_id
+        WHERE c.repo_id = %s ORDER BY cf.commit_id, cf.file_id""", True,
+        ('repo_name', 'sha', 'file_name', 'change_type', 'file_mode')),
+    ExportTable('hunks', pa.schema([
+        ('repo_id', pa.int32()),
+        ('repo_name', pa.string()),
+        ('id', pa.int32()),
+        ('commit_id', pa.int64()),
+        ('file_id', pa.int64()),
+        ('sha', pa.string()),
+        ('file_name', pa.string()),
+        ('old_start', pa.int32()),
+        ('new_start', pa.int32()),
+        ('old_length', pa.int32()),
+        ('new_length', pa.int32()),
+        ('old_name', pa.string()),
+        ('new_name', pa.string()),
+        ('lines', pa.list_(pa.string())),
+    ]), """SELECT h.id, h.commit_id, h.file_id, c.sha, f.file_name, h.old_start, h.new_start,
+            h.old_length, h.new_length, h.old_name, h.new_name, h.lines
+        FROM hunks h
+        JOIN commits c ON c.commit_id = h.commit_id
+        JOIN files f ON f.file_id = h.file_id
+        WHERE c.repo_id = %s ORDER BY h.id""", True,
+        ('repo_name', 'sha', 'file_name', 'old_name', 'new_name'), 10000),
+]}
+
+def _stream(query: str, params: tuple = (), itersize: int = 2000) -> Iterator[tuple]:
+    """Streams the rows of a query through a named server-side cursor, like `general_iter_all`."""
+    with connection() as conn, conn.cursor(name=f"export_{uuid.uuid4().hex}") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+        yield from cursor
+
+def partition_dir(eco_name: Optional[str], org_name: Optional[str]) -> str:
+    """Returns the Hive-style directory of an ecosystem/organization partition, e.g.
+    `eco_name=Spring%20Boot/org_name=spring-guides`.
+
+    Args:
+        eco_name (Optional[str]) - The ecosystem of the partition.\n
+        org_name (Optional[str]) - The organization of the partition.
+
+    Returns:
+        str: The directory, relative to the table's directory.
+    """
+    parts = []
+    for column, value in zip(PARTITION_COLUMNS, (eco_name, org_name)):
+        parts.append(f"{column}={quote(value, safe='') if value is not None else NULL_PARTITION}")
+    return path.join(*parts)
+
+class _PartWriter:
+    """Writes the rows of one table partition to `part-NNNNN.parquet` files, holding at
+    most a row group in memory and starting a new file every `max_rows_per_file` rows."""
+
+    def __init__(self, directory: str, table: ExportTable, compression: str, max_rows_per_file: int):
+        self.directory = directory
+        self.table = table
+        self.compression = compression
+        self.max_rows_per_file = max_rows_per_file
+        self.rows: List[tuple] = []
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.file_path: Optional[str] = None
+        self.file_rows = 0
+        self.file_row_groups = 0
+        self.files: List[dict] = []
+
+    def append(self, row: tuple) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= self.table.row_group_size or self.file_rows + len(self.rows) >= self.max_rows_per_file:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self.rows:
+            return
+        if self.writer is None:
+            makedirs(self.directory, exist_ok=True)
+            self.file_path = path.join(self.directory, f"part-{len(self.files):05d}.parquet")
+            self.writer = pq.ParquetWriter(self.file_path, self.table.schema, compression=self.compression,
+                                           use_dictionary=list(self.table.dictionary) or False)
+        columns = zip(*self.rows)
+        arrays = [pa.array(values, type=field.type) for values, field in zip(columns, self.table.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.table.schema))
+        self.file_rows += len(self.rows)
+        self.file_row_groups += 1
+        self.rows = []
+        if self.file_rows >= self.max_rows_per_file:
+            self._close_file()
+
+    def _close_file(self) -> None:
+        self.writer.close()
+        self.files.append({'path': self.file_path, 'rows': self.file_rows, 'row_groups': self.file_row_groups})
+        self.writer = None
+        self.file_rows = 0
+        self.file_row_groups = 0
+
+    def close(self) -> List[dict]:
+        """Writes the buffered rows and returns the files written."""
+        self._flush()
+        if self.writer is not None:
+            self._close_file()
+        return self.files
+
+def _export_table(table: ExportTable, output_dir: str, repos: List[tuple], compression: str, max_rows_per_file: int) -> dict:
+    """Writes one table into a scratch directory, then swaps it with the previous export."""
+    table_dir = path.join(output_dir, table.name)
+    scratch_dir = path.join(output_dir, f".{table.name}.partial")
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    files: List[dict] = []
+    if table.partitioned:
+        writer = None
+        current = None
+        for repo_id, repo_name, eco_name, org_name in repos:
+            if (eco_name, org_name) != current:
+                if writer is not None:
+                    files += writer.close()
+                current = (eco_name, org_name)
+                writer = _PartWriter(path.join(scratch_dir, partition_dir(eco_name, org_name)), table, compression, max_rows_per_file)
+            for row in _stream(table.query, (repo_id,)):
+                writer.append((repo_id, repo_name) + tuple(row))
+        if writer is not None:
+            files += writer.close()
+    else:
+        writer = _PartWriter(scratch_dir, table, compression, max_rows_per_file)
+        for row in _stream(table.query):
+            writer.append(tuple(row))
+        files += writer.close()
+
+    shutil.rmtree(table_dir, ignore_errors=True)
+    if path.exists(scratch_dir):
+        replace(scratch_dir, table_dir)
+
+    for file in files:
+        relative = path.relpath(file['path'], scratch_dir)
+        file['bytes'] = path.getsize(path.join(table_dir, relative))
+        file['path'] = path.join(table.name, relative).replace(path.sep, '/')
+
+    return {
+        'rows': sum(file['rows'] for file in files),
+        'partitioned_by': PARTITION_COLUMNS if table.partitioned else [],
+        'columns': {field.name: str(field.type) for field in table.schema},
+        'dictionary_encoded': list(table.dictionary),
+        'files': files,
+    }
+
+def export_dataset(output_dir: str = 'export', tables: Optional[List[str]] = None, compression: str = 'zstd',
+                   max_rows_per_file: int = 1000000, max_workers: int = 4) -> dict:
+    """Exports the dataset from PostgreSQL to Parquet files that pandas, pyarrow or
+    DuckDB load directly. Rows are streamed from server-side cursors and written a row
+    group at a time, so memory stays bounded by `row_group_size` rows per table.
+
+    Commits, files, commit files and hunks are partitioned by ecosystem and organization
+    (`<table>/eco_name=<eco>/org_name=<org>/part-00000.parquet`) and carry the `repo_id`
+    and `repo_name` of their rows; the other tables are written to `<table>/`. A
+    `manifest.json` with the row counts and files of every table is written last, so an
+    interrupted export never leaves a manifest describing files that are not there.
+
+    Args:
+        output_dir (str) - The directory to write the export to.\n
+        tables (Optional[List[str]]) - The tables to export, all of `EXPORT_TABLES` if None; the manifest keeps the entries of the others.\n
+        compression (str) - The Parquet compression codec.\n
+        max_rows_per_file (int) - The number of rows after which a partition continues in a new file.\n
+        max_workers (int) - The number of tables exported at the same time.
+
+    Returns:
+        dict: The manifest.
+    """
+    names = list(EXPORT_TABLES) if tables is None else tables
+    unknown = [name for name in names if name not in EXPORT_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}, expected some of {list(EXPORT_TABLES)}")
+
+    makedirs(output_dir, exist_ok=True)
+    repos = []
+    if any(EXPORT_TABLES[name].partitioned for name in names):
+        repos = sorted(general_fetch_all('repositories', ['repo_id', 'repo_name', 'eco_name', 'org_name']),
+                       key=lambda repo: (repo[2] or '', repo[3] or '', repo[0]))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_export_table, EXPORT_TABLES[name], output_dir, repos, compression, max_rows_per_file)
+                   for name in names}
+        results = {name: future.result() for name, future in futures.items()}
+
+    manifest_path = path.join(output_dir, MANIFEST_NAME)
+    manifest = {'tables': {}}
+    if path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    manifest['format'] = 'parquet'
+    manifest['compression'] = compression
+    manifest['exported_at'] = datetime.now().isoformat()
+    manifest['tables'].update(results)
+    manifest['tables'] = {name: manifest['tables'][name] for name in EXPORT_TABLES if name in manifest['tables']}
+
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    replace(tmp_path, manifest_path)
+    return manifest
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m utils.export',
+        description='Exports the dataset from PostgreSQL to partitioned Parquet files.'
+    )
+    parser.add_argument('--output', default='export', help='Directory to write the export to.')
+    parser.add_argument('--tables', default=','.join(EXPORT_TABLES), help='Comma separated tables to export.')
+    parser.add_argument('--compression', default='zstd', help='Parquet compression codec (zstd, snappy, gzip, none).')
+    parser.add_argument('--max-rows-per-file', type=int, default=1000000, help='Rows after which a partition continues in a new file.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of tables exported at the same time.')
+    args = parser.parse_args(argv)
+
+    tables = [name.strip() for name in args.tables.split(',') if name.strip()]
+    manifest = export_dataset(args.output, tables, args.compression, args.max_rows_per_file, args.workers)
+    for name in tables:
+        entry = manifest['tables'][name]
+        print(f"{name:<15} {entry['rows']:>12} rows in {len(entry['files'])} files", flush=True)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
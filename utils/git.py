@@ -1,6 +1,37 @@
-from os import path, makedirs
+from os import path, makedirs, stat, walk
 from git import Repo
+from typing import Dict, List, Optional, Tuple
+import atexit
+import hashlib
 import subprocess
+import threading
+import time
+
+def repo_and_org_from_path(repo_path: str) -> Tuple[str, str]:
+    '''Extract the repository and organization names from a local repository path
+    laid out as `<...>/orgs/<org_name>/<repo_name>`
+
+    Args:
+        repo_path (str) - Path to the repository
+
+    Returns:
+        Tuple[str, str] - The repository name and the organization name
+    '''
+    normalized = path.normpath(repo_path)
+    return path.basename(normalized), path.basename(path.dirname(normalized))
+
+def git_blob_id(content: str) -> str:
+    '''Compute the id git gives a blob holding the UTF-8 encoding of `content`
+    (`git hash-object`), so text read from a repository keeps its git blob id
+
+    Args:
+        content (str) - Text content of the blob
+
+    Returns:
+        str - The 40 character SHA-1 of the blob
+    '''
+    data = content.encode('utf-8')
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
 
 def clone(git_url: str, repo_dir: str, sample: str) -> None:
     '''Clone a git repository and checkout all files in the repository
@@ -18,27 +49,207 @@ def clone(git_url: str, repo_dir: str, sample: str) -> None:
 
     Repo.clone_from(git_url, repo_path, multi_options=["--no-checkout"], bare=True)
         
-def download(sample: str) -> None:
+def download(sample: str, incremental: bool = False, repo_dir: str = "../download/orgs/") -> None:
     '''Download the repository. If the repository is already downloaded,
-    nothing is done.
+    nothing is done, unless `incremental` is set, in which case new commits
+    and refs are fetched into the existing clone.
     
     Args:
-        sample (str) - Name of the sample
+        sample (str) - Name of the sample\n
+        incremental (bool) - Fetch into existing clones instead of skipping them\n
+        repo_dir (str) - Directory holding the clones of all organizations
     
     Returns:
         None
     '''
     gitHubUrl = f"https://github.com/{sample}.git"
-    repoDir = "../download/orgs/"
-    isdir = path.isdir(repoDir+sample)
+    isdir = path.isdir(path.join(repo_dir, sample))
     if isdir:
+        if incremental:
+            fetch(path.join(repo_dir, sample))
+            return
         print(f"Repository {sample} already downloaded")
         return
     else:
-        clone(gitHubUrl, repoDir, sample)
+        clone(gitHubUrl, repo_dir, sample)
+
+def fetch(repo_path: str) -> None:
+    '''Fetch new commits, branches and tags from origin into a bare clone, pruning
+    refs deleted upstream.
+    
+    Args:
+        repo_path (str) - The path to the repository
+    
+    Returns:
+        None
+    '''
+    subprocess.run(
+        ["git", "fetch", "--prune", "--quiet", "origin",
+         "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"],
+        cwd=repo_path,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+
+def head_sha(repo_path: str) -> str:
+    '''Resolve the commit HEAD points to.
+    
+    Args:
+        repo_path (str) - The path to the repository
+    
+    Returns:
+        str: The SHA of HEAD.
+    '''
+    return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_path, text=True).strip()
+
+def refs_state(repo_path: str) -> str:
+    '''Hash the targets of HEAD and of all refs of the repository. The hash only
+    changes when a ref is created, deleted or moved.
+    
+    Args:
+        repo_path (str) - The path to the repository
+    
+    Returns:
+        str: A hex digest of the refs of the repository.
+    '''
+    output = subprocess.check_output(["git", "show-ref", "--head"], cwd=repo_path)
+    return hashlib.sha1(output).hexdigest()
+
+def _git_dir(repo_path: str) -> str:
+    dot_git = path.join(repo_path, '.git')
+    return dot_git if path.isdir(dot_git) else repo_path
+
+def refs_fingerprint(repo_path: str) -> str:
+    """Fingerprints the refs of a repository from the file system, without running git.
+    The fingerprint changes whenever a fetch, commit or ref update touches HEAD,
+    `packed-refs` or a loose ref.
+
+    Args:
+        repo_path (str): The path to the repository.
+
+    Returns:
+        str: A hex digest of the state of the refs.
+    """
+    git_dir = _git_dir(repo_path)
+    digest = hashlib.sha1()
+    candidates = [path.join(git_dir, 'HEAD'), path.join(git_dir, 'packed-refs')]
+    for root, dirs, files in walk(path.join(git_dir, 'refs')):
+        dirs.sort()
+        candidates.extend(path.join(root, name) for name in sorted(files))
+
+    for candidate in candidates:
+        try:
+            info = stat(candidate)
+        except OSError:
+            continue
+        digest.update(f"{path.relpath(candidate, git_dir)}:{info.st_mtime_ns}:{info.st_size}\n".encode())
+    return digest.hexdigest()
+
+class ParentIndex:
+    '''Parents of every commit reachable from the refs of a repository, built from a
+    single `git rev-list --parents --all` walk.
+
+    Args:
+        repo_path (str) - The path to the repository.
+    '''
+    # Seconds between two checks of the refs of the repository
+    REFS_CHECK_INTERVAL = 5.0
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.parents: Dict[str, Tuple[str, ...]] = {}
+        self.fingerprint = None
+        self.checked_at = 0.0
+        self.persist = False
+        self.lock = threading.Lock()
+
+    def persist_path(self) -> str:
+        """Returns the path of the file the index is persisted to, next to the repository."""
+        return f"{path.normpath(self.repo_path)}.parents"
+
+    def refresh(self, persist: bool = False) -> None:
+        """Rebuilds the index if the refs of the repository changed since it was built.
+
+        Args:
+            persist (bool): If True, the index is also loaded from and saved to `persist_path()`,
+                now and on every later rebuild.
+        """
+        self.persist = self.persist or persist
+        persist = self.persist
+        now = time.monotonic()
+        if self.fingerprint is not None and now - self.checked_at < self.REFS_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+
+        fingerprint = refs_fingerprint(self.repo_path)
+        if fingerprint == self.fingerprint:
+            return
+
+        if persist and self._load(fingerprint):
+            return
+
+        output = subprocess.check_output(
+            ["git", "rev-list", "--parents", "--all"],
+            cwd=self.repo_path,
+            stderr=subprocess.DEVNULL
+        ).decode()
+        self._parse(output)
+        self.fingerprint = fingerprint
+
+        if persist:
+            with open(self.persist_path(), 'w', encoding='utf-8') as file:
+                file.write(f"{fingerprint}\n{output}")
+
+    def _parse(self, output: str) -> None:
+        parents = {}
+        for line in output.splitlines():
+            shas = line.split()
+            if shas:
+                parents[shas[0]] = tuple(shas[1:])
+        self.parents = parents
+
+    def _load(self, fingerprint: str) -> bool:
+        try:
+            with open(self.persist_path(), 'r', encoding='utf-8') as file:
+                if file.readline().strip() != fingerprint:
+                    return False
+                self._parse(file.read())
+        except OSError:
+            return False
+
+        self.fingerprint = fingerprint
+        return True
+
+_parent_indexes: Dict[str, ParentIndex] = {}
+_parent_indexes_lock = threading.Lock()
+
+def get_parent_index(repo_path: str, persist: bool = False) -> Dict[str, Tuple[str, ...]]:
+    """Returns the parents of every commit of a repository. The index is built once,
+    kept in memory and rebuilt when the refs of the repository change.
+
+    Args:
+        repo_path (str): The path to the repository.
+        persist (bool): If True, the index is also persisted next to the repository so
+            other processes and later runs can reuse it.
+
+    Returns:
+        Dict[str, Tuple[str, ...]]: The parent SHAs, by commit SHA.
+    """
+    key = path.abspath(repo_path)
+    with _parent_indexes_lock:
+        index = _parent_indexes.get(key)
+        if index is None:
+            index = _parent_indexes[key] = ParentIndex(repo_path)
+
+    with index.lock:
+        index.refresh(persist)
+        return index.parents
 
 def is_merge_commit(repo_path: str, sha: str) -> bool:
-    """Check if a commit is a merge commit.
+    """Check if a commit is a merge commit. The check is a lookup in the parent index
+    of the repository (see `get_parent_index`); only commits missing from the index,
+    e.g. abbreviated SHAs, fall back to running `git rev-list`.
     
     Args:
         repo_path (str): The path to the repository.
@@ -47,6 +258,13 @@ def is_merge_commit(repo_path: str, sha: str) -> bool:
     Returns:
         bool: True if the commit is a merge commit, False otherwise.
     """
+    try:
+        parents = get_parent_index(repo_path).get(sha)
+        if parents is not None:
+            return len(parents) > 1
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
     try:
         process = subprocess.Popen(
             ["git", "rev-list", "--parents", "-n", "1", sha],
@@ -68,3 +286,164 @@ def is_merge_commit(repo_path: str, sha: str) -> bool:
         return len(parents) > 2  # Commit SHA + at least 2 parents
     except Exception:
         return False
+
+
+class CatFile:
+    '''Long-lived `git cat-file --batch` / `--batch-check` processes used to read
+    objects of a repository through a pipe instead of spawning one process per object.
+    Every request holds a lock for its round-trip, so a single instance can be
+    shared by all threads working on the repository (see `get_cat_file`).
+
+    Args:
+        repo_path (str) - The path to the repository.
+    '''
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.requests_served = 0
+        self._batch = None
+        self._batch_check = None
+        self._lock = threading.Lock()
+
+    def _spawn(self, mode: str) -> subprocess.Popen:
+        return subprocess.Popen(
+            ["git", "cat-file", mode],
+            cwd=self.repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    @staticmethod
+    def _request(process: subprocess.Popen, rev: str) -> Optional[List[bytes]]:
+        process.stdin.write(rev.encode('utf-8') + b'\n')
+        process.stdin.flush()
+
+        parts = process.stdout.readline().split()
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None  # "<rev> missing" or "<rev> ambiguous"
+        return parts
+
+    def info(self, rev: str) -> Tuple[Optional[str], Optional[int]]:
+        """Looks up the type and size of an object without reading it.
+
+        Args:
+            rev (str): Anything `git cat-file` accepts, e.g. a blob SHA or `<sha>:<path>`.
+
+        Returns:
+            Tuple[Optional[str], Optional[int]]: The object type and its size in bytes,
+                or (None, None) if the object does not exist.
+        """
+        with self._lock:
+            if self._batch_check is None:
+                self._batch_check = self._spawn("--batch-check")
+            self.requests_served += 1
+            parts = self._request(self._batch_check, rev)
+
+        if parts is None:
+            return None, None
+        return parts[1].decode(), int(parts[2])
+
+    def read(self, rev: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """Reads an object from the repository.
+
+        Args:
+            rev (str): Anything `git cat-file` accepts, e.g. a blob SHA or `<sha>:<path>`.
+
+        Returns:
+            Tuple[Optional[str], Optional[bytes]]: The object type and its raw content,
+                or (None, None) if the object does not exist.
+        """
+        with self._lock:
+            if self._batch is None:
+                self._batch = self._spawn("--batch")
+            self.requests_served += 1
+            parts = self._request(self._batch, rev)
+            if parts is None:
+                return None, None
+
+            content = self._batch.stdout.read(int(parts[2]))
+            self._batch.stdout.read(1)  # Trailing newline after the object
+
+        return parts[1].decode(), content
+
+    def mode(self, commit_sha: str, file_path: str) -> Optional[str]:
+        """Looks up the mode of a path in the tree of a commit, e.g. '100644' for a
+        regular file or '160000' for a submodule.
+
+        Args:
+            commit_sha (str): The commit to look in.
+            file_path (str): Path of the file relative to the repo.
+
+        Returns:
+            Optional[str]: The mode of the tree entry, or None if the path does not exist.
+        """
+        parent, _, name = file_path.rstrip('/').rpartition('/')
+        obj_type, tree = self.read(f"{commit_sha}:{parent}")
+        if obj_type != 'tree':
+            return None
+
+        name = name.encode('utf-8')
+        position = 0
+        while position < len(tree):
+            space = tree.index(b' ', position)
+            null = tree.index(b'\0', space)
+            if tree[space + 1:null] == name:
+                return tree[position:space].decode().rjust(6, '0')
+            position = null + 21  # Skip the 20-byte object id
+
+        return None
+
+    def close(self) -> None:
+        """Terminates the underlying git processes."""
+        with self._lock:
+            for process in (self._batch, self._batch_check):
+                if process is None:
+                    continue
+                if process.poll() is None:
+                    process.stdin.close()
+                    process.wait()
+                process.stdout.close()
+            self._batch = None
+            self._batch_check = None
+
+    def __enter__(self) -> 'CatFile':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+_cat_files: Dict[str, CatFile] = {}
+_cat_files_lock = threading.Lock()
+
+def get_cat_file(repo_path: str) -> CatFile:
+    """Returns the shared `CatFile` of a repository, starting it on first use.
+
+    Args:
+        repo_path (str): The path to the repository.
+
+    Returns:
+        CatFile: The object reader of the repository.
+    """
+    key = path.abspath(repo_path)
+    with _cat_files_lock:
+        cat_file = _cat_files.get(key)
+        if cat_file is None:
+            cat_file = _cat_files[key] = CatFile(repo_path)
+        return cat_file
+
+def cat_file_stats() -> Dict[str, int]:
+    """Reports how many requests each pooled `CatFile` has served.
+
+    Returns:
+        Dict[str, int]: The number of requests served, by repository path.
+    """
+    with _cat_files_lock:
+        return {key: cat_file.requests_served for key, cat_file in _cat_files.items()}
+
+@atexit.register
+def close_cat_files() -> None:
+    """Terminates all pooled `CatFile` processes."""
+    with _cat_files_lock:
+        for cat_file in _cat_files.values():
+            cat_file.close()
+        _cat_files.clear()
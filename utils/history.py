@@ -0,0 +1,318 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Union
+import subprocess
+
+from models.commit import Commit
+from models.file import File
+from models.cf import CommitFile
+from models.hunk import Hunk
+from utils.diff import CHANGE_TYPE_PATTERN, HUNK_PATTERN, INDEX_PATTERN, MODE_PATTERN, unquote_path
+from utils.git import CatFile, get_cat_file, repo_and_org_from_path
+
+# Each commit starts with a record separator line holding the sha, the commit timestamp
+# and the parents, followed by the raw message terminated by a unit separator line.
+# A merge is printed once per parent, each time with its diff against that parent.
+COMMIT_FORMAT = '%x1e%H %ct %P%n%B%x1f'
+
+SUBMODULE_MODE = '160000'
+
+HistoryItem = Union[Commit, File, CommitFile, Hunk]
+
+def get_blob_content(cat_file: CatFile, blob_sha: str) -> str:
+    """Returns the content of a blob the same way `File.get_file_content` does.
+
+    Args:
+        cat_file (CatFile) - The object reader of the repository.
+        blob_sha (str) - The SHA of the blob.
+
+    Returns:
+        str: The decoded content, '<binary content>', 'File is empty' or
+            "Couldn't retrieve content".
+    """
+    _, content = cat_file.read(blob_sha)
+    if content is None:
+        return "Couldn't retrieve content"
+    if File.is_binary(content):
+        return '<binary content>'
+
+    content = content.decode('utf-8', errors='replace')
+    if not content.strip():
+        return "File is empty"
+    return content
+
+class _RawEntry:
+    __slots__ = ('file_name', 'old_mode', 'new_mode', 'new_sha', 'status')
+
+    def __init__(self, line: str):
+        meta, file_name = line[1:].split('\t', 1)
+        self.old_mode, self.new_mode, _, self.new_sha, self.status = meta.split(' ')[:5]
+        self.file_name = unquote_path(file_name)
+
+class _Section:
+    """Collects the patch of a single file of a commit."""
+
+    def __init__(self, commit: Commit, entry: _RawEntry):
+        self.commit = commit
+        self.entry = entry
+        self.old_name = None
+        self.new_name = None
+        self.change_type = None
+        self.file_mode = None
+        self.index_info = None
+        self.in_header = True
+        self.hunks: List[Hunk] = []
+
+    def feed(self, line: str) -> None:
+        if self.in_header:
+            if line.startswith('--- '):
+                self.old_name = unquote_path(line[4:].rstrip('\t'))
+                return
+            if line.startswith('+++ '):
+                self.new_name = unquote_path(line[4:].rstrip('\t'))
+                return
+
+            change_match = CHANGE_TYPE_PATTERN.match(line)
+            if change_match:
+                self.change_type = change_match.group(1)
+
+            mode_match = MODE_PATTERN.match(line)
+            if mode_match:
+                self.file_mode = mode_match.group(1)
+
+            index_match = INDEX_PATTERN.match(line)
+            if index_match:
+                self.index_info = index_match.group(1)
+                if index_match.group(2):
+                    self.file_mode = index_match.group(2)
+                if self.change_type is None:
+                    self.change_type = 'modified'
+
+        hunk_match = HUNK_PATTERN.match(line)
+        if hunk_match:
+            self.in_header = False
+            old_start, old_length, new_start, new_length = hunk_match.groups()
+            self.hunks.append(Hunk(
+                None,
+                self.entry.file_name,
+                self.commit.repo_name,
+                self.commit.org_name,
+                self.commit.sha,
+                int(old_start),
+                int(old_length) if old_length is not None else 1,
+                int(new_start),
+                int(new_length) if new_length is not None else 1,
+                [],
+                self.old_name,
+                self.new_name
+            ))
+        elif not self.in_header:
+            self.hunks[-1].lines.append(line)
+
+class _CommitDiff:
+    """Collects the file sections of a commit and emits them the way the per-file stages
+    build them from `Commit.get_file_names_from_commit`, `File.get_file_content` and
+    `CommitFile.get_metadata`:
+
+    - a file gets a `CommitFile` only if it has hunks;
+    - a renamed file holds 'File was renamed in this commit', both under its old and its new path;
+    - a merge has the files changed since any of its parents, each with its content at
+      the merge and its hunks against every parent (`git show -m`), so its sections are
+      held until the diffs against all of its parents have been read.
+    """
+
+    def __init__(self, commit: Commit, is_merge: bool, repo_path: str, cat_file: CatFile):
+        self.commit = commit
+        self.is_merge = is_merge
+        self.repo_path = repo_path
+        self.cat_file = cat_file
+        self.parent = 0
+        self.entries: Dict[str, _RawEntry] = {}
+        self.first_parent = set()
+        self.may_rename = False
+        self.sections: Dict[str, List[_Section]] = {}
+
+    def add_entries(self, entries: List[_RawEntry]) -> List[str]:
+        """Records the files changed since the current parent.
+
+        Returns:
+            List[str]: The files not changed since any of the previous parents.
+        """
+        new_names = []
+        for entry in entries:
+            if entry.file_name not in self.entries:
+                self.entries[entry.file_name] = entry
+                new_names.append(entry.file_name)
+        if self.parent == 0:
+            self.first_parent.update(new_names)
+            statuses = {entry.status for entry in entries}
+            # Without rename detection a rename is a deletion plus an addition
+            self.may_rename = self.may_rename or ('D' in statuses and 'A' in statuses)
+        return new_names
+
+    def add(self, section: _Section) -> Iterator[HistoryItem]:
+        if self.is_merge:
+            self.sections.setdefault(section.entry.file_name, []).append(section)
+        else:
+            yield from self._emit([section])
+
+    def finish(self) -> Iterator[HistoryItem]:
+        for file_name in self.entries:
+            if file_name in self.sections:
+                yield from self._emit(self.sections[file_name])
+
+    def _content(self, entry: _RawEntry) -> str:
+        if entry.new_mode == SUBMODULE_MODE:
+            return 'This is a submodule'
+        if entry.file_name not in self.first_parent:
+            # Unchanged since the first parent, so read as it is at the merge
+            return get_blob_content(self.cat_file, f'{self.commit.sha}:{entry.file_name}')
+        if self.may_rename and entry.status in ('A', 'D') and \
+                File.get_file_status(self.repo_path, self.commit.sha, entry.file_name) == 'renamed':
+            return 'File was renamed in this commit'
+        if entry.status == 'D':
+            return 'File was deleted in this commit'
+        return get_blob_content(self.cat_file, entry.new_sha)
+
+    def _emit(self, sections: List[_Section]) -> Iterator[HistoryItem]:
+        sections = [section for section in sections if section.hunks]
+        if not sections:
+            return
+
+        first = sections[0]
+        entry = self.entries[first.entry.file_name]
+        yield CommitFile(
+            self.commit.repo_name,
+            self.commit.org_name,
+            entry.file_name,
+            self.commit.sha,
+            self._content(entry),
+            first.change_type,
+            first.file_mode,
+            first.index_info
+        )
+        for section in sections:
+            yield from section.hunks
+
+def extract_history(repo_path: str, cutoff_date: Optional[datetime] = None, rev: str = 'HEAD') -> Iterator[HistoryItem]:
+    """Walks the history of a repository with a single `git log --raw --patch` process
+    and yields the rows of every stage of the dataset as they are parsed.
+
+    For each commit a `Commit` is yielded first, then a `File` for every file not seen
+    before in this walk, then for each changed file its `CommitFile` followed by its
+    `Hunk`s, so the objects can be loaded in foreign key order. File contents are read
+    through one `git cat-file --batch` process shared by the whole walk.
+
+    The rows are the ones the per-file stages build from `Commit.get_file_names_from_commit`,
+    `File.get_file_content` and `CommitFile.get_metadata`: a renamed file shows up as a
+    deletion of the old path and an addition of the new path, both with the content
+    'File was renamed in this commit'; a merge has the files changed since any of its
+    parents, with their hunks against every parent; a root commit and the files without
+    hunks get no `CommitFile`, see `_CommitDiff`.
+
+    Args:
+        repo_path (str) - The path to the repository.\n
+        cutoff_date (Optional[datetime]) - Commits committed after this date are skipped.\n
+        rev (str) - The revision range to walk, e.g. 'HEAD' or '<sha>..HEAD'.\n
+
+    Yields:
+        Commit | File | CommitFile | Hunk: The parsed rows.
+    """
+    repo_name, org_name = repo_and_org_from_path(repo_path)
+    cmd = [
+        'git', 'log', '--no-renames', '--raw', '--patch', '--no-abbrev', '--no-color',
+        '--no-ext-diff', '--no-textconv', '--diff-merges=separate',
+        f'--format={COMMIT_FORMAT}', rev, '--'
+    ]
+    process = subprocess.Popen(
+        cmd,
+        cwd=repo_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    cat_file = get_cat_file(repo_path)
+    seen_files = set()
+
+    current_sha = None
+    diff: Optional[_CommitDiff] = None
+    entries: List[_RawEntry] = []
+    section = None
+
+    try:
+        lines = iter(process.stdout)
+        for raw_line in lines:
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\n')
+
+            if line.startswith('\x1e'):
+                if section is not None:
+                    yield from diff.add(section)
+                    section = None
+
+                sha, committed, *parents = line[1:].split()
+                message = []
+                for raw_message_line in lines:
+                    message_line = raw_message_line.decode('utf-8', errors='replace')
+                    if message_line.rstrip('\n').endswith('\x1f'):
+                        message.append(message_line.rstrip('\n')[:-1])
+                        break
+                    message.append(message_line)
+
+                entries = []
+                if sha == current_sha:
+                    # The diff of a merge against its next parent
+                    if diff is not None:
+                        diff.parent += 1
+                    continue
+
+                current_sha = sha
+                if diff is not None:
+                    yield from diff.finish()
+                    diff = None
+                committed = int(committed)
+                if cutoff_date is not None and datetime.fromtimestamp(committed, tz=timezone.utc) > cutoff_date:
+                    continue
+
+                commit = Commit(
+                    sha=sha,
+                    repo_name=repo_name,
+                    org_name=org_name,
+                    timestamp=datetime.fromtimestamp(committed),
+                    message=''.join(message).strip()
+                )
+                yield commit
+                # `git diff-tree` lists no files for a root commit
+                if parents:
+                    diff = _CommitDiff(commit, len(parents) > 1, repo_path, cat_file)
+                continue
+
+            if diff is None:
+                continue
+
+            if section is None and line.startswith(':'):
+                entries.append(_RawEntry(line))
+                continue
+
+            if line.startswith('diff --git '):
+                if section is None:
+                    for file_name in diff.add_entries(entries):
+                        if file_name not in seen_files:
+                            seen_files.add(file_name)
+                            yield File(file_name, repo_name, org_name, file_name.split('.')[-1].lower())
+                    entries.reverse()
+                else:
+                    yield from diff.add(section)
+
+                section = _Section(diff.commit, entries.pop()) if entries else None
+                continue
+
+            if section is not None:
+                section.feed(line)
+
+        if section is not None:
+            yield from diff.add(section)
+        if diff is not None:
+            yield from diff.finish()
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
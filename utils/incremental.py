@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from os import path, listdir
+from typing import Dict, List, Optional
+import traceback
+
+from models.commit import Commit
+from models.file import File
+from models.cf import CommitFile
+from models.hunk import Hunk
+from models.watermark import Watermark
+from utils.git import fetch, get_cat_file, head_sha, refs_state, repo_and_org_from_path
+from utils.history import extract_history
+from utils.postgres import create_watermarks_table
+
+# Number of hunks buffered before the pending rows are written to the database
+FLUSH_THRESHOLD = 20000
+
+class _Loader:
+    """Buffers the rows yielded by `extract_history` and writes them in foreign key order."""
+
+    def __init__(self):
+        self.commits: List[Commit] = []
+        self.files: List[File] = []
+        self.cfs: List[CommitFile] = []
+        self.hunks: List[Hunk] = []
+        self.newest_sha: Optional[str] = None
+        self.counts: Dict[str, int] = {'commits': 0, 'files': 0, 'commit_files': 0, 'hunks': 0}
+
+    def add(self, item) -> None:
+        if isinstance(item, Commit):
+            if len(self.hunks) >= FLUSH_THRESHOLD:
+                self.flush()
+            if self.newest_sha is None:
+                self.newest_sha = item.sha
+            self.commits.append(item)
+        elif isinstance(item, File):
+            self.files.append(item)
+        elif isinstance(item, CommitFile):
+            self.cfs.append(item)
+        else:
+            self.hunks.append(item)
+
+    def flush(self) -> None:
+        if self.commits:
+            Commit.add_commit_in_batches(self.commits, use_copy=True)
+        if self.files:
+            File.add_files_in_batches(self.files, use_copy=True)
+        if self.cfs:
+            CommitFile.add_cfs_in_batches(self.cfs, use_copy=True)
+        if self.hunks:
+            Hunk.add_hunks_in_batches(self.hunks, use_copy=True)
+
+        self.counts['commits'] += len(self.commits)
+        self.counts['files'] += len(self.files)
+        self.counts['commit_files'] += len(self.cfs)
+        self.counts['hunks'] += len(self.hunks)
+        self.commits, self.files, self.cfs, self.hunks = [], [], [], []
+
+def refresh_repository(repo_path: str, cutoff_date: Optional[datetime] = None, fetch_remote: bool = True) -> Dict[str, int]:
+    """Brings the dataset up to date with a repository. New commits are fetched into
+    the bare clone, then only the history between the repository's watermark and HEAD
+    is walked and loaded into commits, files, commit_files and hunks. The watermark
+    is moved to HEAD once everything is written; a repository whose refs did not
+    change since the last run is skipped without walking anything.
+
+    When `cutoff_date` skips HEAD, the watermark is only moved to the newest commit
+    loaded, without the refs state, so the next run walks the skipped commits again.
+
+    Args:
+        repo_path (str) - The path to the bare clone of the repository.\n
+        cutoff_date (Optional[datetime]) - Commits committed after this date are skipped.\n
+        fetch_remote (bool) - If True, runs `git fetch` on the clone first.
+
+    Returns:
+        Dict[str, int]: The number of rows written per table.
+    """
+    repo_name, org_name = repo_and_org_from_path(repo_path)
+    if fetch_remote:
+        fetch(repo_path)
+
+    state = refs_state(repo_path)
+    watermark = Watermark.fetch(repo_name, org_name)
+    loader = _Loader()
+    if watermark and watermark.refs_state == state:
+        return loader.counts
+
+    head = head_sha(repo_path)
+    rev = head
+    if watermark and get_cat_file(repo_path).info(watermark.last_sha)[0] == 'commit':
+        rev = f"{watermark.last_sha}..{head}"
+
+    for item in extract_history(repo_path, cutoff_date, rev):
+        loader.add(item)
+    loader.flush()
+
+    up_to_date = watermark is not None and watermark.last_sha == head
+    if loader.newest_sha == head or up_to_date:
+        Watermark.save(Watermark(repo_name, org_name, head, state, datetime.now()))
+    elif loader.newest_sha is not None:
+        Watermark.save(Watermark(repo_name, org_name, loader.newest_sha, None, datetime.now()))
+    return loader.counts
+
+def refresh_all(parent_folder: str, max_workers: int, cutoff_date: Optional[datetime] = None, fetch_remote: bool = True) -> Dict[str, Dict[str, int]]:
+    """Runs `refresh_repository` on every repository downloaded under `parent_folder`
+    (laid out as `<parent_folder>/<org_name>/<repo_name>`).
+
+    Args:
+        parent_folder (str) - The path to the folder containing all organizations.\n
+        max_workers (int) - The number of repositories refreshed concurrently.\n
+        cutoff_date (Optional[datetime]) - Commits committed after this date are skipped.\n
+        fetch_remote (bool) - If True, runs `git fetch` on each clone first.
+
+    Returns:
+        Dict[str, Dict[str, int]]: The number of rows written per table, by repository path.
+    """
+    create_watermarks_table()
+
+    repo_paths = []
+    for org_dir in sorted(listdir(parent_folder)):
+        org_path = path.join(parent_folder, org_dir)
+        if path.isdir(org_path):
+            for repo_dir in sorted(listdir(org_path)):
+                repo_path = path.join(org_path, repo_dir)
+                if path.isdir(repo_path):
+                    repo_paths.append(repo_path)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(refresh_repository, repo_path, cutoff_date, fetch_remote): repo_path
+            for repo_path in repo_paths
+        }
+        for future in as_completed(futures):
+            repo_path = futures[future]
+            try:
+                results[repo_path] = future.result()
+            except Exception as e:
+                print(f"Error refreshing {repo_path}: {e}")
+                traceback.print_exc()
+
+    return results
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+import threading
+
+from utils.postgres import general_lookup_in_batches
+
+# Number of commit ids and of file ids each process keeps in memory
+CACHE_SIZE = 500000
+
+class _LRUCache:
+    """A thread-safe mapping that forgets the least recently used keys past `maxsize`."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[int]:
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: int) -> None:
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+_repo_ids = _LRUCache(10000)
+_commit_ids = _LRUCache(CACHE_SIZE)
+_file_ids = _LRUCache(CACHE_SIZE)
+
+def repo_ids(keys: Iterable[Tuple[str, str]]) -> List[Optional[int]]:
+    """Maps (repo_name, org_name) pairs to repository ids.
+
+    Args:
+        keys (Iterable[Tuple[str, str]]) - The repository and organization names.
+
+    Returns:
+        List[Optional[int]]: The ids aligned with `keys`, None for unknown repositories.
+    """
+    keys = list(keys)
+    ids = [_repo_ids.get(key) for key in keys]
+    missing = list(dict.fromkeys(key for key, id in zip(keys, ids) if id is None))
+    if missing:
+        found = general_lookup_in_batches('repositories', [{'repo_name': repo_name, 'org_name': org_name} for repo_name, org_name in missing], 'repo_id')
+        looked_up: Dict[Tuple[str, str], int] = {}
+        for key, id in zip(missing, found):
+            if id is not None:
+                _repo_ids.put(key, id)
+                looked_up[key] = id
+        ids = [id if id is not None else looked_up.get(key) for key, id in zip(keys, ids)]
+    return ids
+
+def repo_id(repo_name: str, org_name: str) -> Optional[int]:
+    """Returns the id of a repository, None if it is not in the database."""
+    return repo_ids([(repo_name, org_name)])[0]
+
+def _ids_by_name(cache: _LRUCache, table: str, name_column: str, id_column: str, keys: List[Tuple[str, str, str]]) -> List[Optional[int]]:
+    repos = repo_ids((repo_name, org_name) for repo_name, org_name, _ in keys)
+    scoped = [(repo, name) if repo is not None else None for repo, (_, _, name) in zip(repos, keys)]
+    ids = [cache.get(key) if key is not None else None for key in scoped]
+
+    missing = list(dict.fromkeys(key for key, id in zip(scoped, ids) if key is not None and id is None))
+    if missing:
+        found = general_lookup_in_batches(table, [{'repo_id': repo, name_column: name} for repo, name in missing], id_column)
+        looked_up = {}
+        for key, id in zip(missing, found):
+            if id is not None:
+                cache.put(key, id)
+                looked_up[key] = id
+        ids = [id if id is not None else looked_up.get(key) for key, id in zip(scoped, ids)]
+    return ids
+
+def commit_ids(keys: Iterable[Tuple[str, str, str]]) -> List[Optional[int]]:
+    """Maps (repo_name, org_name, sha) triples to commit ids, querying only the ones
+    that are not cached yet, in one batched query.
+
+    Args:
+        keys (Iterable[Tuple[str, str, str]]) - The repository, organization and commit sha.
+
+    Returns:
+        List[Optional[int]]: The ids aligned with `keys`, None for unknown commits.
+    """
+    return _ids_by_name(_commit_ids, 'commits', 'sha', 'commit_id', list(keys))
+
+def file_ids(keys: Iterable[Tuple[str, str, str]]) -> List[Optional[int]]:
+    """Maps (repo_name, org_name, file_name) triples to file ids, querying only the ones
+    that are not cached yet, in one batched query.
+
+    Args:
+        keys (Iterable[Tuple[str, str, str]]) - The repository, organization and file name.
+
+    Returns:
+        List[Optional[int]]: The ids aligned with `keys`, None for unknown files.
+    """
+    return _ids_by_name(_file_ids, 'files', 'file_name', 'file_id', list(keys))
+
+def require(ids: List[Optional[int]], keys: list, kind: str) -> List[int]:
+    """Returns `ids` unchanged, or raises if one of the keys has no id.
+
+    Args:
+        ids (List[Optional[int]]) - The looked up ids.\n
+        keys (list) - The keys the ids were looked up for.\n
+        kind (str) - What the keys name, for the error message.
+
+    Returns:
+        List[int]: The ids.
+    """
+    for key, id in zip(keys, ids):
+        if id is None:
+            raise ValueError(f"{kind} {key} is not in the database")
+    return ids
+
+def clear_cache() -> None:
+    """Forgets every cached id, e.g. after the database was recreated."""
+    _repo_ids.clear()
+    _commit_ids.clear()
+    _file_ids.clear()
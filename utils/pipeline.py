@@ -0,0 +1,357 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from os import path, makedirs, replace
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import argparse
+import json
+import traceback
+
+import pandas as pd
+import pytz
+
+from models.commit import Commit
+from models.ecosystem import Ecosystem
+from models.file import File
+from models.organization import Organization
+from models.repository import Repository
+from utils.git import download
+from utils.postgres import initialize_db
+from utils.stages import process_cfs_and_hunks
+from utils.worker import get_optimal_max_workers
+
+ECO_ORG_DICT = {
+    "aws-samples": "Amazon AWS",
+    "Azure-Samples": "Microsoft Azure",
+    "googlesamples": "Google Android",
+    "spring-guides": "Spring Boot",
+    "spring-cloud-samples": "Spring Boot",
+}
+
+@dataclass(frozen=True)
+class Stage:
+    """A node of the pipeline. Per-repository stages run once for every sample and only
+    wait for their dependencies on the same repository; global stages run once and wait
+    for their dependencies on every repository."""
+    name: str
+    depends_on: Tuple[str, ...]
+    per_repo: bool
+
+# In topological order, so the tasks of a repository are submitted in the order the
+# notebooks run them.
+STAGES: Dict[str, Stage] = {stage.name: stage for stage in [
+    Stage('download', (), True),
+    Stage('ecosystems', (), False),
+    Stage('organizations', ('ecosystems',), False),
+    Stage('repositories', ('organizations',), False),
+    Stage('commits', ('download', 'repositories'), True),
+    Stage('files', ('commits',), True),
+    Stage('cfs', ('files',), True),
+    Stage('hunks', ('cfs',), True),
+]}
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """The settings shared by every task. It is sent to the worker processes, so it only
+    holds picklable values."""
+    csv_path: str
+    parent_folder: str
+    cutoff_date: datetime
+    threads: int
+
+Task = Tuple[str, Optional[str]]
+
+def read_samples(csv_path: str) -> pd.DataFrame:
+    """Reads the code samples spreadsheet the same way the notebooks do.
+
+    Args:
+        csv_path (str) - The path to `code_samples.csv`.
+
+    Returns:
+        pd.DataFrame: One row per repository with a GitHub URL.
+    """
+    repos = pd.read_csv(csv_path, skiprows=1)
+    return repos.dropna(subset=['html_url'])
+
+def sample_name(row: pd.Series) -> str:
+    """Returns the `<org_name>/<repo_name>` name of a sample, as used by `download`.
+
+    Args:
+        row (pd.Series) - A row of the code samples spreadsheet.
+
+    Returns:
+        str: The name of the sample.
+    """
+    return f"{row['html_url'].split('/')[3]}/{row['name']}"
+
+class Checkpoint:
+    """Records the completed tasks in an append-only JSON lines file, one line per
+    (stage, repository) pair, so an interrupted run resumes where it stopped. A task
+    is recorded only once it has finished, and every stage writes with
+    `ON CONFLICT DO NOTHING`, so a task cut short is simply run again."""
+
+    def __init__(self, checkpoint_path: str):
+        self.path = checkpoint_path
+        self.done: Set[Task] = set()
+        if path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line torn by a crash is treated as not completed
+                        continue
+                    self.done.add((entry['stage'], entry['repo']))
+
+    def is_done(self, task: Task) -> bool:
+        return task in self.done
+
+    def mark(self, task: Task) -> None:
+        self.done.add(task)
+        makedirs(path.dirname(path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'stage': task[0], 'repo': task[1], 'finished_at': datetime.now().isoformat()}) + '\n')
+
+    def reset(self, stages: Iterable[str]) -> None:
+        """Forgets the completed tasks of the given stages."""
+        stages = set(stages)
+        self.done = {task for task in self.done if task[0] not in stages}
+        if not path.exists(self.path):
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(self.path, encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+            for line in src:
+                try:
+                    if json.loads(line)['stage'] in stages:
+                        continue
+                except json.JSONDecodeError:
+                    continue
+                dst.write(line)
+        replace(tmp_path, self.path)
+
+def _run_download(config: PipelineConfig, repo: str) -> int:
+    download(repo, repo_dir=config.parent_folder)
+    return 1
+
+def _run_ecosystems(config: PipelineConfig, repo: None) -> int:
+    samples = read_samples(config.csv_path)
+    ecosystems = [Ecosystem(name) for name in sorted(set(samples['Ecosystem']))]
+    Ecosystem.add_ecosystems_in_batches(ecosystems)
+    return len(ecosystems)
+
+def _run_organizations(config: PipelineConfig, repo: None) -> int:
+    samples = read_samples(config.csv_path)
+    org_names = sorted({url.split('/')[3] for url in samples['html_url']})
+    organizations = [Organization(org_name, ECO_ORG_DICT[org_name], f"https://github.com/{org_name}") for org_name in org_names]
+    Organization.add_organizations_in_batches(organizations)
+    return len(organizations)
+
+def _run_repositories(config: PipelineConfig, repo: None) -> int:
+    samples = read_samples(config.csv_path)
+    repos = [Repository.csv_row_to_Repository(row) for _, row in samples.iterrows()]
+    repos = [repo for repo in repos if repo is not None]
+    Repository.add_repositories_in_batches(repos)
+    return len(repos)
+
+def _run_commits(config: PipelineConfig, repo: str) -> int:
+    commits = Commit.get_commit_data(path.join(config.parent_folder, *repo.split('/')), config.cutoff_date)
+    if commits:
+        Commit.add_commit_in_batches(commits, use_copy=True)
+    return len(commits)
+
+def _run_files(config: PipelineConfig, repo: str) -> int:
+    org_name, repo_name = repo.split('/')
+    repo_path = path.join(config.parent_folder, org_name, repo_name)
+    commits = Commit.fetch_by_repo(repo_name, org_name)
+
+    names = set()
+    with ThreadPoolExecutor(max_workers=config.threads) as executor:
+        for file_names in executor.map(lambda com: Commit.get_file_names_from_commit(repo_path, com.sha), commits):
+            names.update(file_names or [])
+
+    candidates = [File(name, repo_name, org_name, name.split('.')[-1].lower()) for name in sorted(names)]
+    new_files = File.filter_new(candidates) if candidates else []
+    if new_files:
+        File.add_files_in_batches(new_files, use_copy=True)
+    return len(new_files)
+
+def _run_cfs(config: PipelineConfig, repo: str) -> int:
+    org_name, repo_name = repo.split('/')
+    total_cfs, _ = process_cfs_and_hunks(Commit.fetch_by_repo(repo_name, org_name), config.parent_folder, config.threads)
+    return total_cfs
+
+def _run_hunks(config: PipelineConfig, repo: str) -> int:
+    # The cfs stage writes every batch of commit files together with its hunks, so
+    # there is nothing left to do; the node is kept so the graph mirrors the notebooks.
+    return 0
+
+STAGE_RUNNERS: Dict[str, Callable[[PipelineConfig, Optional[str]], int]] = {
+    'download': _run_download,
+    'ecosystems': _run_ecosystems,
+    'organizations': _run_organizations,
+    'repositories': _run_repositories,
+    'commits': _run_commits,
+    'files': _run_files,
+    'cfs': _run_cfs,
+    'hunks': _run_hunks,
+}
+
+def run_task(stage: str, repo: Optional[str], config: PipelineConfig) -> int:
+    """Runs one stage for one repository (or once, for global stages) in a worker process.
+
+    Args:
+        stage (str) - The name of the stage.\n
+        repo (Optional[str]) - The `<org_name>/<repo_name>` sample, None for global stages.\n
+        config (PipelineConfig) - The pipeline settings.
+
+    Returns:
+        int: The number of rows (or repositories) the task handled.
+    """
+    return STAGE_RUNNERS[stage](config, repo)
+
+def with_dependencies(stages: Iterable[str]) -> List[str]:
+    """Returns the given stages and every stage they depend on, in topological order."""
+    selected = set()
+    pending = list(stages)
+    while pending:
+        name = pending.pop()
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}', expected one of {', '.join(STAGES)}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(STAGES[name].depends_on)
+    return [name for name in STAGES if name in selected]
+
+def run_pipeline(config: PipelineConfig, stages: List[str], repos: List[str], checkpoint: Checkpoint, processes: int) -> Dict[str, List[Task]]:
+    """Runs the stage graph over the given repositories. Every task whose dependencies
+    are completed is submitted to a process pool right away, so a repository can be
+    loading its commit files while others are still being cloned. Completed tasks are
+    skipped, and a failed task only blocks the tasks that depend on it.
+
+    Args:
+        config (PipelineConfig) - The pipeline settings.\n
+        stages (List[str]) - The stages to run, in topological order.\n
+        repos (List[str]) - The `<org_name>/<repo_name>` samples to process.\n
+        checkpoint (Checkpoint) - The record of completed tasks.\n
+        processes (int) - The number of worker processes.
+
+    Returns:
+        Dict[str, List[Task]]: The tasks that 'completed', 'failed' or were 'blocked'.
+    """
+    selected = set(stages)
+    pending: List[Task] = []
+    for name in stages:
+        tasks = [(name, repo) for repo in repos] if STAGES[name].per_repo else [(name, None)]
+        pending.extend(task for task in tasks if not checkpoint.is_done(task))
+
+    def dependency_tasks(task: Task) -> List[Task]:
+        name, repo = task
+        deps = []
+        for dep in STAGES[name].depends_on:
+            if dep not in selected:
+                continue
+            if not STAGES[dep].per_repo:
+                deps.append((dep, None))
+            elif repo is not None:
+                deps.append((dep, repo))
+            else:
+                deps.extend((dep, other) for other in repos)
+        return deps
+
+    completed: List[Task] = []
+    failed: Set[Task] = set()
+    blocked: Set[Task] = set()
+    running: Dict[Future, Task] = {}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            still_pending = []
+            for task in pending:
+                deps = dependency_tasks(task)
+                if all(checkpoint.is_done(dep) for dep in deps):
+                    running[executor.submit(run_task, task[0], task[1], config)] = task
+                else:
+                    still_pending.append(task)
+            pending = still_pending
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                label = f"{task[0]}" + (f" {task[1]}" if task[1] else '')
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error running {label}: {e}", flush=True)
+                    traceback.print_exception(e)
+                    failed.add(task)
+                    continue
+                checkpoint.mark(task)
+                completed.append(task)
+                print(f"Finished {label} ({result})", flush=True)
+
+            # Tasks depending on a failed one can never run in this invocation
+            still_pending = []
+            for task in pending:
+                if any(dep in failed or dep in blocked for dep in dependency_tasks(task)):
+                    blocked.add(task)
+                else:
+                    still_pending.append(task)
+            pending = still_pending
+
+    return {'completed': completed, 'failed': sorted(failed, key=str), 'blocked': sorted(blocked, key=str)}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m utils.pipeline',
+        description='Builds the code samples dataset without the notebooks, resuming from the last checkpoint.'
+    )
+    parser.add_argument('--csv', default='code_samples.csv', help='Path to the code samples spreadsheet.')
+    parser.add_argument('--parent-folder', default=path.join('download', 'orgs'), help='Folder the repositories are cloned into.')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint file (defaults to pipeline_checkpoint.jsonl next to the parent folder).')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma separated stages to run; their dependencies are added.')
+    parser.add_argument('--repos', default=None, help='Comma separated <org_name>/<repo_name> samples to restrict the run to.')
+    parser.add_argument('--cutoff', default=None, help='ISO date after which commits are skipped (defaults to now).')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes.')
+    parser.add_argument('--threads', type=int, default=None, help='Number of threads per worker for git calls.')
+    parser.add_argument('--reset', action='store_true', help='Forget the checkpoints of the requested stages first.')
+    parser.add_argument('--init-db', action='store_true', help='Recreate the database and forget all checkpoints first.')
+    args = parser.parse_args(argv)
+
+    parent_folder = path.normpath(args.parent_folder)
+    checkpoint_path = args.checkpoint or path.join(path.dirname(path.abspath(parent_folder)), 'pipeline_checkpoint.jsonl')
+    checkpoint = Checkpoint(checkpoint_path)
+
+    requested = [name.strip() for name in args.stages.split(',') if name.strip()]
+    stages = with_dependencies(requested)
+
+    if args.init_db:
+        initialize_db()
+        checkpoint.reset([name for name in STAGES if name != 'download'])
+    elif args.reset:
+        checkpoint.reset(requested)
+
+    repos = [sample_name(row) for _, row in read_samples(args.csv).iterrows()]
+    if args.repos:
+        wanted = {repo.strip() for repo in args.repos.split(',')}
+        repos = [repo for repo in repos if repo in wanted]
+
+    cutoff_date = datetime.fromisoformat(args.cutoff) if args.cutoff else datetime.now(pytz.timezone("UTC"))
+    if cutoff_date.tzinfo is None:
+        cutoff_date = pytz.UTC.localize(cutoff_date)
+
+    processes = args.processes or max(1, get_optimal_max_workers() // 4)
+    threads = args.threads or get_optimal_max_workers()
+    config = PipelineConfig(args.csv, parent_folder, cutoff_date, threads)
+
+    makedirs(parent_folder, exist_ok=True)
+    summary = run_pipeline(config, stages, repos, checkpoint, processes)
+
+    print(f"{len(summary['completed'])} tasks completed, {len(summary['failed'])} failed, "
+          f"{len(summary['blocked'])} blocked by failures", flush=True)
+    return 1 if summary['failed'] or summary['blocked'] else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
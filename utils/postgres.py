@@ -1,5 +1,14 @@
-from psycopg2 import connect, extensions, extras
-from os import getenv
+from psycopg2 import Error, connect, extensions, extras, pool
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import chain, islice
+from os import getenv, getpid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from utils.git import git_blob_id
+import struct
+import threading
+import time
+import uuid
 
 def db_conn(db: str, password: str, user: str) -> extensions.connection:
     """Connects to the specified database.
@@ -20,6 +29,415 @@ def db_conn(db: str, password: str, user: str) -> extensions.connection:
         port = '5432'        
     )
     
+class ConnectionPool:
+    '''Thread-safe pool of connections to the dataset database. Checkouts wait until
+    a connection is free instead of failing when all `maxconn` connections are in use,
+    and raise `PoolError` if none frees up within `checkout_timeout`.
+
+    A thread must not check out a second connection while it holds one: no database
+    helper may be called inside a `with connection()` block (including from a generator
+    consumed there), since threads holding every connection would wait on each other.
+
+    Args:
+        minconn (int) - The number of connections opened upfront.\n
+        maxconn (int) - The maximum number of open connections.\n
+        health_check_interval (float) - Connections idle for longer than this many
+            seconds are checked with `SELECT 1` before being handed out.\n
+        checkout_timeout (Optional[float]) - The seconds a checkout waits for a free
+            connection, None to wait forever.
+    '''
+    def __init__(self, minconn: int, maxconn: int, health_check_interval: float = 30.0,
+                 checkout_timeout: Optional[float] = 300.0):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self._pool = pool.ThreadedConnectionPool(
+            minconn, maxconn,
+            database = 'code_samples',
+            user = 'codesamples_user',
+            host = 'localhost',
+            password = 'codesamples',
+            port = '5432'
+        )
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used: Dict[int, float] = {}
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.failed_health_checks = 0
+
+    def _is_healthy(self, conn: extensions.connection) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Error:
+            return False
+
+    def _checkout(self) -> extensions.connection:
+        conn = self._pool.getconn()
+        while not self._is_healthy(conn):
+            with self._stats_lock:
+                self.failed_health_checks += 1
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[extensions.connection]:
+        """Checks out a connection for the duration of the `with` block. The transaction
+        is committed when the block succeeds and rolled back when it raises.
+
+        Yields:
+            psycopg2.extensions.connection: The connection object.
+
+        Raises:
+            psycopg2.pool.PoolError: If no connection is free within `checkout_timeout`.
+        """
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise pool.PoolError(f"No connection free after {self.checkout_timeout}s, "
+                                 f"a connection may be checked out while another is held: {self.stats()}")
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except Exception:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except Error:
+                pass
+            raise
+        finally:
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=bool(conn.closed))
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Returns the checkout and wait-time metrics of the pool.
+
+        Returns:
+            dict: The number of checkouts, the total, mean and max time spent waiting
+                for a connection in seconds, and the number of failed health checks.
+        """
+        with self._stats_lock:
+            return {
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+                'checkouts': self.checkouts,
+                'total_wait': self.total_wait,
+                'mean_wait': self.total_wait / self.checkouts if self.checkouts else 0.0,
+                'max_wait': self.max_wait,
+                'failed_health_checks': self.failed_health_checks,
+            }
+
+    def close(self) -> None:
+        """Closes all connections of the pool."""
+        self._pool.closeall()
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+_pool_config = {
+    'minconn': int(getenv('DB_POOL_MIN', '1')),
+    'maxconn': int(getenv('DB_POOL_MAX', '32')),
+    'checkout_timeout': float(getenv('DB_POOL_TIMEOUT', '300')),
+}
+
+def configure_pool(minconn: int = 1, maxconn: int = 32, health_check_interval: float = 30.0,
+                   checkout_timeout: Optional[float] = 300.0) -> None:
+    """Sets the size of the process-wide connection pool, replacing the current pool.
+    Defaults can also be set with the `DB_POOL_MIN`, `DB_POOL_MAX` and `DB_POOL_TIMEOUT`
+    environment variables.
+    
+    Args:
+        minconn (int) - The number of connections opened upfront.\n
+        maxconn (int) - The maximum number of open connections.\n
+        health_check_interval (float) - Idle seconds after which a connection is checked before reuse.\n
+        checkout_timeout (Optional[float]) - The seconds a checkout waits for a free connection, None to wait forever.
+    """
+    global _pool
+    with _pool_lock:
+        _pool_config.update(minconn=minconn, maxconn=maxconn, health_check_interval=health_check_interval,
+                            checkout_timeout=checkout_timeout)
+        if _pool is not None and _pool_pid == getpid():
+            _pool.close()
+        _pool = None
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use (and again
+    in a forked child, which must not share the connections of its parent).
+    
+    Returns:
+        ConnectionPool: The connection pool.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != getpid():
+            _pool = ConnectionPool(**_pool_config)
+            _pool_pid = getpid()
+        return _pool
+
+def connection():
+    """Checks out a connection of the process-wide pool, see `ConnectionPool.connection`.
+    No other database helper may be called while it is held.
+    
+    Usage:
+        with connection() as conn:
+            ...
+    """
+    return get_pool().connection()
+
+def pool_stats() -> dict:
+    """Returns the metrics of the process-wide connection pool, see `ConnectionPool.stats`."""
+    return get_pool().stats()
+    
+REPOSITORIES_TABLE = """CREATE TABLE IF NOT EXISTS repositories (
+        repo_name TEXT,
+        eco_name TEXT,
+        org_name TEXT,
+        stars INT,
+        forks INT,
+        watchers INT,
+        contributors INT,
+        language TEXT,
+        size FLOAT,
+        loc FLOAT,
+        archived BOOLEAN,
+        repo_id SERIAL PRIMARY KEY,
+        UNIQUE (repo_name, org_name),
+        FOREIGN KEY (eco_name) REFERENCES ecosystems(eco_name),
+        FOREIGN KEY (org_name) REFERENCES organizations(org_name)
+    );"""
+
+COMMITS_TABLE = """CREATE TABLE IF NOT EXISTS commits (
+        commit_id BIGSERIAL PRIMARY KEY,
+        repo_id INT NOT NULL REFERENCES repositories(repo_id),
+        sha TEXT NOT NULL,
+        timestamp TIMESTAMP,
+        message TEXT,
+        UNIQUE (repo_id, sha)
+    );"""
+
+FILES_TABLE = """CREATE TABLE IF NOT EXISTS files (
+        file_id BIGSERIAL PRIMARY KEY,
+        repo_id INT NOT NULL REFERENCES repositories(repo_id),
+        file_name TEXT NOT NULL,
+        type TEXT,
+        UNIQUE (repo_id, file_name)
+    );"""
+
+BLOBS_TABLE = """CREATE TABLE IF NOT EXISTS blobs (
+        blob_id TEXT PRIMARY KEY,
+        content TEXT
+    );"""
+
+COMMIT_FILES_TABLE = """CREATE TABLE IF NOT EXISTS commit_files (
+        commit_id BIGINT REFERENCES commits(commit_id),
+        file_id BIGINT REFERENCES files(file_id),
+        blob_id TEXT REFERENCES blobs(blob_id),
+        change_type TEXT,
+        file_mode TEXT,
+        index_info TEXT,
+        PRIMARY KEY (commit_id, file_id)
+    );"""
+
+HUNKS_TABLE = """CREATE TABLE IF NOT EXISTS hunks (
+        id SERIAL PRIMARY KEY,
+        commit_id BIGINT,
+        file_id BIGINT,
+        old_start INT,
+        new_start INT,
+        old_length INT,
+        new_length INT,
+        old_name TEXT,
+        new_name TEXT,
+        lines TEXT[],
+        FOREIGN KEY (commit_id, file_id) REFERENCES commit_files(commit_id, file_id),
+        UNIQUE (commit_id, file_id, old_start, new_start, old_length, new_length)
+    );"""
+
+REPO_WATERMARKS_TABLE = """CREATE TABLE IF NOT EXISTS repo_watermarks (
+        repo_name TEXT,
+        org_name TEXT,
+        last_sha TEXT,
+        refs_state TEXT,
+        updated_at TIMESTAMP,
+        PRIMARY KEY (repo_name, org_name),
+        FOREIGN KEY (repo_name, org_name) REFERENCES repositories(repo_name, org_name)
+    );"""
+
+# The tables above reference repositories, commits and files by integer id. These views
+# restore the name-keyed column layout the tables had before, followed by the ids, so
+# reads by name keep working and keyset pagination can still walk the ids.
+VIEWS = [
+    """CREATE OR REPLACE VIEW commits_view AS
+        SELECT c.sha, r.repo_name, r.org_name, c.timestamp, c.message, c.commit_id, c.repo_id
+        FROM commits c
+        JOIN repositories r ON r.repo_id = c.repo_id;""",
+    """CREATE OR REPLACE VIEW files_view AS
+        SELECT f.file_name, r.repo_name, r.org_name, f.type, f.file_id, f.repo_id
+        FROM files f
+        JOIN repositories r ON r.repo_id = f.repo_id;""",
+    """CREATE OR REPLACE VIEW commit_files_view AS
+        SELECT r.repo_name, r.org_name, f.file_name, c.sha, b.content,
+            cf.change_type, cf.file_mode, cf.index_info, cf.commit_id, cf.file_id
+        FROM commit_files cf
+        JOIN commits c ON c.commit_id = cf.commit_id
+        JOIN files f ON f.file_id = cf.file_id
+        JOIN repositories r ON r.repo_id = c.repo_id
+        LEFT JOIN blobs b ON b.blob_id = cf.blob_id;""",
+    """CREATE OR REPLACE VIEW hunks_view AS
+        SELECT h.id, f.file_name, r.repo_name, r.org_name, c.sha, h.old_start, h.new_start,
+            h.old_length, h.new_length, h.old_name, h.new_name, h.lines, h.commit_id, h.file_id
+        FROM hunks h
+        JOIN commits c ON c.commit_id = h.commit_id
+        JOIN files f ON f.file_id = h.file_id
+        JOIN repositories r ON r.repo_id = c.repo_id;""",
+]
+
+def create_watermarks_table() -> None:
+    """Creates the `repo_watermarks` table in a database set up before it existed."""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(REPO_WATERMARKS_TABLE)
+
+def _has_column(cursor: extensions.cursor, table: str, column: str) -> bool:
+    cursor.execute("""SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s AND column_name = %s;""", (table, column))
+    return cursor.fetchone() is not None
+
+def _migrate_commit_files_to_blobs(batch_size: int) -> int:
+    """Moves the inline `commit_files.content` into `blobs`, one row per distinct
+    content, and replaces the column by `blob_id`. The rows are migrated page by page
+    in key order, so an interrupted migration can simply be run again."""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(BLOBS_TABLE)
+        if not _has_column(cursor, 'commit_files', 'content'):
+            return 0
+        cursor.execute("DROP VIEW IF EXISTS commit_files_view;")
+        cursor.execute("ALTER TABLE commit_files ADD COLUMN IF NOT EXISTS blob_id TEXT REFERENCES blobs(blob_id);")
+    
+    key_columns = ['file_name', 'repo_name', 'org_name', 'sha']
+    migrated = 0
+    rows = general_iter_keyset('commit_files', key_columns + ['content'], batch_size, key_columns)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        blobs = {}
+        updates = []
+        for *key, content in batch:
+            blob_id = git_blob_id(content) if content is not None else None
+            if blob_id is not None:
+                blobs[blob_id] = content
+            updates.append((*key, blob_id))
+        
+        with connection() as conn, conn.cursor() as cursor:
+            if blobs:
+                extras.execute_values(cursor, """INSERT INTO blobs (blob_id, content) VALUES %s ON CONFLICT DO NOTHING;""", list(blobs.items()))
+            extras.execute_values(cursor, """UPDATE commit_files AS cf SET blob_id = v.blob_id
+                FROM (VALUES %s) AS v(file_name, repo_name, org_name, sha, blob_id)
+                WHERE (cf.file_name, cf.repo_name, cf.org_name, cf.sha) = (v.file_name, v.repo_name, v.org_name, v.sha);""", updates)
+        migrated += len(batch)
+    
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE commit_files DROP COLUMN content;")
+    
+    return migrated
+
+def _migrate_to_surrogate_keys() -> bool:
+    """Rebuilds `commits`, `files`, `commit_files` and `hunks` keyed by integer ids in a
+    single transaction. The old tables are moved to a scratch schema first so their
+    constraint names do not clash with the new ones, then copied over and dropped."""
+    with connection() as conn, conn.cursor() as cursor:
+        if _has_column(cursor, 'commits', 'commit_id'):
+            return False
+        
+        cursor.execute(REPO_WATERMARKS_TABLE)
+        cursor.execute("DROP VIEW IF EXISTS commit_files_view;")
+        cursor.execute("CREATE SCHEMA migration_old;")
+        for table in ('hunks', 'commit_files', 'files', 'commits'):
+            cursor.execute(f"ALTER TABLE {table} SET SCHEMA migration_old;")
+        
+        cursor.execute("ALTER TABLE repositories ADD COLUMN repo_id SERIAL;")
+        cursor.execute("ALTER TABLE repositories DROP CONSTRAINT repositories_pkey CASCADE;")
+        cursor.execute("ALTER TABLE repositories ADD PRIMARY KEY (repo_id), ADD UNIQUE (repo_name, org_name);")
+        cursor.execute("""ALTER TABLE repo_watermarks ADD FOREIGN KEY (repo_name, org_name)
+            REFERENCES repositories(repo_name, org_name);""")
+        
+        for ddl in (COMMITS_TABLE, FILES_TABLE, COMMIT_FILES_TABLE, HUNKS_TABLE):
+            cursor.execute(ddl)
+        
+        cursor.execute("""INSERT INTO commits (repo_id, sha, timestamp, message)
+            SELECT r.repo_id, c.sha, c.timestamp, c.message
+            FROM migration_old.commits c JOIN repositories r USING (repo_name, org_name)
+            ORDER BY r.repo_id, c.timestamp;""")
+        cursor.execute("""INSERT INTO files (repo_id, file_name, type)
+            SELECT r.repo_id, f.file_name, f.type
+            FROM migration_old.files f JOIN repositories r USING (repo_name, org_name)
+            ORDER BY r.repo_id, f.file_name;""")
+        cursor.execute("""INSERT INTO commit_files (commit_id, file_id, blob_id, change_type, file_mode, index_info)
+            SELECT c.commit_id, f.file_id, cf.blob_id, cf.change_type, cf.file_mode, cf.index_info
+            FROM migration_old.commit_files cf
+            JOIN repositories r USING (repo_name, org_name)
+            JOIN commits c ON c.repo_id = r.repo_id AND c.sha = cf.sha
+            JOIN files f ON f.repo_id = r.repo_id AND f.file_name = cf.file_name;""")
+        cursor.execute("""INSERT INTO hunks (id, commit_id, file_id, old_start, new_start, old_length, new_length, old_name, new_name, lines)
+            SELECT h.id, c.commit_id, f.file_id, h.old_start, h.new_start, h.old_length, h.new_length, h.old_name, h.new_name, h.lines
+            FROM migration_old.hunks h
+            JOIN repositories r USING (repo_name, org_name)
+            JOIN commits c ON c.repo_id = r.repo_id AND c.sha = h.sha
+            JOIN files f ON f.repo_id = r.repo_id AND f.file_name = h.file_name;""")
+        cursor.execute("SELECT setval(pg_get_serial_sequence('hunks', 'id'), COALESCE(MAX(id), 1)) FROM hunks;")
+        
+        cursor.execute("DROP SCHEMA migration_old CASCADE;")
+    
+    return True
+
+def migrate_schema(batch_size: int = 2000) -> None:
+    """Brings a database created by an older `initialize_db` to the current schema:
+    file contents are moved to `blobs`, then repositories, commits and files get
+    integer ids that `commit_files` and `hunks` reference, and the name-keyed views
+    are created. Steps already applied are skipped. Run `VACUUM FULL` afterwards to
+    give the freed space back to the operating system.
+    
+    Args:
+        batch_size (int) - The number of commit files moved to `blobs` per transaction.
+    """
+    _migrate_commit_files_to_blobs(batch_size)
+    _migrate_to_surrogate_keys()
+    
+    with connection() as conn, conn.cursor() as cursor:
+        for view in VIEWS:
+            cursor.execute(view)
+    _column_types.clear()
+    _primary_keys.clear()
+    
 def initialize_db():
     DB_PASSWORD = getenv('DB_PASSWORD')
     conn = db_conn('postgres', DB_PASSWORD, 'postgres')
@@ -73,73 +491,22 @@ def initialize_db():
         FOREIGN KEY (eco_name) REFERENCES ecosystems(eco_name)
     );""")
     
-    cursor.execute(f"""CREATE TABLE IF NOT EXISTS repositories (
-        repo_name TEXT,
-        eco_name TEXT,
-        org_name TEXT,
-        stars INT,
-        forks INT,
-        watchers INT,
-        contributors INT,
-        language TEXT,
-        size FLOAT,
-        loc FLOAT,
-        archived BOOLEAN,
-        PRIMARY KEY (repo_name, org_name),
-        FOREIGN KEY (eco_name) REFERENCES ecosystems(eco_name),
-        FOREIGN KEY (org_name) REFERENCES organizations(org_name)
-    );""")
-
-    cursor.execute(f"""CREATE TABLE IF NOT EXISTS commits (
-        sha TEXT,
-        repo_name TEXT,
-        org_name TEXT,
-        timestamp TIMESTAMP,
-        message TEXT,
-        PRIMARY KEY (sha, repo_name, org_name),
-        FOREIGN KEY (repo_name, org_name) REFERENCES repositories(repo_name, org_name)
-    );""")
+    cursor.execute(REPOSITORIES_TABLE)
     
-    cursor.execute(f"""CREATE TABLE IF NOT EXISTS files (
-        file_name TEXT,
-        repo_name TEXT,
-        org_name TEXT,
-        type TEXT,
-        PRIMARY KEY (file_name, repo_name, org_name),
-        FOREIGN KEY (repo_name, org_name) REFERENCES repositories(repo_name, org_name)
-    );""")
+    cursor.execute(COMMITS_TABLE)
     
-    cursor.execute(f"""CREATE TABLE IF NOT EXISTS commit_files (
-        repo_name TEXT,
-        org_name TEXT,
-        file_name TEXT,
-        sha TEXT,
-        content TEXT,
-        change_type TEXT,
-        file_mode TEXT,
-        index_info TEXT,
-        PRIMARY KEY (file_name, repo_name, org_name, sha),
-        FOREIGN KEY (sha, repo_name, org_name) REFERENCES commits(sha, repo_name, org_name),
-        FOREIGN KEY (file_name, repo_name, org_name) REFERENCES files(file_name, repo_name, org_name)
-    );""")
+    cursor.execute(FILES_TABLE)
     
-    cursor.execute(f"""CREATE TABLE IF NOT EXISTS hunks (
-        id SERIAL PRIMARY KEY,
-        file_name TEXT,
-        repo_name TEXT,
-        org_name TEXT,
-        sha TEXT,
-        old_start INT,
-        new_start INT,
-        old_length INT,
-        new_length INT,
-        old_name TEXT,
-        new_name TEXT,
-        lines TEXT[],
-        FOREIGN KEY (file_name, repo_name, org_name, sha) 
-            REFERENCES commit_files(file_name, repo_name, org_name, sha),
-        UNIQUE (file_name, repo_name, org_name, sha, old_start, new_start, old_length, new_length)
-    );""")
+    cursor.execute(BLOBS_TABLE)
+    
+    cursor.execute(COMMIT_FILES_TABLE)
+    
+    cursor.execute(HUNKS_TABLE)
+    
+    cursor.execute(REPO_WATERMARKS_TABLE)
+    
+    for view in VIEWS:
+        cursor.execute(view)
 
     conn.commit()
 
@@ -153,69 +520,346 @@ def general_add(table: str, values: dict):
         table (str) - The name of the table to add the row to.\n
         values (dict) - The values to insert into the table.
     """
-    conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-    cursor = conn.cursor()
+    columns = ', '.join(values.keys())
+    placeholders = ', '.join([f'%({key})s' for key in values.keys()])
     
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""INSERT INTO {table} ({columns}) VALUES ({placeholders});""", values)
+    
+def general_upsert(table: str, values: dict, conflict_columns: List[str]):
+    """Adds a row to the specified table, or updates the existing row with the same
+    `conflict_columns`.
+    
+    Args:
+        table (str) - The name of the table to add the row to.\n
+        values (dict) - The values to insert into the table.\n
+        conflict_columns (List[str]) - The columns of the unique constraint identifying the row.
+    """
     columns = ', '.join(values.keys())
     placeholders = ', '.join([f'%({key})s' for key in values.keys()])
+    updates = ', '.join([f'{key} = EXCLUDED.{key}' for key in values.keys() if key not in conflict_columns])
     
-    cursor.execute(f"""INSERT INTO {table} ({columns}) VALUES ({placeholders});""", values)
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""INSERT INTO {table} ({columns}) VALUES ({placeholders})
+            ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {updates};""", values)
     
-    conn.commit()
-    cursor.close()
-    conn.close()
+def iter_batches(values: Iterable, batch_size: int) -> Iterator[list]:
+    """Splits an iterable into lists of at most `batch_size` items, reading it lazily.
     
-def general_add_in_batches(table: str, values: list):
-    """Adds rows to the specified table in batches.
+    Args:
+        values (Iterable) - The items to split.\n
+        batch_size (int) - The number of items per list.
+        
+    Yields:
+        list: The next items.
+    """
+    values = iter(values)
+    while True:
+        batch = list(islice(values, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def general_add_in_batches(table: str, values: Iterable[dict], batch_size: int = 3000):
+    """Adds rows to the specified table in batches. Only one batch is read from `values`
+    at a time, so it can be a generator, as long as it does not query the database itself:
+    it is read while a pooled connection is held.
     
     Args:
         table (str) - The name of the table to add the rows to.\n
-        values (list) - The values to insert into the table.
+        values (Iterable[dict]) - The values to insert into the table, all with the same keys.\n
+        batch_size (int) - The number of rows sent per round-trip.
     """
-    conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-    cursor = conn.cursor()
-    
-    columns = ', '.join(values[0].keys())
-    placeholders = ', '.join([f'%({key})s' for key in values[0].keys()])
+    values = iter(values)
+    first = next(values, None)
+    if first is None:
+        return
+    columns = ', '.join(first.keys())
+    placeholders = ', '.join([f'%({key})s' for key in first.keys()])
+    
+    with connection() as conn, conn.cursor() as cursor:
+        for batch in iter_batches(chain([first], values), batch_size):
+            extras.execute_batch(cursor, f"""INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING;""", batch)
+    
+def general_add_in_transaction(tables: List[Tuple[str, list]]):
+    """Adds rows to several tables in batches within a single transaction, in the
+    given order, so rows referenced by foreign keys can be inserted first and either
+    all tables are written or none is.
     
+    Args:
+        tables (List[Tuple[str, list]]) - The table names and the values to insert into each.
+    """
     batch_size = 3000
     
-    for i in range(0, len(values), batch_size):
-        batch = values[i:i + batch_size]
-        extras.execute_batch(cursor, f"""INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING;""", batch)
+    with connection() as conn, conn.cursor() as cursor:
+        for table, values in tables:
+            if not values:
+                continue
+            columns = ', '.join(values[0].keys())
+            placeholders = ', '.join([f'%({key})s' for key in values[0].keys()])
+            
+            for i in range(0, len(values), batch_size):
+                batch = values[i:i + batch_size]
+                extras.execute_batch(cursor, f"""INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING;""", batch)
+    
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('!h', -1)
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+
+def _copy_text_value(value) -> str:
+    """Encodes a value as a field of the COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, (list, tuple)):
+        elements = []
+        for element in value:
+            if element is None:
+                elements.append('NULL')
+            else:
+                element = str(element).replace('\\', '\\\\').replace('"', '\\"')
+                elements.append(f'"{element}"')
+        value = '{' + ','.join(elements) + '}'
+    elif isinstance(value, datetime):
+        value = value.isoformat(sep=' ')
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _copy_binary_text(value) -> bytes:
+    return str(value).encode('utf-8')
+
+def _copy_binary_timestamp(value: datetime) -> bytes:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - POSTGRES_EPOCH
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+def _copy_binary_text_array(value, element_oid: int) -> bytes:
+    """Encodes a one-dimensional array of `element_oid` (25 for text, 1043 for varchar),
+    which `array_recv` checks against the element type of the column."""
+    if not value:
+        return struct.pack('!iii', 0, 0, element_oid)
+    has_null = any(element is None for element in value)
+    parts = [struct.pack('!iiiii', 1, int(has_null), element_oid, len(value), 1)]
+    for element in value:
+        if element is None:
+            parts.append(struct.pack('!i', -1))
+        else:
+            encoded = str(element).encode('utf-8')
+            parts.append(struct.pack('!i', len(encoded)) + encoded)
+    return b''.join(parts)
+
+# Binary encoders by type OID for the column types used in the schema
+COPY_BINARY_ENCODERS = {
+    16: lambda value: b'\x01' if value else b'\x00',
+    20: lambda value: struct.pack('!q', value),
+    21: lambda value: struct.pack('!h', value),
+    23: lambda value: struct.pack('!i', value),
+    25: _copy_binary_text,
+    700: lambda value: struct.pack('!f', value),
+    701: lambda value: struct.pack('!d', value),
+    1009: lambda value: _copy_binary_text_array(value, 25),
+    1015: lambda value: _copy_binary_text_array(value, 1043),
+    1042: _copy_binary_text,
+    1043: _copy_binary_text,
+    1114: _copy_binary_timestamp,
+    1184: _copy_binary_timestamp,
+}
+
+class _CopyStream:
+    """File-like object that encodes rows for `COPY ... FROM STDIN` only as they are read."""
+
+    def __init__(self, rows: Iterable[dict], columns: List[str], encoders: Optional[list] = None):
+        self.rows = iter(rows)
+        self.columns = columns
+        self.encoders = encoders
+        self.buffer = bytearray(COPY_BINARY_HEADER if encoders else b'')
+        self.finished = False
+        self.row_count = 0
+
+    def _encode(self, row: dict) -> bytes:
+        if self.encoders is None:
+            return ('\t'.join(_copy_text_value(row[column]) for column in self.columns) + '\n').encode('utf-8')
+
+        parts = [struct.pack('!h', len(self.columns))]
+        for column, encoder in zip(self.columns, self.encoders):
+            value = row[column]
+            if value is None:
+                parts.append(struct.pack('!i', -1))
+            else:
+                encoded = encoder(value)
+                parts.append(struct.pack('!i', len(encoded)) + encoded)
+        return b''.join(parts)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            row = next(self.rows, None)
+            if row is None:
+                self.finished = True
+                if self.encoders:
+                    self.buffer += COPY_BINARY_TRAILER
+                break
+            self.buffer += self._encode(row)
+            self.row_count += 1
+
+        if size < 0:
+            size = len(self.buffer)
+        chunk = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return chunk
+
+def _column_type_oids(cursor: extensions.cursor, table: str) -> Dict[str, int]:
+    cursor.execute("""SELECT attname, atttypid FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;""", (table,))
+    return dict(cursor.fetchall())
+
+def general_copy_in_batches(table: str, values: Iterable[dict], format: str = 'text', batch_size: int = 50000) -> int:
+    """Adds rows to the specified table through `COPY ... FROM STDIN`. Each batch is
+    streamed into a temporary staging table and then merged into the table, skipping
+    rows that already exist (`ON CONFLICT DO NOTHING`). Rows are encoded as the COPY
+    consumes them, so `values` can be a generator and never has to fit in memory; it must
+    not query the database itself, since it is read while a pooled connection is held.
     
-    conn.commit()
-    cursor.close()
-    conn.close()
+    Args:
+        table (str) - The name of the table to add the rows to.\n
+        values (Iterable[dict]) - The rows to insert, all with the same keys.\n
+        format (str) - The COPY format, 'text' or 'binary'.\n
+        batch_size (int) - The number of rows staged and merged per transaction.
+        
+    Returns:
+        int: The number of rows streamed to the database.
+    """
+    if format not in ('text', 'binary'):
+        raise ValueError(f"Unsupported COPY format: {format}")
+
+    values = iter(values)
+    first = next(values, None)
+    if first is None:
+        return 0
+    values = chain([first], values)
+    columns = list(first.keys())
+    column_list = ', '.join(columns)
+    staging = f"{table}_staging"
+
+    total = 0
+    with connection() as conn, conn.cursor() as cursor:
+        encoders = None
+        if format == 'binary':
+            oids = _column_type_oids(cursor, table)
+            unsupported = [column for column in columns if oids[column] not in COPY_BINARY_ENCODERS]
+            if unsupported:
+                raise ValueError(f"No binary COPY encoder for columns {unsupported} of {table}")
+            encoders = [COPY_BINARY_ENCODERS[oids[column]] for column in columns]
+
+        while True:
+            stream = _CopyStream(islice(values, batch_size), columns, encoders)
+            cursor.execute(f"""CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+                SELECT {column_list} FROM {table} WITH NO DATA;""")
+            cursor.copy_expert(f"""COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT {format});""", stream)
+            cursor.execute(f"""INSERT INTO {table} ({column_list})
+                SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING;""")
+            conn.commit()
+
+            total += stream.row_count
+            if stream.row_count < batch_size:
+                break
+
+    return total
     
-def general_exists_in_batches(table: str, values: list) -> list:
-    """Checks if rows exist in the specified table in batches.
+_column_types: Dict[str, Dict[str, str]] = {}
+
+def _get_column_types(cursor: extensions.cursor, table: str) -> Dict[str, str]:
+    """Returns the SQL types of the columns of a table or view, cached per process."""
+    if table not in _column_types:
+        cursor.execute("""SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;""", (table,))
+        _column_types[table] = dict(cursor.fetchall())
+    return _column_types[table]
+
+def general_exists_in_batches(table: str, values: list, batch_size: int = 3000) -> List[bool]:
+    """Checks if rows exist in the specified table in batches. Each batch is checked
+    with a single query that joins the table against the batch passed as `unnest`
+    arrays, one per column.
     
     Args:
         table (str) - The name of the table to check.\n
-        values (list) - The values to check for in the table.
+        values (list) - The values to check for in the table, all with the same keys.\n
+        batch_size (int) - The number of rows checked per query.
         
     Returns:
-        list: A list of True/False values for each row in the batch.
+        List[bool]: A list of True/False values aligned with `values`.
     """
-    conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-    cursor = conn.cursor()
-    
-    columns = ' AND '.join([f'{key} = %({key})s' for key in values[0].keys()])
-    
-    batch_size = 3000
-    exists = []
-    
-    for i in range(0, len(values), batch_size):
-        batch = values[i:i + batch_size]
-        for row in batch:
-            cursor.execute(f"""SELECT 1 FROM {table} WHERE {columns};""", row)
-            exists.append(cursor.fetchone())
+    if not values:
+        return []
+
+    keys = list(values[0].keys())
+    exists = [False] * len(values)
+
+    with connection() as conn, conn.cursor() as cursor:
+        types = _get_column_types(cursor, table)
+        arrays = ', '.join([f'%s::{types[key]}[]' for key in keys])
+        conditions = ' AND '.join([f't.{key} = v.{key}' for key in keys])
+        query = f"""SELECT v._ord FROM unnest({arrays}) WITH ORDINALITY AS v({', '.join(keys)}, _ord)
+            WHERE EXISTS (SELECT 1 FROM {table} t WHERE {conditions});"""
+
+        for i in range(0, len(values), batch_size):
+            batch = values[i:i + batch_size]
+            cursor.execute(query, [[row[key] for row in batch] for key in keys])
+            for (ordinality,) in cursor.fetchall():
+                exists[i + ordinality - 1] = True
+
+    return exists
+
+def general_lookup_in_batches(table: str, values: list, column: str, batch_size: int = 3000) -> list:
+    """Fetches one column of the row matching each of the values in batches, e.g. the
+    id of a row by its unique name. Batches are joined against the table the same way
+    as in `general_exists_in_batches`.
     
-    cursor.close()
-    conn.close()
+    Args:
+        table (str) - The name of the table to look up.\n
+        values (list) - The unique values to look up in the table, all with the same keys.\n
+        column (str) - The column to fetch.\n
+        batch_size (int) - The number of rows looked up per query.
+        
+    Returns:
+        list: The fetched values aligned with `values`, None where no row matches.
+    """
+    if not values:
+        return []
+
+    keys = list(values[0].keys())
+    found = [None] * len(values)
+
+    with connection() as conn, conn.cursor() as cursor:
+        types = _get_column_types(cursor, table)
+        arrays = ', '.join([f'%s::{types[key]}[]' for key in keys])
+        conditions = ' AND '.join([f't.{key} = v.{key}' for key in keys])
+        query = f"""SELECT v._ord, t.{column} FROM unnest({arrays}) WITH ORDINALITY AS v({', '.join(keys)}, _ord)
+            JOIN {table} t ON {conditions};"""
+
+        for i in range(0, len(values), batch_size):
+            batch = values[i:i + batch_size]
+            cursor.execute(query, [[row[key] for row in batch] for key in keys])
+            for ordinality, value in cursor.fetchall():
+                found[i + ordinality - 1] = value
+
+    return found
+
+def general_filter_new_in_batches(table: str, values: list, batch_size: int = 3000) -> list:
+    """Keeps only the rows that do not exist in the specified table yet, see
+    `general_exists_in_batches`.
     
-    return exists
+    Args:
+        table (str) - The name of the table to check.\n
+        values (list) - The rows to filter, all with the same keys.\n
+        batch_size (int) - The number of rows checked per query.
+        
+    Returns:
+        list: The rows of `values` missing from the table, in their original order.
+    """
+    return [row for row, exists in zip(values, general_exists_in_batches(table, values, batch_size)) if not exists]
     
 def general_exists(table: str, values: dict) -> bool:
     """Checks if a row exists in the specified table.
@@ -227,58 +871,146 @@ def general_exists(table: str, values: dict) -> bool:
     Returns:
         bool: True if the row exists in the table, False otherwise.
     """
-    conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-    cursor = conn.cursor()
-    
     columns = ' AND '.join([f'{key} = %({key})s' for key in values.keys()])
     
-    cursor.execute(f"""SELECT 1 FROM {table} WHERE {columns};""", values)
-    exists = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""SELECT 1 FROM {table} WHERE {columns};""", values)
+        exists = cursor.fetchone()
     
     return exists
 
-def general_fetch_by_args(table: str, values: dict) -> list:
+def general_fetch_by_args(table: str, values: dict, columns: Optional[List[str]] = None) -> list:
     """Fetches rows from the specified table by unknown arguments.
     
     Args:
         table (str) - The name of the table to fetch from.\n
-        values (dict) - The values to fetch from the table.
+        values (dict) - The values to fetch from the table.\n
+        columns (Optional[List[str]]) - The columns to fetch, all of them if None.
         
     Returns:
         list: A list of all rows in the table that match the values.
     """
-    conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-    cursor = conn.cursor()
+    conditions = ' AND '.join([f'{key} = %({key})s' for key in values.keys()])
+    column_list = ', '.join(columns) if columns else '*'
     
-    columns = ' AND '.join([f'{key} = %({key})s' for key in values.keys()])
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""SELECT {column_list} FROM {table} WHERE {conditions};""", values)
+        rows = cursor.fetchone()
     
-    cursor.execute(f"""SELECT * FROM {table} WHERE {columns};""", values)
-    rows = cursor.fetchone()
+    return rows
+
+def general_fetch_all_by_args(table: str, values: dict, columns: Optional[List[str]] = None) -> list:
+    """Fetches every row from the specified table that matches the arguments.
     
-    cursor.close()
-    conn.close()
+    Args:
+        table (str) - The name of the table to fetch from.\n
+        values (dict) - The values to fetch from the table.\n
+        columns (Optional[List[str]]) - The columns to fetch, all of them if None.
+        
+    Returns:
+        list: A list of all rows in the table that match the values.
+    """
+    conditions = ' AND '.join([f'{key} = %({key})s' for key in values.keys()])
+    column_list = ', '.join(columns) if columns else '*'
+    
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""SELECT {column_list} FROM {table} WHERE {conditions};""", values)
+        rows = cursor.fetchall()
     
     return rows
 
-def general_fetch_all(table: str) -> list:
+def general_fetch_all(table: str, columns: Optional[List[str]] = None) -> list:
     """Fetches all rows from the specified table.
     
     Args:
-        table (str) - The name of the table to fetch from.
+        table (str) - The name of the table to fetch from.\n
+        columns (Optional[List[str]]) - The columns to fetch, all of them if None.
         
     Returns:
         list: A list of all rows in the table.
     """
-    conn = db_conn('code_samples', 'codesamples', 'codesamples_user')
-    cursor = conn.cursor()
+    column_list = ', '.join(columns) if columns else '*'
     
-    cursor.execute(f"""SELECT * FROM {table};""")
-    rows = cursor.fetchall()
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""SELECT {column_list} FROM {table};""")
+        rows = cursor.fetchall()
     
-    cursor.close()
-    conn.close()
+    return rows
+
+def general_iter_all(table: str, columns: Optional[List[str]] = None, itersize: int = 2000, order_by: Optional[List[str]] = None) -> Iterator[tuple]:
+    """Streams all rows from the specified table through a named server-side cursor,
+    so only `itersize` rows are held in memory at a time. The pooled connection stays
+    checked out until the iterator is exhausted or closed.
     
-    return rows
\ No newline at end of file
+    Args:
+        table (str) - The name of the table to fetch from.\n
+        columns (Optional[List[str]]) - The columns to fetch, all of them if None.\n
+        itersize (int) - The number of rows fetched from the server per round-trip.\n
+        order_by (Optional[List[str]]) - The columns to sort the rows by.
+        
+    Yields:
+        tuple: The rows of the table.
+    """
+    column_list = ', '.join(columns) if columns else '*'
+    order = f" ORDER BY {', '.join(order_by)}" if order_by else ''
+
+    with connection() as conn, conn.cursor(name=f"iter_{table}_{uuid.uuid4().hex}") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(f"""SELECT {column_list} FROM {table}{order};""")
+        yield from cursor
+
+_primary_keys: Dict[str, List[str]] = {}
+
+def _get_primary_key(cursor: extensions.cursor, table: str) -> List[str]:
+    """Returns the primary key columns of a table in index order, cached per process."""
+    if table not in _primary_keys:
+        cursor.execute("""SELECT a.attname FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND i.indisprimary
+            ORDER BY array_position(i.indkey::int2[], a.attnum);""", (table,))
+        _primary_keys[table] = [row[0] for row in cursor.fetchall()]
+    return _primary_keys[table]
+
+def general_iter_keyset(table: str, columns: Optional[List[str]] = None, page_size: int = 5000, key_columns: Optional[List[str]] = None) -> Iterator[tuple]:
+    """Streams all rows from the specified table page by page with keyset pagination
+    (`WHERE (key) > (last key) ORDER BY key LIMIT n`). Unlike `general_iter_all` no
+    transaction is held open between pages, so a slow consumer does not pin a connection.
+    
+    Args:
+        table (str) - The name of the table to fetch from.\n
+        columns (Optional[List[str]]) - The columns to fetch, all of them if None.\n
+        page_size (int) - The number of rows fetched per query.\n
+        key_columns (Optional[List[str]]) - The unique columns to paginate by, the primary key if None.
+        
+    Yields:
+        tuple: The rows of the table, in key order.
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        if key_columns is None:
+            key_columns = _get_primary_key(cursor, table)
+        if not key_columns:
+            raise ValueError(f"{table} has no primary key, pass key_columns explicitly")
+        if columns is None:
+            columns = list(_get_column_types(cursor, table).keys())
+
+    key_list = ', '.join(key_columns)
+    column_list = ', '.join(key_columns + columns)
+    key_placeholders = ', '.join(['%s'] * len(key_columns))
+    key_count = len(key_columns)
+    last_key = None
+
+    while True:
+        with connection() as conn, conn.cursor() as cursor:
+            if last_key is None:
+                cursor.execute(f"""SELECT {column_list} FROM {table} ORDER BY {key_list} LIMIT %s;""", (page_size,))
+            else:
+                cursor.execute(f"""SELECT {column_list} FROM {table} WHERE ({key_list}) > ({key_placeholders})
+                    ORDER BY {key_list} LIMIT %s;""", (*last_key, page_size))
+            rows = cursor.fetchall()
+
+        for row in rows:
+            yield row[key_count:]
+
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][:key_count]
\ No newline at end of file
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import path
+from typing import Iterable, List, Tuple
+
+from models.commit import Commit
+from models.file import File
+from models.cf import CommitFile, MetadataHelper
+from models.hunk import Hunk
+
+# Number of commit files buffered before they are written with their hunks
+FLUSH_THRESHOLD = 5000
+
+def build_cfs_and_hunks(com: Commit, repo_path: str) -> Tuple[List[CommitFile], List[Hunk]]:
+    """Builds the commit files and hunks of a commit, reading the content and the diff
+    metadata of each of its files only once.
+
+    Args:
+        com (Commit) - The commit to process.\n
+        repo_path (str) - The path to the repository the commit is in.
+
+    Returns:
+        Tuple[List[CommitFile], List[Hunk]]: One commit file per changed file that has
+            hunks, and the hunks of those files.
+    """
+    cfs = []
+    hunks = []
+
+    for name in Commit.get_file_names_from_commit(repo_path, com.sha) or []:
+        file_content, file_name = File.get_file_content(repo_path, com.sha, name)
+        metadata_list: List[MetadataHelper] = CommitFile.get_metadata(
+            com.org_name, com.repo_name, com.sha, file_name, repo_path=repo_path
+        )
+        if not metadata_list:
+            continue
+
+        first = metadata_list[0]
+        cfs.append(CommitFile(com.repo_name, com.org_name, file_name, com.sha, file_content,
+                              first.change_type, first.file_mode, first.index_info))
+        for metadata in metadata_list:
+            hunks.append(Hunk(None, file_name, com.repo_name, com.org_name, com.sha,
+                              metadata.old_start, metadata.old_length, metadata.new_start,
+                              metadata.new_length, metadata.lines, metadata.old_name, metadata.new_name))
+
+    return cfs, hunks
+
+def process_cfs_and_hunks(commits: Iterable[Commit], parent_folder: str, max_workers: int) -> Tuple[int, int]:
+    """Fills both the `commit_files` and the `hunks` tables for the given commits in one
+    pass. Each batch of commit files is written together with its hunks in a single
+    transaction, so the hunks' foreign keys always find their commit file.
+
+    Args:
+        commits (Iterable[Commit]) - The commits to process.\n
+        parent_folder (str) - The path to the folder containing all organizations.\n
+        max_workers (int) - The number of commits processed concurrently.
+
+    Returns:
+        Tuple[int, int]: The number of commit files and hunks processed.
+    """
+    pending_cfs: List[CommitFile] = []
+    pending_hunks: List[Hunk] = []
+    total_cfs = 0
+    total_hunks = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(build_cfs_and_hunks, com, path.join(parent_folder, com.org_name, com.repo_name)): com
+            for com in commits
+        }
+        for future in as_completed(futures):
+            com = futures[future]
+            try:
+                cfs, hunks = future.result()
+            except Exception as e:
+                print(f"Error processing commit {com.sha}: {e}")
+                continue
+
+            pending_cfs.extend(cfs)
+            pending_hunks.extend(hunks)
+            if len(pending_cfs) >= FLUSH_THRESHOLD:
+                CommitFile.add_cfs_and_hunks_in_batches(pending_cfs, pending_hunks)
+                total_cfs += len(pending_cfs)
+                total_hunks += len(pending_hunks)
+                pending_cfs, pending_hunks = [], []
+
+    if pending_cfs:
+        CommitFile.add_cfs_and_hunks_in_batches(pending_cfs, pending_hunks)
+        total_cfs += len(pending_cfs)
+        total_hunks += len(pending_hunks)
+
+    return total_cfs, total_hunks